@@ -10,6 +10,7 @@ from softwarecenter.enums import (
     CustomKeys,
     XapianValues,
     )
+from softwarecenter.db.database import get_collation_locale, get_sort_key
 from softwarecenter.db.update import index_name
 from softwarecenter.distro import get_distro
 
@@ -73,6 +74,9 @@ class SoftwareCenterMetadataPlugin:
               AT to "application" for applications
             It sets the following xapian values from the software-center
             enums:
+              XapianValues.DOCUMENT_TYPE
+              XapianValues.SORT_KEY
+              XapianValues.SORT_KEY_LOCALE
               XapianValues.ICON
               XapianValues.ICON_NEEDS_DOWNLOAD
               XapianValues.ICON_URL
@@ -104,6 +108,15 @@ class SoftwareCenterMetadataPlugin:
             index_name(document, name, self.indexer)
             # we pretend to be an application
             document.add_term("AT" + "application")
+            document.add_value(XapianValues.DOCUMENT_TYPE, "application")
+            # the sort key for the alphabetical sort, the locale of this
+            # run may be different from the one of the users
+            try:
+                document.add_value(XapianValues.SORT_KEY, get_sort_key(name))
+                document.add_value(XapianValues.SORT_KEY_LOCALE,
+                                   get_collation_locale())
+            except ValueError:
+                pass
             # and we inject a custom component value to indicate "independent"
             document.add_value(XapianValues.ARCHIVE_SECTION, "independent")
         if CustomKeys.ICON in ver.record:
@@ -0,0 +1,223 @@
+# Copyright (C) 2012 Canonical
+#
+# Authors:
+#  Michael Vogt
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""
+A shared http layer for the piston clients
+
+piston_mini_client creates new httplib2.Http objects for every api
+object, so there is no keep-alive between them and every cache lookup
+reads and parses a file of the httplib2 FileCache. The HttpPool hands
+out httplib2.Http objects that are reused (one per thread and set of
+options), each of them keeps its connections to the hosts open. Their
+cache is a HotCache, a size bounded in-memory tier in front of the
+FileCache.
+
+httplib2 revalidates stale cache entries with If-None-Match and
+If-Modified-Since, so a unchanged reply is just a "304 Not Modified"
+over a connection that is already open.
+"""
+
+import httplib2
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+
+from softwarecenter.expunge import ExpungeIndex
+
+LOG = logging.getLogger(__name__)
+
+# the default size of the in-memory tier
+DEFAULT_HOT_CACHE_BYTES = 8 * 1024 * 1024
+
+
+class HotCache(object):
+    """ A httplib2 cache (get/set/delete) that keeps the recently used
+        entries in memory in front of a httplib2.FileCache
+    """
+
+    def __init__(self, file_cache=None, max_bytes=DEFAULT_HOT_CACHE_BYTES):
+        # a httplib2.FileCache or a directory for it
+        if isinstance(file_cache, basestring):
+            file_cache = httplib2.FileCache(file_cache)
+        self.file_cache = file_cache
+        # the files that are written are added to the index of the
+        # ExpungeCache so that it does not need to read them
+        self.expunge_index = None
+        if isinstance(file_cache, httplib2.FileCache):
+            self.expunge_index = ExpungeIndex(file_cache.cache)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def _add(self, key, value):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._nbytes -= len(old)
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._nbytes += len(value)
+        while self._nbytes > self.max_bytes:
+            (evicted_key, evicted) = self._entries.popitem(last=False)
+            self._nbytes -= len(evicted)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                # re-insert to mark it as most recently used
+                self._entries[key] = value
+                self.hits += 1
+                return value
+        if self.file_cache is not None:
+            value = self.file_cache.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._add(key, value)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._add(key, value)
+        if self.file_cache is not None:
+            self.file_cache.set(key, value)
+            if self.expunge_index is not None:
+                self.expunge_index.add(self.file_cache.safe(key),
+                                       value.split("\n", 1)[0])
+
+    def delete(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._nbytes -= len(value)
+        if self.file_cache is not None:
+            self.file_cache.delete(key)
+            if self.expunge_index is not None:
+                self.expunge_index.remove(self.file_cache.safe(key))
+
+    def get_stats(self):
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "entries": len(self._entries),
+                    "bytes": self._nbytes,
+                   }
+
+
+class HttpPool(object):
+    """ Hand out reusable httplib2.Http objects, the call signature is
+        the one of httplib2.Http so it can be used in its place
+    """
+
+    def __init__(self, hot_cache_bytes=DEFAULT_HOT_CACHE_BYTES):
+        self.hot_cache_bytes = hot_cache_bytes
+        self._caches = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_cache(self, file_cache):
+        """ return the shared HotCache for the given httplib2.FileCache
+            or cache directory
+        """
+        if isinstance(file_cache, basestring):
+            cachedir = os.path.abspath(file_cache)
+        else:
+            cachedir = os.path.abspath(file_cache.cache)
+        with self._lock:
+            if cachedir not in self._caches:
+                self._caches[cachedir] = HotCache(
+                    file_cache, self.hot_cache_bytes)
+            return self._caches[cachedir]
+
+    @staticmethod
+    def _get_proxy_key(proxy_info):
+        if proxy_info is None or callable(proxy_info):
+            return proxy_info
+        return (proxy_info.proxy_type, proxy_info.proxy_host,
+                proxy_info.proxy_port)
+
+    def __call__(self, cache=None, **kwargs):
+        if isinstance(cache, (basestring, httplib2.FileCache)):
+            cache = self.get_cache(cache)
+        proxy_info = kwargs.get("proxy_info")
+        key = (id(cache), self._get_proxy_key(proxy_info)) + tuple(
+            sorted((k, v) for (k, v) in kwargs.items() if k != "proxy_info"))
+        # httplib2.Http is not thread-safe, so each thread gets its own
+        pool = getattr(self._local, "pool", None)
+        if pool is None:
+            pool = self._local.pool = {}
+        http = pool.get(key)
+        if http is None:
+            LOG.debug("new http object for '%s'" % (key,))
+            http = httplib2.Http(cache=cache, **kwargs)
+            pool[key] = http
+        elif "proxy_info" in kwargs:
+            http.proxy_info = proxy_info
+        return http
+
+    def close(self):
+        """ close the connections of the http objects of this thread """
+        for http in getattr(self._local, "pool", {}).values():
+            for conn in http.connections.values():
+                conn.close()
+            http.connections.clear()
+
+    def get_stats(self):
+        """ return the stats of the hot caches by cachedir """
+        with self._lock:
+            return dict((cachedir, cache.get_stats())
+                        for (cachedir, cache) in self._caches.items())
+
+
+class _Httplib2WithPool(object):
+    """ The httplib2 module with a HttpPool as its Http """
+
+    def __init__(self, pool):
+        self.Http = pool
+
+    def __getattr__(self, name):
+        return getattr(httplib2, name)
+
+
+_http_pool = None
+
+
+def get_http_pool():
+    global _http_pool
+    if _http_pool is None:
+        _http_pool = HttpPool()
+    return _http_pool
+
+
+def install_http_pool(pool=None):
+    """ make piston_mini_client use the (given or shared) HttpPool for
+        all requests, returns the pool
+    """
+    import piston_mini_client
+    if pool is None:
+        pool = get_http_pool()
+    piston_mini_client.httplib2 = _Httplib2WithPool(pool)
+    return pool
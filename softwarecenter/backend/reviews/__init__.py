@@ -18,9 +18,10 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import array
 import datetime
+import heapq
 import logging
-import operator
 import os
 import random
 import struct
@@ -28,6 +29,7 @@ import shutil
 import subprocess
 import time
 import threading
+import weakref
 
 from bsddb import db as bdb
 
@@ -55,6 +57,13 @@ from softwarecenter.paths import (SOFTWARE_CENTER_CACHE_DIR,
 from softwarecenter.enums import ReviewSortMethods
 
 from softwarecenter.backend.spawn_helper import SpawnHelper
+from softwarecenter.backend.reviews.statsstore import (
+    ReviewStatsStore,
+    ReviewStatsStoreError,
+    append_review_stats_journal,
+    read_review_stats_journal,
+    write_review_stats_store,
+    )
 
 LOG = logging.getLogger(__name__)
 
@@ -75,6 +84,179 @@ class ReviewStats(object):
                 self.rating_spread, self.dampened_rating))
 
 
+class ReviewStatsCache(object):
+    """ A dict like Application -> ReviewStats mapping that is backed by a
+        memory mapped ReviewStatsStore, the ReviewStats objects are only
+        created on lookup. Changes are kept in memory, save() appends them
+        to the journal of the store and writes a new store once the
+        journal gets big.
+    """
+
+    JOURNAL_SUFFIX = ".journal"
+
+    # compact the journal into a new store when it has more records
+    # than this (or than the given fraction of the store records)
+    JOURNAL_COMPACT_MIN = 512
+    JOURNAL_COMPACT_RATIO = 0.25
+
+    def __init__(self, store=None):
+        self._store = store
+        # pkgname -> ReviewStats that override the store
+        self._changes = {}
+        # pkgnames that are changed since the last save
+        self._unsaved = set()
+        self._journal_len = 0
+
+    @classmethod
+    def open(cls, path):
+        """ return the cache for the store at path with its journal
+            applied
+        """
+        stats_cache = cls(ReviewStatsStore(path))
+        for record in read_review_stats_journal(path + cls.JOURNAL_SUFFIX):
+            stats = cls._stats_from_record(record)
+            stats_cache._changes[stats.app.pkgname] = stats
+            stats_cache._journal_len += 1
+        return stats_cache
+
+    @staticmethod
+    def _stats_from_record(record):
+        (pkgname, average, total, spread, dampened) = record
+        stats = ReviewStats(Application("", pkgname))
+        stats.ratings_average = average
+        stats.ratings_total = total
+        if spread is not None:
+            stats.rating_spread = spread
+        stats.dampened_rating = dampened
+        return stats
+
+    @staticmethod
+    def _record_from_stats(pkgname, stats):
+        return (pkgname,
+                stats.ratings_average,
+                stats.ratings_total,
+                getattr(stats, "rating_spread", None),
+                getattr(stats, "dampened_rating", 3.00))
+
+    def get(self, app, default=None):
+        pkgname = app.pkgname
+        if pkgname in self._changes:
+            return self._changes[pkgname]
+        if self._store is not None:
+            record = self._store.get(pkgname)
+            if record is not None:
+                return self._stats_from_record(record)
+        return default
+
+    def __getitem__(self, app):
+        stats = self.get(app)
+        if stats is None:
+            raise KeyError(app)
+        return stats
+
+    def __setitem__(self, app, stats):
+        self._changes[app.pkgname] = stats
+        self._unsaved.add(app.pkgname)
+
+    def update(self, stats_list):
+        """ add the given ReviewStats and return the set of pkgnames
+            whose stats actually changed
+        """
+        changed = set()
+        for stats in stats_list:
+            old = self.get(stats.app)
+            record = self._record_from_stats("", stats)
+            if old is not None and self._record_from_stats("", old) == record:
+                continue
+            self[stats.app] = stats
+            changed.add(stats.app.pkgname)
+        return changed
+
+    def __contains__(self, app):
+        return (app.pkgname in self._changes or
+                (self._store is not None and app.pkgname in self._store))
+
+    def __len__(self):
+        if self._store is None:
+            return len(self._changes)
+        return len(self._store) + len(
+            [p for p in self._changes if p not in self._store])
+
+    def iteritems(self):
+        changes = self._changes.copy()
+        if self._store is not None:
+            for record in self._store:
+                pkgname = record[0]
+                if pkgname in changes:
+                    stats = changes.pop(pkgname)
+                else:
+                    stats = self._stats_from_record(record)
+                yield (stats.app, stats)
+        for stats in changes.values():
+            yield (stats.app, stats)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __iter__(self):
+        for (app, stats) in self.iteritems():
+            yield app
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [stats for (app, stats) in self.iteritems()]
+
+    def has_missing_rating_spread(self):
+        """ return True if there are stats without a rating spread (the
+            histogram data that older servers did not send)
+        """
+        for (app, stats) in self.iteritems():
+            if not getattr(stats, "rating_spread", None):
+                return True
+        return False
+
+    def _needs_compaction(self, path):
+        if self._store is None or self._store.path != path:
+            return True
+        journal_len = self._journal_len + len(self._unsaved)
+        return journal_len > max(self.JOURNAL_COMPACT_MIN,
+                                 self.JOURNAL_COMPACT_RATIO * len(self._store))
+
+    def save(self, path, compact=False):
+        """ save the stats to the store at path, only the unsaved changes
+            are appended to the journal unless compact is given or the
+            journal is too big
+
+            Returns the set of the saved pkgnames or None if the full
+            store got written.
+        """
+        journal = path + self.JOURNAL_SUFFIX
+        if compact or self._needs_compaction(path):
+            write_review_stats_store(path, [
+                    self._record_from_stats(app.pkgname, stats)
+                    for (app, stats) in self.iteritems()])
+            # the old store is not closed explicitly as a query thread
+            # may still iterate over it, it is unmapped once it is unused
+            self._store = ReviewStatsStore(path)
+            self._changes = {}
+            self._unsaved = set()
+            self._journal_len = 0
+            if os.path.exists(journal):
+                os.remove(journal)
+            return None
+        saved = self._unsaved
+        append_review_stats_journal(journal, [
+                self._record_from_stats(pkgname, self._changes[pkgname])
+                for pkgname in saved])
+        self._journal_len += len(saved)
+        self._unsaved = set()
+        # the mtime of the store is the time of the last refresh
+        os.utime(path, None)
+        return saved
+
+
 class UsefulnessCache(object):
 
     USEFULNESS_CACHE = {}
@@ -232,9 +414,14 @@ class ReviewLoader(GObject.GObject):
                                           GObject.TYPE_NONE,
                                           (GObject.TYPE_PYOBJECT,),
                                          ),
+        # the set of pkgnames whose review stats changed
+        "review-stats-changed": (GObject.SIGNAL_RUN_LAST,
+                                 GObject.TYPE_NONE,
+                                 (GObject.TYPE_PYOBJECT,),
+                                ),
     }
 
-    # cache the ReviewStats
+    # cache the ReviewStats (a ReviewStatsCache)
     REVIEW_STATS_CACHE = {}
     _cache_version_old = False
     _review_sort_methods = ReviewSortMethods.REVIEW_SORT_METHODS
@@ -247,33 +434,64 @@ class ReviewLoader(GObject.GObject):
         if not self.distro:
             self.distro = softwarecenter.distro.get_distro()
         fname = "%s_%s" % (uri_to_filename(self.distro.REVIEWS_SERVER),
-                           "review-stats-pkgnames.p")
+                           "review-stats-pkgnames")
         self.REVIEW_STATS_CACHE_FILE = os.path.join(SOFTWARE_CENTER_CACHE_DIR,
-                                                    fname)
+                                                    fname + ".bin")
+        # the pickle of older versions, it is migrated on startup
+        self.REVIEW_STATS_PICKLE_FILE = os.path.join(
+            SOFTWARE_CENTER_CACHE_DIR, fname + ".p")
+        # unity expects the name of the pickle file
         self.REVIEW_STATS_BSDDB_FILE = "%s__%s.%s.db" % (
-            self.REVIEW_STATS_CACHE_FILE,
+            self.REVIEW_STATS_PICKLE_FILE,
             bdb.DB_VERSION_MAJOR,
             bdb.DB_VERSION_MINOR)
 
         self.language = get_languages()[0]
+        # the dampened ratings indexed by docid for each StoreDatabase
+        self._dampened_ratings = weakref.WeakKeyDictionary()
+        self._dampened_ratings_dbs = weakref.WeakSet()
+        self._dampened_ratings_lock = threading.Lock()
+        self.connect("review-stats-changed",
+                     self._on_review_stats_changed)
+        self.REVIEW_STATS_CACHE = ReviewStatsCache()
+        if (os.path.exists(self.REVIEW_STATS_PICKLE_FILE) and
+                not os.path.exists(self.REVIEW_STATS_CACHE_FILE)):
+            self._migrate_review_stats_pickle()
         if os.path.exists(self.REVIEW_STATS_CACHE_FILE):
             try:
-                self.REVIEW_STATS_CACHE = pickle.load(
-                    open(self.REVIEW_STATS_CACHE_FILE))
+                self.REVIEW_STATS_CACHE = ReviewStatsCache.open(
+                    self.REVIEW_STATS_CACHE_FILE)
                 self._cache_version_old = self._missing_histogram_in_cache()
-            except:
+            except (EnvironmentError, ReviewStatsStoreError):
                 LOG.exception("review stats cache load failure")
                 os.rename(self.REVIEW_STATS_CACHE_FILE,
                     self.REVIEW_STATS_CACHE_FILE + ".fail")
 
+    def _migrate_review_stats_pickle(self):
+        """ convert the review stats pickle of older versions into a
+            review stats store
+        """
+        pickle_file = self.REVIEW_STATS_PICKLE_FILE
+        LOG.info("migrating '%s'" % pickle_file)
+        try:
+            stats_cache = ReviewStatsCache()
+            for (app, stats) in pickle.load(open(pickle_file)).iteritems():
+                stats_cache[app] = stats
+            stats_cache.save(self.REVIEW_STATS_CACHE_FILE)
+            # keep the mtime, the next refresh only asks for the changes
+            # since then
+            st = os.stat(pickle_file)
+            os.utime(self.REVIEW_STATS_CACHE_FILE,
+                     (st.st_atime, st.st_mtime))
+            os.remove(pickle_file)
+        except:
+            LOG.exception("review stats pickle migration failure")
+            os.rename(pickle_file, pickle_file + ".fail")
+
     def _missing_histogram_in_cache(self):
         '''iterate through review stats to see if it has been fully reloaded
            with new histogram data from server update'''
-        for app in self.REVIEW_STATS_CACHE.values():
-            result = getattr(app, 'rating_spread', False)
-            if not result:
-                return True
-        return False
+        return self.REVIEW_STATS_CACHE.has_missing_rating_spread()
 
     def get_reviews(self, application, callback, page=1, language=None,
                     sort=0, relaxed=False):
@@ -286,6 +504,59 @@ class ReviewLoader(GObject.GObject):
     def update_review_stats(self, translated_application, stats):
         application = Application("", translated_application.pkgname)
         self.REVIEW_STATS_CACHE[application] = stats
+        self.emit("review-stats-changed", set([application.pkgname]))
+
+    def get_dampened_ratings(self, db):
+        """ return a array.array("d") with the dampened rating of every
+            document of the given StoreDatabase, indexed by docid (docs
+            without review stats are rated 0)
+
+            It is cached until the review stats change or the database
+            is reopened. None is returned if the ratings do not come
+            from the REVIEW_STATS_CACHE.
+        """
+        with self._dampened_ratings_lock:
+            ratings = self._dampened_ratings.get(db)
+            if ratings is None:
+                ratings = self._build_dampened_ratings(db)
+                self._dampened_ratings[db] = ratings
+                if db not in self._dampened_ratings_dbs:
+                    db.connect("reopen", self._on_db_reopen)
+                    self._dampened_ratings_dbs.add(db)
+            return ratings
+
+    def _build_dampened_ratings(self, db):
+        xapiandb = db.xapiandb
+        ratings = array.array("d", [0.0]) * (xapiandb.get_lastdocid() + 1)
+        for (app, stats) in self.REVIEW_STATS_CACHE.iteritems():
+            self._set_dampened_rating(
+                xapiandb, ratings, app.pkgname, stats.dampened_rating)
+        return ratings
+
+    @staticmethod
+    def _set_dampened_rating(xapiandb, ratings, pkgname, rating):
+        # the stats are keyed by pkgname, so rate every doc of the pkg
+        for prefix in ("AP", "XP"):
+            for post in xapiandb.postlist(prefix + pkgname):
+                ratings[post.docid] = rating
+
+    def _on_review_stats_changed(self, loader, pkgnames):
+        """ update the cached dampened ratings of the changed pkgnames """
+        with self._dampened_ratings_lock:
+            for (db, ratings) in self._dampened_ratings.items():
+                for pkgname in pkgnames:
+                    stats = self.REVIEW_STATS_CACHE.get(
+                        Application("", pkgname))
+                    if stats is None:
+                        rating = 0.0
+                    else:
+                        rating = stats.dampened_rating
+                    self._set_dampened_rating(
+                        db.xapiandb, ratings, pkgname, rating)
+
+    def _on_db_reopen(self, db):
+        with self._dampened_ratings_lock:
+            self._dampened_ratings.pop(db, None)
 
     def get_review_stats(self, translated_application):
         """return a ReviewStats (number of reviews, rating)
@@ -295,8 +566,7 @@ class ReviewLoader(GObject.GObject):
         # check cache
         try:
             application = Application("", translated_application.pkgname)
-            if application in self.REVIEW_STATS_CACHE:
-                return self.REVIEW_STATS_CACHE[application]
+            return self.REVIEW_STATS_CACHE.get(application)
         except ValueError:
             pass
 
@@ -317,13 +587,13 @@ class ReviewLoader(GObject.GObject):
             self._save_review_stats_cache_blocking()
 
     def _save_review_stats_cache_blocking(self):
-        # dump out for software-center in simple pickle
-        self._dump_pickle_for_sc()
+        # dump out for software-center as a review stats store
+        pkgnames = self._dump_store_for_sc()
         # dump out in c-friendly dbm format for unity
         try:
             outfile = self.REVIEW_STATS_BSDDB_FILE
             outdir = self.REVIEW_STATS_BSDDB_FILE + ".dbenv/"
-            self._dump_bsddbm_for_unity(outfile, outdir)
+            self._dump_bsddbm_for_unity(outfile, outdir, pkgnames)
         except bdb.DBError as e:
             # see bug #858437, db corruption seems to be rather common
             # on ecryptfs
@@ -334,15 +604,20 @@ class ReviewLoader(GObject.GObject):
             except:
                 LOG.exception("trying to repair DB failed")
 
-    def _dump_pickle_for_sc(self):
-        """ write out the full REVIEWS_STATS_CACHE as a pickle """
-        pickle.dump(self.REVIEW_STATS_CACHE,
-                      open(self.REVIEW_STATS_CACHE_FILE, "w"))
+    def _dump_store_for_sc(self):
+        """ write out the changes of the REVIEWS_STATS_CACHE to the
+            review stats store, returns the set of written pkgnames or
+            None if the full store got written
+        """
+        return self.REVIEW_STATS_CACHE.save(self.REVIEW_STATS_CACHE_FILE)
 
-    def _dump_bsddbm_for_unity(self, outfile, outdir):
+    def _dump_bsddbm_for_unity(self, outfile, outdir, pkgnames=None):
         """ write out the subset that unity needs of the REVIEW_STATS_CACHE
-            as a C friendly (using struct) bsddb
+            as a C friendly (using struct) bsddb, if pkgnames is given
+            only those are updated in a existing bsddb
         """
+        if not os.path.exists(outfile):
+            pkgnames = None
         env = bdb.DBEnv()
         if not os.path.exists(outdir):
             os.makedirs(outdir)
@@ -355,7 +630,13 @@ class ReviewLoader(GObject.GObject):
                 dbtype=bdb.DB_HASH,
                 mode=0600,
                 flags=bdb.DB_CREATE)
-        for (app, stats) in self.REVIEW_STATS_CACHE.iteritems():
+        if pkgnames is None:
+            items = self.REVIEW_STATS_CACHE.iteritems()
+        else:
+            items = [(Application("", pkgname),
+                      self.REVIEW_STATS_CACHE[Application("", pkgname)])
+                     for pkgname in pkgnames]
+        for (app, stats) in items:
             # pkgname is ascii by policy, so its fine to use str() here
             db[str(app.pkgname)] = struct.pack('iii',
                                                stats.ratings_average or 0,
@@ -372,32 +653,15 @@ class ReviewLoader(GObject.GObject):
         cache = self.REVIEW_STATS_CACHE
 
         if category:
-            applist = self._get_apps_for_category(category)
+            applist = set(self._get_apps_for_category(category))
             cache = self._filter_cache_with_applist(cache, applist)
 
-        #create a list of tuples with (Application,dampened_rating)
-        dr_list = []
-        for item in cache.items():
-            if hasattr(item[1], 'dampened_rating'):
-                dr_list.append((item[0], item[1].dampened_rating))
-            else:
-                dr_list.append((item[0], 3.00))
-
-        #sorted the list descending by dampened rating
-        sorted_dr_list = sorted(dr_list, key=operator.itemgetter(1),
-                                reverse=True)
-
-        #return the quantity requested or as much as we can
-        if quantity < len(sorted_dr_list):
-            return_qty = quantity
-        else:
-            return_qty = len(sorted_dr_list)
-
-        top_rated = []
-        for i in range(0, return_qty):
-            top_rated.append(sorted_dr_list[i][0])
-
-        return top_rated
+        # only the top "quantity" items are needed, so there is no need
+        # to sort the full list (ties keep the order of a full sort)
+        top_rated = heapq.nlargest(
+            quantity, cache.iteritems(),
+            key=lambda item: getattr(item[1], 'dampened_rating', 3.00))
+        return [app for (app, stats) in top_rated]
 
     def _filter_cache_with_applist(self, cache, applist):
         """Take the review cache and filter it to only include the apps that
@@ -511,6 +775,10 @@ class ReviewLoaderFake(ReviewLoader):
         review_stats = []
         callback(review_stats)
 
+    def get_dampened_ratings(self, db):
+        # the stats do not come from the REVIEW_STATS_CACHE
+        return None
+
 
 class ReviewLoaderFortune(ReviewLoaderFake):
     def __init__(self, cache, db):
@@ -668,6 +936,10 @@ class ReviewLoaderNull(ReviewLoader):
         review_stats = []
         callback(review_stats)
 
+    def get_dampened_ratings(self, db):
+        # the stats do not come from the REVIEW_STATS_CACHE
+        return None
+
 
 review_loader = None
 
@@ -29,6 +29,7 @@ from softwarecenter.backend.reviews import (
                                             Review,
                                             ReviewStats,
                                             UsefulnessCache,
+                                            ReviewStatsCache,
                                             )
 from softwarecenter.backend.piston.rnrclient import RatingsAndReviewsAPI
 from softwarecenter.backend.piston.rnrclient_pristine import ReviewDetails
@@ -161,12 +162,13 @@ class ReviewLoaderSpawningRNRClient(ReviewLoader):
 
         if self._cache_version_old and self._server_has_histogram(
             piston_review_stats):
-            self.REVIEW_STATS_CACHE = {}
+            self.REVIEW_STATS_CACHE = ReviewStatsCache()
             self.save_review_stats_cache_file()
             self.refresh_review_stats(callback)
             return
 
         # convert to the format that s-c uses
+        stats_list = []
         for r in piston_review_stats:
             s = ReviewStats(Application("", r.package_name))
             s.ratings_average = float(r.ratings_average)
@@ -176,9 +178,15 @@ class ReviewLoaderSpawningRNRClient(ReviewLoader):
             else:
                 s.rating_spread = [0, 0, 0, 0, 0]
             s.dampened_rating = calc_dr(s.rating_spread)
-            review_stats[s.app] = s
+            stats_list.append(s)
+        # the server sends all the stats of the last days, only the
+        # changed ones need to be redrawn and saved
+        changed = review_stats.update(stats_list)
+        LOG.debug("review stats of %i pkgs changed" % len(changed))
         self.REVIEW_STATS_CACHE = review_stats
         callback(review_stats)
+        if changed:
+            self.emit("review-stats-changed", changed)
         self.emit("refresh-review-stats-finished", review_stats)
         self.save_review_stats_cache_file()
 
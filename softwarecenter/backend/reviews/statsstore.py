@@ -0,0 +1,264 @@
+# Copyright (C) 2012 Canonical
+#
+# Authors:
+#  Michael Vogt
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""
+A compact, read-only review stats store that is memory mapped
+
+The file layout (all integers little endian) is simple enough to be
+read from C as well:
+
+  header:  char magic[4] = "SCRS"
+           uint32 version
+           uint32 nr_records
+           uint32 names_offset
+  records: nr_records fixed size records, sorted by pkgname
+           uint32 name_offset      (relative to names_offset)
+           uint16 name_length
+           uint16 flags            (HAS_SPREAD, HAS_AVERAGE)
+           double ratings_average
+           uint32 ratings_total
+           uint32 rating_spread[5]
+           double dampened_rating
+  names:   the utf-8 pkgnames, not terminated
+
+Changes after the store was written are appended to a journal file
+instead of rewriting the whole store, each entry is:
+
+           uint16 name_length
+           uint16 flags
+           double ratings_average
+           uint32 ratings_total
+           uint32 rating_spread[5]
+           double dampened_rating
+           char name[name_length]
+
+A later entry for the same pkgname overrides the earlier one. Once the
+journal is big it is compacted into a new store.
+"""
+
+import logging
+import mmap
+import os
+import struct
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = "SCRS"
+VERSION = 1
+
+HEADER = struct.Struct("<4sIII")
+RECORD = struct.Struct("<IHHdI5Id")
+JOURNAL_RECORD = struct.Struct("<HHdI5Id")
+
+# record flags
+HAS_SPREAD = 1 << 0
+HAS_AVERAGE = 1 << 1
+
+
+class ReviewStatsStoreError(Exception):
+    pass
+
+
+def _pack_values(average, total, spread, dampened):
+    """ return the flags and the packed values of a record """
+    flags = 0
+    if spread:
+        flags |= HAS_SPREAD
+    else:
+        spread = [0, 0, 0, 0, 0]
+    if average is not None:
+        flags |= HAS_AVERAGE
+    else:
+        average = 0.0
+    return (flags, float(average), int(total or 0)) + tuple(
+        [int(s) for s in spread] + [float(dampened)])
+
+
+def _unpack_values(values):
+    """ return (ratings_average, ratings_total, rating_spread,
+        dampened_rating) from the unpacked flags and values
+    """
+    flags = values[0]
+    if flags & HAS_AVERAGE:
+        average = values[1]
+    else:
+        average = None
+    if flags & HAS_SPREAD:
+        spread = list(values[3:8])
+    else:
+        spread = None
+    return (average, values[2], spread, values[8])
+
+
+def _encode(pkgname):
+    if isinstance(pkgname, unicode):
+        return pkgname.encode("utf-8")
+    return pkgname
+
+
+def write_review_stats_store(path, records):
+    """ write the given records as a new store to path, records is a
+        iterable of (pkgname, ratings_average, ratings_total,
+        rating_spread, dampened_rating) tuples, ratings_average and
+        rating_spread may be None
+
+        The file is replaced atomically so that readers that have the
+        old file mapped are not affected.
+    """
+    records = sorted(records)
+    names = []
+    packed = []
+    names_len = 0
+    for (pkgname, average, total, spread, dampened) in records:
+        name = _encode(pkgname)
+        packed.append(RECORD.pack(names_len, len(name), *_pack_values(
+                    average, total, spread, dampened)))
+        names.append(name)
+        names_len += len(name)
+    tmp_path = path + ".new"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(packed),
+                            HEADER.size + RECORD.size * len(packed)))
+        f.write("".join(packed))
+        f.write("".join(names))
+    os.rename(tmp_path, path)
+
+
+def append_review_stats_journal(path, records):
+    """ append the given records (see write_review_stats_store) to the
+        journal at path
+    """
+    data = []
+    for (pkgname, average, total, spread, dampened) in records:
+        name = _encode(pkgname)
+        data.append(JOURNAL_RECORD.pack(len(name), *_pack_values(
+                    average, total, spread, dampened)))
+        data.append(name)
+    with open(path, "ab") as f:
+        f.write("".join(data))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_review_stats_journal(path):
+    """ return the list of records in the journal at path, a truncated
+        last record (e.g. from a crash while writing) is cut off
+    """
+    records = []
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except IOError:
+        return records
+    offset = 0
+    while offset + JOURNAL_RECORD.size <= len(data):
+        values = JOURNAL_RECORD.unpack_from(data, offset)
+        start = offset + JOURNAL_RECORD.size
+        end = start + values[0]
+        if end > len(data):
+            break
+        records.append((data[start:end],) + _unpack_values(values[1:]))
+        offset = end
+    if offset != len(data):
+        LOG.warn("removing truncated record from '%s'" % path)
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+    return records
+
+
+class ReviewStatsStore(object):
+    """ Read-only access to a review stats store, the lookup of a
+        pkgname is a binary search in the mapped file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mmap = None
+        self._count = 0
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ReviewStatsStoreError("'%s' is truncated" % path)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, count, names_offset) = HEADER.unpack_from(
+            self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ReviewStatsStoreError(
+                "'%s' is not a review stats store (version %s)" % (
+                    path, VERSION))
+        if names_offset != HEADER.size + RECORD.size * count:
+            self.close()
+            raise ReviewStatsStoreError("'%s' is corrupted" % path)
+        self._count = count
+        self._names_offset = names_offset
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _get_record(self, i):
+        return RECORD.unpack_from(self._mmap, HEADER.size + RECORD.size * i)
+
+    def _get_pkgname(self, record):
+        start = self._names_offset + record[0]
+        return self._mmap[start:start + record[1]]
+
+    def _find(self, pkgname):
+        """ return the record of pkgname or None """
+        pkgname = _encode(pkgname)
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self._get_record(mid)
+            name = self._get_pkgname(record)
+            if name < pkgname:
+                lo = mid + 1
+            elif name > pkgname:
+                hi = mid
+            else:
+                return record
+        return None
+
+    @staticmethod
+    def _to_tuple(pkgname, record):
+        return (pkgname,) + _unpack_values(record[2:])
+
+    def __contains__(self, pkgname):
+        return self._find(pkgname) is not None
+
+    def get(self, pkgname):
+        """ return the (pkgname, ratings_average, ratings_total,
+            rating_spread, dampened_rating) tuple for pkgname or None
+        """
+        record = self._find(pkgname)
+        if record is None:
+            return None
+        return self._to_tuple(pkgname, record)
+
+    def __iter__(self):
+        """ iterate over all the records (in pkgname order) """
+        for i in range(self._count):
+            record = self._get_record(i)
+            yield self._to_tuple(self._get_pkgname(record), record)
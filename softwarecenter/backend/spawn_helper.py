@@ -26,9 +26,11 @@ try:
 except ImportError:
     import pickle
 
+import errno
 import logging
 import os
 import json
+import struct
 
 import softwarecenter.paths
 from softwarecenter.paths import PistonHelpers
@@ -37,6 +39,194 @@ from gi.repository import GObject
 
 LOG = logging.getLogger(__name__)
 
+# the frames of the piston helper daemon protocol are a pickled dict
+# prefixed with its length
+FRAME_HEADER = struct.Struct("!I")
+
+# the size of the reads from the helper pipes
+READ_SIZE = 64 * 1024
+
+
+def pack_frame(obj):
+    """ return the frame for obj """
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+class FrameDecoder(object):
+    """ Decode the frames of a stream that arrives in chunks """
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        # the size of the next frame once its header is known
+        self._needed = FRAME_HEADER.size
+
+    def feed(self, data):
+        """ add data and return the list of complete frames """
+        self._chunks.append(data)
+        self._size += len(data)
+        frames = []
+        # only join the chunks once the whole frame is there
+        while self._size >= self._needed:
+            buf = "".join(self._chunks)
+            (length,) = FRAME_HEADER.unpack_from(buf)
+            end = FRAME_HEADER.size + length
+            if len(buf) < end:
+                self._chunks = [buf]
+                self._needed = end
+                break
+            frames.append(pickle.loads(buf[FRAME_HEADER.size:end]))
+            self._chunks = [buf[end:]]
+            self._size = len(buf) - end
+            self._needed = FRAME_HEADER.size
+        return frames
+
+
+def write_all(fd, data):
+    """ write all of data to the fd """
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+class PistonHelperDaemon(object):
+    """ A long running piston_generic_helper that runs the requests of
+        all SpawnHelpers, so the piston and sso modules are only loaded
+        once and the http connections and the oauth token are reused
+
+        Requests and responses are frames on the stdin and stdout of the
+        helper and are matched by their id, so requests of different
+        SpawnHelpers can be in flight at the same time. If the helper
+        dies it is restarted and the pending requests are sent again
+        (once).
+    """
+
+    MAX_RETRIES = 1
+
+    def __init__(self):
+        self._pid = None
+        self._stdin = None
+        self._stdout = None
+        self._io_watch = None
+        self._decoder = None
+        self._next_id = 0
+        # request id -> [spawn_helper, request, retries]
+        self._pending = {}
+
+    @property
+    def running(self):
+        return self._pid is not None
+
+    def _start(self):
+        binary = os.path.join(
+            softwarecenter.paths.datadir, PistonHelpers.GENERIC_HELPER)
+        cmd = [binary, "--datadir", softwarecenter.paths.datadir, "--daemon"]
+        try:
+            (pid, stdin, stdout, stderr) = GObject.spawn_async(
+                cmd, flags=GObject.SPAWN_DO_NOT_REAP_CHILD,
+                standard_input=True, standard_output=True)
+        except Exception as e:
+            LOG.warn("can not start piston helper daemon: '%s'" % e)
+            return False
+        LOG.debug("running piston helper daemon as pid: '%s'" % pid)
+        self._pid = pid
+        self._stdin = stdin
+        self._stdout = stdout
+        self._decoder = FrameDecoder()
+        GObject.child_watch_add(pid, self._on_daemon_exited)
+        self._io_watch = GObject.io_add_watch(
+            stdout, GObject.IO_IN | GObject.IO_HUP, self._on_io_ready)
+        return True
+
+    def submit(self, spawn_helper, request):
+        """ send the request of spawn_helper to the daemon, returns False
+            if the daemon can not be started
+        """
+        if not self.running and not self._start():
+            return False
+        self._next_id += 1
+        request["id"] = self._next_id
+        self._pending[request["id"]] = [spawn_helper, request, 0]
+        self._send(request)
+        return True
+
+    def _send(self, request):
+        try:
+            write_all(self._stdin, pack_frame(request))
+        except OSError as e:
+            # the child watch takes care of the pending requests
+            if e.errno != errno.EPIPE:
+                raise
+            LOG.warn("piston helper daemon went away")
+
+    def _on_io_ready(self, source, condition):
+        data = ""
+        if condition & GObject.IO_IN:
+            data = os.read(self._stdout, READ_SIZE)
+        if not data:
+            self._io_watch = None
+            return False
+        for response in self._decoder.feed(data):
+            self._dispatch(response)
+        return True
+
+    def _dispatch(self, response):
+        entry = self._pending.pop(response["id"], None)
+        if entry is None:
+            LOG.warn("response for unknown request '%s'" % response["id"])
+            return
+        entry[0]._on_daemon_response(response)
+
+    def _on_daemon_exited(self, pid, status):
+        if pid != self._pid:
+            # a daemon that was already replaced
+            GObject.spawn_close_pid(pid)
+            return
+        LOG.warn("piston helper daemon '%s' exited with '%s'" % (pid, status))
+        # process the responses that are still in the pipe
+        if self._io_watch is not None:
+            GObject.source_remove(self._io_watch)
+            self._io_watch = None
+            while True:
+                data = os.read(self._stdout, READ_SIZE)
+                if not data:
+                    break
+                for response in self._decoder.feed(data):
+                    self._dispatch(response)
+        os.close(self._stdin)
+        os.close(self._stdout)
+        GObject.spawn_close_pid(pid)
+        self._pid = self._stdin = self._stdout = self._decoder = None
+        pending = sorted(self._pending.values(),
+                         key=lambda entry: entry[1]["id"])
+        self._pending = {}
+        # a single new daemon gets all the requests that can be retried
+        started = (any(retries < self.MAX_RETRIES
+                       for (spawn_helper, request, retries) in pending) and
+                   self._start())
+        for (spawn_helper, request, retries) in pending:
+            if started and retries < self.MAX_RETRIES:
+                self._pending[request["id"]] = [
+                    spawn_helper, request, retries + 1]
+                self._send(request)
+            else:
+                spawn_helper._on_daemon_response(
+                    {"id": request["id"],
+                     "status": "error",
+                     "data": "piston helper exited with '%s'" % status,
+                    })
+
+
+_piston_helper_daemon = None
+
+
+def get_piston_helper_daemon():
+    global _piston_helper_daemon
+    if _piston_helper_daemon is None:
+        _piston_helper_daemon = PistonHelperDaemon()
+    return _piston_helper_daemon
+
 
 class SpawnHelper(GObject.GObject):
 
@@ -55,6 +245,9 @@ class SpawnHelper(GObject.GObject):
                  ),
         }
 
+    # run the generic piston helper calls in the shared daemon
+    use_daemon = True
+
     def __init__(self, format="pickle"):
         super(SpawnHelper, self).__init__()
         self._expect_format = format
@@ -68,6 +261,10 @@ class SpawnHelper(GObject.GObject):
         self.parent_xid = None
 
     def run_generic_piston_helper(self, klass, func, **kwargs):
+        if (self.use_daemon and
+                "SOFTWARE_CENTER_DISABLE_PISTON_DAEMON" not in os.environ):
+            if self._run_in_daemon(klass, func, kwargs):
+                return
         binary = os.path.join(
             softwarecenter.paths.datadir, PistonHelpers.GENERIC_HELPER)
         cmd = [binary]
@@ -85,6 +282,35 @@ class SpawnHelper(GObject.GObject):
         LOG.debug("run_generic_piston_helper()")
         self.run(cmd)
 
+    def _run_in_daemon(self, klass, func, kwargs):
+        # only useful for debugging
+        if "SOFTWARE_CENTER_DISABLE_SPAWN_HELPER" in os.environ:
+            return True
+        self._cmd = (klass, func, kwargs)
+        request = {"klass": klass,
+                   "func": func,
+                   "kwargs": kwargs,
+                   "needs_auth": self.needs_auth,
+                   "ignore_cache": self.ignore_cache,
+                   "parent_xid": self.parent_xid,
+                   "output": self._expect_format,
+                  }
+        LOG.debug("run_generic_piston_helper() in daemon")
+        return get_piston_helper_daemon().submit(self, request)
+
+    def _on_daemon_response(self, response):
+        if response["status"] == "ok":
+            if response["data"] is not None:
+                self._stdout = response["data"]
+                self._emit_data(response["data"])
+            self.emit("exited", 0)
+        else:
+            err = response["data"]
+            self._stderr = err
+            LOG.warn("got error from helper for '%s': '%s'" % (
+                self._cmd, err))
+            self.emit("error", err)
+
     def run(self, cmd):
         # only useful for debugging
         if "SOFTWARE_CENTER_DISABLE_SPAWN_HELPER" in os.environ:
@@ -123,14 +349,19 @@ class SpawnHelper(GObject.GObject):
 
     def _helper_io_ready(self, source, condition, (stdout,)):
         # read the raw data
-        data = ""
+        chunks = []
         while True:
-            s = os.read(stdout, 1024)
+            s = os.read(stdout, READ_SIZE)
             if not s:
                 break
-            data += s
+            chunks.append(s)
         os.close(stdout)
+        data = "".join(chunks)
         self._stdout = data
+        self._emit_data(data)
+        return False
+
+    def _emit_data(self, data):
         if self._expect_format == "pickle":
             # unpickle it, we should *always* get valid data here, so if
             # we don't this should raise a error
@@ -149,4 +380,3 @@ class SpawnHelper(GObject.GObject):
             LOG.error("unknown format: '%s'", self._expect_format)
         LOG.debug("got data for cmd: '%s'='%s'" % (self._cmd, data))
         self.emit("data-available", data)
-        return False
@@ -1,9 +1,15 @@
+import logging
+import threading
+import weakref
 import xapian
 
 from softwarecenter.distro import get_distro
 from softwarecenter.enums import (XapianValues,
                                   AVAILABLE_FOR_PURCHASE_MAGIC_CHANNEL_NAME,
                                   )
+from softwarecenter.utils import ExecutionTime
+
+LOG = logging.getLogger(__name__)
 
 
 class GlobalFilter(object):
@@ -63,6 +69,19 @@ class AppFilter(xapian.MatchDecider):
     def get_supported_only(self):
         return global_filter.supported_only
 
+    def get_state(self):
+        """ return a hashable representation of the filter settings
+            (e.g. to use it as part of a cache key)
+        """
+        restricted_list = self.restricted_list
+        if restricted_list is not False:
+            restricted_list = frozenset(restricted_list)
+        return (self.available_only,
+                global_filter.supported_only,
+                self.installed_only,
+                self.not_installed_only,
+                restricted_list)
+
     def __eq__(self, other):
         if self is None and other is not None:
             return True
@@ -76,8 +95,41 @@ class AppFilter(xapian.MatchDecider):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def get_query(self):
+        """ return a boolean xapian.Query that selects the documents that
+            pass this filter, it can be combined with OP_FILTER instead
+            of using the filter as a (slow) MatchDecider
+        """
+        index = get_filter_index(self.db, self.cache)
+        queries = []
+        if self.available_only:
+            queries.append((xapian.Query.OP_AND_NOT,
+                            index.get_unavailable_query()))
+        if self.installed_only:
+            queries.append((xapian.Query.OP_FILTER,
+                            index.get_installed_query()))
+        if self.not_installed_only:
+            queries.append((xapian.Query.OP_AND_NOT,
+                            index.get_installed_query()))
+        if global_filter.supported_only:
+            queries.append((xapian.Query.OP_FILTER,
+                            index.get_supported_query()))
+        if self.restricted_list is not False:
+            queries.append((xapian.Query.OP_FILTER,
+                            get_query_for_pkgnames(self.restricted_list)))
+        # everything, the queries above are then applied to it
+        query = xapian.Query("")
+        for (op, subquery) in queries:
+            query = xapian.Query(op, query, subquery)
+        return query
+
     def __call__(self, doc):
-        """return True if the package should be displayed"""
+        """return True if the package should be displayed
+
+           This is not used as a MatchDecider by the searches anymore,
+           they use get_query(). It is kept as the reference the query
+           is tested against in test_filter_query_matches_decider.
+        """
         # get pkgname from document
         pkgname = self.db.get_pkgname(doc)
         #logging.debug(
@@ -122,3 +174,128 @@ class AppFilter(xapian.MatchDecider):
         self.installed_only = False
         self.not_installed_only = False
         self.restricted_list = False
+
+
+def get_query_for_pkgnames(pkgnames):
+    """ return a xapian.Query that matches the documents of all the
+        given pkgnames (both app-install-data and apt-xapian-index docs)
+    """
+    terms = []
+    for pkgname in pkgnames:
+        terms.append("AP" + pkgname)
+        terms.append("XP" + pkgname)
+    return xapian.Query(xapian.Query.OP_OR, terms)
+
+
+class AppFilterIndex(object):
+    """
+    The pkgnames of a database split by their installed and available
+    state. This is what AppFilter.get_query() uses to build boolean
+    queries, so the apt cache is only consulted once per pkgname and not
+    for each matched document of each query. The supported state is in
+    the index already (the origin terms), so the query of the distro is
+    used for it.
+
+    The sets are computed on first use. When the apt cache is reopened
+    (e.g. after a transaction or a apt-get update) they are computed
+    again, a database reopen drops everything.
+    """
+
+    def __init__(self, db, cache):
+        self.db = db
+        self.cache = cache
+        self.distro = get_distro()
+        # the queries run in threads
+        self._lock = threading.RLock()
+        self._reset()
+        db.connect("reopen", self._on_db_reopen)
+        cache.connect("cache-ready", self._on_cache_ready)
+
+    def _reset(self):
+        self._pkgnames = None
+        self._reset_cache_state()
+
+    def _reset_cache_state(self):
+        self._installed = None
+        self._unavailable = None
+        self._queries = {}
+
+    def _is_installed(self, pkgname):
+        return pkgname in self.cache and self.cache[pkgname].is_installed
+
+    def _is_available(self, pkgname):
+        return pkgname in self.cache
+
+    def get_pkgnames(self):
+        """ return the set of all pkgnames in the database """
+        with self._lock:
+            if self._pkgnames is None:
+                xapiandb = self.db.xapiandb
+                pkgnames = set()
+                for prefix in ("AP", "XP"):
+                    for item in xapiandb.allterms(prefix):
+                        pkgnames.add(item.term[len(prefix):])
+                self._pkgnames = pkgnames
+            return self._pkgnames
+
+    def _get_set(self, attr, predicate):
+        with self._lock:
+            if getattr(self, attr) is None:
+                with ExecutionTime("AppFilterIndex %s" % attr):
+                    setattr(self, attr, set(
+                        pkgname for pkgname in self.get_pkgnames()
+                        if predicate(pkgname)))
+            return getattr(self, attr)
+
+    def get_installed(self):
+        return self._get_set("_installed", self._is_installed)
+
+    def get_unavailable(self):
+        return self._get_set("_unavailable",
+                             lambda p: not self._is_available(p))
+
+    def get_installed_query(self):
+        with self._lock:
+            if "installed" not in self._queries:
+                self._queries["installed"] = get_query_for_pkgnames(
+                    self.get_installed())
+            return self._queries["installed"]
+
+    def get_supported_query(self):
+        return self.distro.get_supported_query()
+
+    def get_unavailable_query(self):
+        """ the docs that are not available, items that are available
+            for purchase are always available
+        """
+        with self._lock:
+            if "unavailable" not in self._queries:
+                self._queries["unavailable"] = xapian.Query(
+                    xapian.Query.OP_AND_NOT,
+                    get_query_for_pkgnames(self.get_unavailable()),
+                    xapian.Query(
+                        "AH" + AVAILABLE_FOR_PURCHASE_MAGIC_CHANNEL_NAME))
+            return self._queries["unavailable"]
+
+    def _on_db_reopen(self, db):
+        with self._lock:
+            self._reset()
+
+    def _on_cache_ready(self, cache):
+        # pkgs may got installed, removed or (after a apt-get update)
+        # available or unavailable
+        with self._lock:
+            self._reset_cache_state()
+
+
+# one index per StoreDatabase
+_filter_indexes = weakref.WeakKeyDictionary()
+_filter_indexes_lock = threading.Lock()
+
+
+def get_filter_index(db, cache):
+    """ return the AppFilterIndex for the given StoreDatabase """
+    with _filter_indexes_lock:
+        if db not in _filter_indexes:
+            _filter_indexes[db] = AppFilterIndex(db, cache)
+        return _filter_indexes[db]
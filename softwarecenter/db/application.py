@@ -16,7 +16,7 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
-from gi.repository import GObject, Gio
+from gi.repository import GObject
 
 import json
 import locale
@@ -33,7 +33,8 @@ from softwarecenter.enums import PkgStates, XapianValues, Icons
 from softwarecenter.paths import (APP_INSTALL_CHANNELS_PATH,
                                   SOFTWARE_CENTER_ICON_CACHE_DIR,
                                   )
-from softwarecenter.utils import utf8, split_icon_ext, capitalize_first_word
+from softwarecenter.utils import (utf8, split_icon_ext, capitalize_first_word,
+                                 get_download_scheduler)
 from softwarecenter.region import get_region_cached, REGIONTAG
 
 LOG = logging.getLogger(__name__)
@@ -642,12 +643,8 @@ class AppDetails(GObject.GObject):
         # download it
         distro = self._distro
         url = distro.SCREENSHOT_JSON_URL % self._app.pkgname
-        try:
-            f = Gio.File.new_for_uri(url)
-            f.load_contents_async(
-                None, self._gio_screenshots_json_download_complete_cb, None)
-        except:
-            LOG.exception("failed to load content")
+        get_download_scheduler().download(
+            url, self._screenshots_json_download_complete_cb)
 
     def _sort_screenshots_by_best_version(self, screenshot_list):
         """ take a screenshot result dict from screenshots.debian.org
@@ -667,10 +664,9 @@ class AppDetails(GObject.GObject):
                                              b["version"] or ''),
             reverse=True)
 
-    def _gio_screenshots_json_download_complete_cb(self, source, result, path):
-        try:
-            res, content, etag = source.load_contents_finish(result)
-        except GObject.GError:
+    def _screenshots_json_download_complete_cb(self, url, content, etag,
+                                              error):
+        if error is not None:
             # ignore read errors, most likely transient
             return
         if content is not None:
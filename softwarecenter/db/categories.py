@@ -23,6 +23,7 @@ import locale
 import logging
 import os
 import string
+import weakref
 import xapian
 
 from xml.etree import ElementTree as ET
@@ -88,15 +89,20 @@ def categories_sorted_by_name(categories):
 
 
 def get_query_for_category(db, untranslated_category_name):
-    cat_parser = CategoriesParser(db)
-    categories = cat_parser.parse_applications_menu(APP_INSTALL_PATH)
-    for c in categories:
-        if untranslated_category_name == c.untranslated_name:
-            query = c.query
-            return query
+    cat = get_category_registry().get_category_by_name(
+        db, untranslated_category_name)
+    if cat is not None:
+        return cat.query
     return False
 
 
+def get_menu_files(datadir):
+    """ return the menu file and the menu drop ins of datadir """
+    menu_files = [datadir + "/desktop/software-center.menu"]
+    menu_files += glob.glob(datadir + "/menu.d/*.menu")
+    return menu_files
+
+
 class Category(GObject.GObject):
     """represents a menu category"""
     def __init__(self, untranslated_name, name, iconname, query,
@@ -258,9 +264,7 @@ class CategoriesParser(object):
         """ parse a application menu and return a list of Category objects """
         categories = []
         # we support multiple menu files and menu drop ins
-        menu_files = [datadir + "/desktop/software-center.menu"]
-        menu_files += glob.glob(datadir + "/menu.d/*.menu")
-        for f in menu_files:
+        for f in get_menu_files(datadir):
             if not os.path.exists(f):
                 continue            
             tree = ET.parse(f)
@@ -520,6 +524,74 @@ class CategoriesParser(object):
         return
 
 
+class CategoryRegistry(object):
+    """ A process wide cache of the parsed menu files, so that the views
+        and stores share the categories and their queries instead of
+        parsing the menu each on their own
+
+        The categories of a datadir are parsed again once a menu file,
+        the locale or the region changed. This is checked by
+        get_categories(), get_category_by_name() is called a lot (e.g.
+        for each row) so it uses the categories of the last check. The
+        returned categories are shared, they must not be modified.
+    """
+
+    def __init__(self):
+        # db -> {datadir: (key, categories, categories by untranslated name)}
+        self._entries = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _get_key(datadir):
+        mtimes = []
+        for f in get_menu_files(datadir):
+            try:
+                mtimes.append((f, os.path.getmtime(f)))
+            except OSError:
+                pass
+        return (tuple(mtimes),
+                locale.setlocale(locale.LC_MESSAGES, None),
+                os.environ.get("LANGUAGE"),
+                get_region_cached()["countrycode"])
+
+    def _get_entry(self, db, datadir, validate=True):
+        entries = self._entries.setdefault(db, {})
+        entry = entries.get(datadir)
+        if entry is not None and not validate:
+            return entry
+        key = self._get_key(datadir)
+        if entry is None or entry[0] != key:
+            categories = CategoriesParser(db).parse_applications_menu(datadir)
+            by_name = dict((cat.untranslated_name, cat) for cat in categories)
+            entry = entries[datadir] = (key, categories, by_name)
+        return entry
+
+    def get_categories(self, db, datadir=APP_INSTALL_PATH):
+        """ return the list of top level Category objects of datadir """
+        return self._get_entry(db, datadir)[1]
+
+    def get_category_by_name(self, db, untranslated_name,
+                             datadir=APP_INSTALL_PATH):
+        """ return the top level Category with the given untranslated name
+            or None
+        """
+        return self._get_entry(db, datadir, validate=False)[2].get(
+            untranslated_name)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_category_registry = None
+
+
+def get_category_registry():
+    """ get the global CategoryRegistry singleton object """
+    global _category_registry
+    if _category_registry is None:
+        _category_registry = CategoryRegistry()
+    return _category_registry
+
+
 # static category mapping for the tiles
 
 category_cat = {
@@ -59,6 +59,16 @@ def parse_axi_values_file(filename="/var/lib/apt-xapian-index/values"):
     return axi_values
 
 
+def get_collation_locale():
+    """ return the name of the locale that is used by locale.strxfrm() """
+    return locale.setlocale(locale.LC_COLLATE)
+
+
+def get_sort_key(name):
+    """ return the locale collation key for the given display name """
+    return locale.strxfrm(name)
+
+
 class SearchQuery(list):
     """ a list wrapper for a search query. it can take a search string
         or a list of search strings
@@ -90,13 +100,24 @@ class SearchQuery(list):
 
 
 class LocaleSorter(xapian.KeyMaker):
-    """ Sort in a locale friendly way by using locale.xtrxfrm """
+    """ Sort in a locale friendly way by using locale.xtrxfrm, the
+        precomputed sort key of a document is used if it was created
+        for the current locale
+    """
     def __init__(self, db):
         super(LocaleSorter, self).__init__()
         self.db = db
+        self.use_sort_keys = db.sort_keys_match_locale()
+        self.locale = get_collation_locale()
 
     def __call__(self, doc):
-        return locale.strxfrm(
+        if self.use_sort_keys:
+            key = doc.get_value(XapianValues.SORT_KEY)
+            # the keys of the apt-xapian-index may be for another locale
+            if key and doc.get_value(XapianValues.SORT_KEY_LOCALE) in (
+                    "", self.locale):
+                return key
+        return get_sort_key(
             doc.get_value(self.db._axi_values["display_name"]))
 
 
@@ -157,6 +178,10 @@ class StoreDatabase(GObject.GObject):
         self._db_per_thread = {}
         self._parser_per_thread = {}
         self._axi_stamp_monitor = None
+        # pkgname -> [(docid, appname), ...] of the app-install-data
+        # documents, built on first use (see get_xapian_documents)
+        self._app_docs_by_pkgname = None
+        self._app_docs_lock = threading.Lock()
 
     @property
     def xapiandb(self):
@@ -217,6 +242,7 @@ class StoreDatabase(GObject.GObject):
         # clean existing DBs on open
         self._db_per_thread = {}
         self._parser_per_thread = {}
+        self._app_docs_by_pkgname = None
         # add the apt-xapian-database for here (we don't do this
         # for now as we do not have a good way to integrate non-apps
         # with the UI)
@@ -274,6 +300,36 @@ class StoreDatabase(GObject.GObject):
         """
         return self.xapiandb.get_metadata("db-schema-version")
 
+    def sort_keys_match_locale(self):
+        """ return True if the precomputed sort keys of the documents
+            were created for the current collation locale
+        """
+        return (self.xapiandb.get_metadata("sort-key-locale") ==
+                get_collation_locale())
+
+    def has_sort_keys(self):
+        """ return True if all applications have a precomputed sort key
+            for the current locale, the alphabetical sort can then be
+            done using the SORT_KEY value slot
+        """
+        if not self.sort_keys_match_locale():
+            return False
+        xapiandb = self.xapiandb
+        try:
+            nr_sort_keys = xapiandb.get_value_freq(XapianValues.SORT_KEY)
+            # the apt-xapian-index plugin stores the locale of the sort
+            # keys of its applications in each document
+            if xapiandb.get_value_freq(XapianValues.SORT_KEY_LOCALE):
+                collation_locale = get_collation_locale()
+                for bound in (xapiandb.get_value_lower_bound,
+                              xapiandb.get_value_upper_bound):
+                    if (bound(XapianValues.SORT_KEY_LOCALE) !=
+                            collation_locale):
+                        return False
+        except xapian.UnimplementedError:
+            return False
+        return nr_sort_keys >= xapiandb.get_termfreq("ATapplication")
+
     def reopen(self):
         """ reopen the database """
         LOG.info("reopen() database")
@@ -492,31 +548,79 @@ class StoreDatabase(GObject.GObject):
             popcon = 0
         return popcon
 
+    def _get_app_docs_by_pkgname(self):
+        """ return the map of pkgname -> [(docid, appname), ...] (in
+            docid order) of the app-install-data documents, it is built
+            from the term lists once per open()
+        """
+        with self._app_docs_lock:
+            if self._app_docs_by_pkgname is not None:
+                return self._app_docs_by_pkgname
+            xapiandb = self.xapiandb
+            appnames = {}
+            for term in xapiandb.allterms("AA"):
+                for m in xapiandb.postlist(term.term):
+                    appnames[m.docid] = term.term[2:]
+            app_docs_by_pkgname = {}
+            for term in xapiandb.allterms("AP"):
+                app_docs_by_pkgname[term.term[2:]] = [
+                    (m.docid, appnames.get(m.docid, ""))
+                    for m in xapiandb.postlist(term.term)]
+            self._app_docs_by_pkgname = app_docs_by_pkgname
+            return app_docs_by_pkgname
+
+    def _get_pkg_docid(self, pkgname, last=False):
+        """ return the (first or last) docid of the a-x-i document for
+            pkgname or None
+        """
+        docid = None
+        for m in self.xapiandb.postlist("XP" + pkgname):
+            docid = m.docid
+            if not last:
+                break
+        return docid
+
+    def get_xapian_documents(self, apps):
+        """Get the matching xapian documents for a list of (appname,
+        pkgname) tuples.
+
+        The documents are returned in the order of apps, with None for
+        the ones that are not found.
+
+        """
+        app_docs_by_pkgname = self._get_app_docs_by_pkgname()
+        docs = []
+        for (appname, pkgname) in apps:
+            app_docs = app_docs_by_pkgname.get(pkgname)
+            docid = None
+            if app_docs:
+                # prefer the app with the given appname
+                for (app_docid, app_appname) in app_docs:
+                    if app_appname == appname:
+                        docid = app_docid
+                        break
+                else:
+                    docid = app_docs[0][0]
+            else:
+                # then look for matching packages from a-x-i
+                docid = self._get_pkg_docid(pkgname)
+            if docid is None:
+                docs.append(None)
+            else:
+                docs.append(self.xapiandb.get_document(docid))
+        return docs
+
     def get_xapian_document(self, appname, pkgname):
         """Get the machting xapian document for appname, pkgname.
 
         If no document is found, raise a IndexError.
 
         """
-        #LOG.debug("get_xapian_document app='%s' pkg='%s'" % (appname,
-        #    pkgname))
-        # first search for appname in the app-install-data namespace
-        for m in self.xapiandb.postlist("AA" + appname):
-            doc = self.xapiandb.get_document(m.docid)
-            if doc.get_value(XapianValues.PKGNAME) == pkgname:
-                return doc
-        # then search for pkgname in the app-install-data namespace
-        for m in self.xapiandb.postlist("AP" + pkgname):
-            doc = self.xapiandb.get_document(m.docid)
-            if doc.get_value(XapianValues.PKGNAME) == pkgname:
-                return doc
-        # then look for matching packages from a-x-i
-        for m in self.xapiandb.postlist("XP" + pkgname):
-            doc = self.xapiandb.get_document(m.docid)
-            return doc
-        # no matching document found
-        raise IndexError("No app '%s' for '%s' in database" % (appname,
-            pkgname))
+        doc = self.get_xapian_documents([(appname, pkgname)])[0]
+        if doc is None:
+            raise IndexError("No app '%s' for '%s' in database" % (appname,
+                pkgname))
+        return doc
 
     def is_pkgname_known(self, pkgname):
         """Check if 'pkgname' is known to this database.
@@ -571,16 +675,20 @@ class StoreDatabase(GObject.GObject):
            MSetItem.document is pkgnames proper xapian document. If the pkgname
            is not available, then MSetItem is actually an Application.
         """
+        app_docs_by_pkgname = self._get_app_docs_by_pkgname()
         matches = []
         for pkgname in pkgnames:
             app = Application('', pkgname.split('?')[0])
             if '?' in pkgname:
                 app.request = pkgname.split('?')[1]
             match = app
-            for m in  self.xapiandb.postlist("XP" + app.pkgname):
-                match = self.xapiandb.get_document(m.docid)
-            for m in self.xapiandb.postlist("AP" + app.pkgname):
-                match = self.xapiandb.get_document(m.docid)
+            app_docs = app_docs_by_pkgname.get(app.pkgname)
+            if app_docs:
+                docid = app_docs[-1][0]
+            else:
+                docid = self._get_pkg_docid(app.pkgname, last=True)
+            if docid is not None:
+                match = self.xapiandb.get_document(docid)
             matches.append(FakeMSetItem(match))
         return matches
 
@@ -17,11 +17,19 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import heapq
 import logging
-import time
 import threading
 import xapian
 
+from collections import OrderedDict
+
+try:
+    from queue import Queue
+    Queue  # pyflakes
+except ImportError:
+    from Queue import Queue
+
 from gi.repository import GObject
 
 from softwarecenter.enums import (SortMethods,
@@ -30,11 +38,98 @@ from softwarecenter.enums import (SortMethods,
                                   DEFAULT_SEARCH_LIMIT)
 from softwarecenter.db.database import (
     SearchQuery, LocaleSorter, TopRatedSorter)
+from softwarecenter.db.querycache import (
+    CachedMSetItem, QueryResult, get_query_result_cache)
 from softwarecenter.distro import get_distro
 from softwarecenter.utils import ExecutionTime
 
 LOG = logging.getLogger(__name__)
 
+# the number of persistent query threads and the number of queries
+# that can be queued before submit() blocks
+DEFAULT_QUERY_WORKERS = 2
+DEFAULT_MAX_PENDING_QUERIES = 32
+
+
+class QueryRequest(object):
+    """ The parameters and the result of a single AppEnquire query,
+        it is filled in by a query worker thread
+    """
+
+    def __init__(self, enquirer, serial, match_docids):
+        self.serial = serial
+        self.search_query = enquirer.search_query
+        self.limit = enquirer.limit
+        self.sortmode = enquirer.sortmode
+        self.filter = enquirer.filter
+        self.nonapps_visible = enquirer.nonapps_visible
+        # the results
+        self.matches = []
+        self.match_docids = match_docids
+        self.nr_apps = 0
+        self.nr_pkgs = 0
+        # set from the main thread if a newer query supersedes this one
+        self.cancelled = False
+        # set in the main thread once the worker is finished
+        self.done = False
+
+
+class QueryWorkerPool(object):
+    """ A small pool of persistent threads that run AppEnquire queries
+
+        The threads keep their names for their whole lifetime so the
+        per thread xapian database of the StoreDatabase is reused. The
+        completion callback is always run in the main loop.
+    """
+
+    def __init__(self, workers=DEFAULT_QUERY_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING_QUERIES):
+        # we need to call idle_add from the worker threads
+        GObject.threads_init()
+        self._queue = Queue(max_pending)
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run,
+                                 name="ThreadedQuery-%s" % (i + 1))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, func, request, callback):
+        """ run func(request) in a worker thread and call
+            callback(request) from the main loop once it is finished
+        """
+        self._queue.put((func, request, callback))
+
+    def _run(self):
+        while True:
+            func, request, callback = self._queue.get()
+            try:
+                # a newer query superseded this one while it was queued
+                if not request.cancelled:
+                    func(request)
+            except Exception:
+                LOG.exception("query failed")
+            finally:
+                GObject.idle_add(self._complete, callback, request)
+                self._queue.task_done()
+
+    def _complete(self, callback, request):
+        request.done = True
+        callback(request)
+        return False
+
+
+_query_worker_pool = None
+
+
+def get_query_worker_pool():
+    """ return the shared QueryWorkerPool, it is created on first use """
+    global _query_worker_pool
+    if _query_worker_pool is None:
+        _query_worker_pool = QueryWorkerPool()
+    return _query_worker_pool
+
 
 class AppEnquire(GObject.GObject):
     """
@@ -73,6 +168,14 @@ class AppEnquire(GObject.GObject):
         self.nr_apps = 0
         self._matches = []
         self.match_docids = set()
+        # facet key -> list of matches, see set_faceted_query()
+        self.facets = OrderedDict()
+        # results are shared between all enquirers of the db
+        self.result_cache = get_query_result_cache(db, cache)
+        # the pending nonblocking query (if any) and a counter to detect
+        # results of superseded queries
+        self._pending_request = None
+        self._serial = 0
 
     def __len__(self):
         return len(self._matches)
@@ -82,37 +185,110 @@ class AppEnquire(GObject.GObject):
         """ return the list of matches as xapian.MSetItem """
         return self._matches
 
-    def _threaded_perform_search(self):
-        self._perform_search_complete = False
-        # generate a name and ensure we never have two threads
-        # with the same name
-        names = [thread.name for thread in threading.enumerate()]
-        for i in range(threading.active_count() + 1, 0, -1):
-            thread_name = 'ThreadedQuery-%s' % i
-            if not thread_name in names:
-                break
-        # create and start it
-        t = threading.Thread(
-            target=self._blocking_perform_search, name=thread_name)
-        t.start()
-        # don't block the UI while the thread is running
-        context = GObject.main_context_default()
-        while not self._perform_search_complete:
-            time.sleep(0.02)  # 50 fps
-            while context.pending():
-                context.iteration()
-        t.join()
-
-        # call the query-complete callback
-        self.emit("query-complete")
-
-    def _get_estimate_nr_apps_and_nr_pkgs(self, enquire, q, xfilter):
+    def _new_request(self, persistent_duplicate_filter):
+        # cancel the query that is still pending, its result is stale
+        self.cancel_query()
+        self._serial += 1
+        if persistent_duplicate_filter:
+            # the worker must not modify the set we are using
+            match_docids = set(self.match_docids)
+        else:
+            match_docids = set()
+        return QueryRequest(self, self._serial, match_docids)
+
+    def _apply_request(self, request, cache_key):
+        self._matches = request.matches
+        self.match_docids = request.match_docids
+        self.nr_apps = request.nr_apps
+        self.nr_pkgs = request.nr_pkgs
+        self.nonapps_visible = request.nonapps_visible
+        if cache_key is not None:
+            self.result_cache.add(cache_key, QueryResult(
+                [m.docid for m in self._matches], self.nr_apps,
+                self.nr_pkgs, self.nonapps_visible))
+
+    def _is_current_request(self, request):
+        return not request.cancelled and request.serial == self._serial
+
+    def _threaded_perform_search(self, request, cache_key, loop=None):
+        """ run the query in the worker pool, if a main loop is given it
+            is quit once the query is finished
+        """
+        def _on_complete(request):
+            if self._pending_request is request:
+                self._pending_request = None
+            if self._is_current_request(request):
+                self._apply_request(request, cache_key)
+            if loop is not None:
+                loop.quit()
+            elif self._is_current_request(request):
+                self.emit("query-complete")
+        self._pending_request = request
+        get_query_worker_pool().submit(
+            self._blocking_perform_search, request, _on_complete)
+
+    def cancel_query(self):
+        """ cancel the pending nonblocking query (if any), it will not
+            emit "query-complete"
+        """
+        if self._pending_request is not None:
+            self._pending_request.cancelled = True
+            self._pending_request = None
+
+    def _has_document_type_values(self):
+        """ return True if every document with a AT term has the
+            DOCUMENT_TYPE value slot, databases created before schema
+            version 7 (and apt-xapian-index plugins of that time) do not
+            have it
+        """
+        xapiandb = self.db.xapiandb
+        try:
+            nr_types = xapiandb.get_value_freq(XapianValues.DOCUMENT_TYPE)
+        except xapian.UnimplementedError:
+            return False
+        nr_typed_docs = sum(xapiandb.get_termfreq(term.term)
+                            for term in xapiandb.allterms("AT"))
+        return nr_types > 0 and nr_types == nr_typed_docs
+
+    def _get_estimate_nr_apps_and_nr_pkgs(self, enquire, q):
+        if self._has_document_type_values():
+            return self._get_estimate_nr_apps_and_nr_pkgs_single_pass(
+                enquire, q)
+        return self._get_estimate_nr_apps_and_nr_pkgs_two_pass(enquire, q)
+
+    def _get_estimate_nr_apps_and_nr_pkgs_single_pass(self, enquire, q):
+        # count the document types of all matches in a single pass, the
+        # docs of pkgs of which there exists a doc of the app are not
+        # counted (just like in the real query)
+        spy = xapian.ValueCountMatchSpy(XapianValues.DOCUMENT_TYPE)
+        enquire.add_matchspy(spy)
+        enquire.set_query(xapian.Query(xapian.Query.OP_AND_NOT,
+                                       q, xapian.Query("XD")))
+        try:
+            # no need to fetch any match, checking at least all
+            # documents ensures that the spy sees every match
+            enquire.get_mset(0, 0, len(self.db))
+        except Exception:
+            LOG.exception("_get_estimate_nr_apps_and_nr_pkgs failed")
+            return (0, 0)
+        finally:
+            enquire.clear_matchspies()
+
+        nr_apps = 0
+        for item in spy.values():
+            if item.term == "application":
+                nr_apps = item.termfreq
+        # pkgs from the apt-xapian-index have no document type
+        nr_pkgs = spy.get_total() - nr_apps
+        return (nr_apps, nr_pkgs)
+
+    def _get_estimate_nr_apps_and_nr_pkgs_two_pass(self, enquire, q):
         # filter out docs of pkgs of which there exists a doc of the app
         enquire.set_query(xapian.Query(xapian.Query.OP_AND,
                                        q, xapian.Query("ATapplication")))
 
         try:
-            tmp_matches = enquire.get_mset(0, len(self.db), None, xfilter)
+            tmp_matches = enquire.get_mset(0, len(self.db))
         except Exception:
             LOG.exception("_get_estimate_nr_apps_and_nr_pkgs failed")
             return (0, 0)
@@ -120,53 +296,58 @@ class AppEnquire(GObject.GObject):
         nr_apps = tmp_matches.get_matches_estimated()
         enquire.set_query(xapian.Query(xapian.Query.OP_AND_NOT,
                                        q, xapian.Query("XD")))
-        tmp_matches = enquire.get_mset(0, len(self.db), None, xfilter)
+        tmp_matches = enquire.get_mset(0, len(self.db))
         nr_pkgs = tmp_matches.get_matches_estimated() - nr_apps
         return (nr_apps, nr_pkgs)
 
-    def _blocking_perform_search(self):
+    def _blocking_perform_search(self, request):
         # WARNING this call may run in a thread, so its *not*
         #         allowed to touch gtk, otherwise hell breaks loose
 
-        # performance only: this is only needed to avoid the
-        # python __call__ overhead for each item if we can avoid it
-
         # use a unique instance of both enquire and xapian database
         # so concurrent queries dont result in an inconsistent database
 
         # an alternative would be to serialise queries
         enquire = xapian.Enquire(self.db.xapiandb)
 
-        if self.filter and self.filter.required:
-            xfilter = self.filter
-        else:
-            xfilter = None
+        # the filter is applied as a boolean query instead of using it
+        # as a MatchDecider that is called for each matched document
+        filter_query = None
+        if request.filter and request.filter.required:
+            filter_query = request.filter.get_query()
 
         # go over the queries
-        self.nr_apps, self.nr_pkgs = 0, 0
-        _matches = self._matches
-        match_docids = self.match_docids
-
-        for q in self.search_query:
+        request.nr_apps, request.nr_pkgs = 0, 0
+        _matches = request.matches
+        match_docids = request.match_docids
+
+        for q in request.search_query:
+            # stop early if the result is not needed anymore
+            if request.cancelled:
+                return
             LOG.debug("initial query: '%s'" % q)
 
             # for searches we may want to disable show/hide
             terms = [term for term in q]
             exact_pkgname_query = (len(terms) == 1 and
                                    terms[0].startswith("XP"))
+            if filter_query is not None:
+                q = xapian.Query(xapian.Query.OP_FILTER, q, filter_query)
 
             with ExecutionTime("calculate nr_apps and nr_pkgs: "):
                 nr_apps, nr_pkgs = self._get_estimate_nr_apps_and_nr_pkgs(
-                    enquire, q, xfilter)
-                self.nr_apps += nr_apps
-                self.nr_pkgs += nr_pkgs
+                    enquire, q)
+                request.nr_apps += nr_apps
+                request.nr_pkgs += nr_pkgs
 
             # only show apps by default (unless in always visible mode)
-            if self.nonapps_visible != NonAppVisibility.ALWAYS_VISIBLE:
+            apps_only_query = False
+            if request.nonapps_visible != NonAppVisibility.ALWAYS_VISIBLE:
                 if not exact_pkgname_query:
                     q = xapian.Query(xapian.Query.OP_AND,
                                      xapian.Query("ATapplication"),
                                      q)
+                    apps_only_query = True
 
             LOG.debug("nearly completely filtered query: '%s'" % q)
 
@@ -176,29 +357,40 @@ class AppEnquire(GObject.GObject):
                                            q, xapian.Query("XD")))
 
             # sort results
+            ratings = None
 
             # cataloged time - what's new category
-            if self.sortmode == SortMethods.BY_CATALOGED_TIME:
+            if request.sortmode == SortMethods.BY_CATALOGED_TIME:
                 if (self.db._axi_values and
                     "catalogedtime" in self.db._axi_values):
                     enquire.set_sort_by_value(
                         self.db._axi_values["catalogedtime"], reverse=True)
                 else:
                     LOG.warning("no catelogedtime in axi")
-            elif self.sortmode == SortMethods.BY_TOP_RATED:
+            elif request.sortmode == SortMethods.BY_TOP_RATED:
                 from softwarecenter.backend.reviews import get_review_loader
                 review_loader = get_review_loader(self.cache, self.db)
-                sorter = TopRatedSorter(self.db, review_loader)
-                enquire.set_sort_by_key(sorter, reverse=True)
+                ratings = review_loader.get_dampened_ratings(self.db)
+                # without the precomputed ratings use the (slow) KeyMaker
+                if ratings is None:
+                    sorter = TopRatedSorter(self.db, review_loader)
+                    enquire.set_sort_by_key(sorter, reverse=True)
             # search ranking - when searching
-            elif self.sortmode == SortMethods.BY_SEARCH_RANKING:
+            elif request.sortmode == SortMethods.BY_SEARCH_RANKING:
                 #enquire.set_sort_by_value(XapianValues.POPCON)
                 # use the default enquire.set_sort_by_relevance()
                 pass
             # display name - all categories / channels
             elif (self.db._axi_values and
                   "display_name" in self.db._axi_values):
-                enquire.set_sort_by_key(LocaleSorter(self.db), reverse=False)
+                # the pkgs of the apt-xapian-index have no sort key so
+                # the value can only be used if the query is apps only
+                if apps_only_query and self.db.has_sort_keys():
+                    enquire.set_sort_by_value(XapianValues.SORT_KEY,
+                                              reverse=False)
+                else:
+                    enquire.set_sort_by_key(LocaleSorter(self.db),
+                                            reverse=False)
                 # fallback to pkgname - if needed?
             # fallback to pkgname - if needed?
             else:
@@ -206,11 +398,16 @@ class AppEnquire(GObject.GObject):
                     XapianValues.PKGNAME, False)
 
             #~ try:
-            if self.limit == 0:
-                matches = enquire.get_mset(0, len(self.db), None, xfilter)
+            if ratings is not None:
+                # rank all matches by the precomputed ratings
+                matches = enquire.get_mset(0, len(self.db))
+                matches = self._sort_by_ratings(matches, ratings,
+                                                request.limit)
+            elif request.limit == 0:
+                matches = enquire.get_mset(0, len(self.db))
             else:
-                matches = enquire.get_mset(0, self.limit, None, xfilter)
-            LOG.debug("found ~%i matches" % matches.get_matches_estimated())
+                matches = enquire.get_mset(0, request.limit)
+            LOG.debug("found ~%i matches" % len(matches))
             #~ except:
                 #~ logging.exception("get_mset")
                 #~ matches = []
@@ -218,8 +415,8 @@ class AppEnquire(GObject.GObject):
             # promote exact matches to a "app", this will make the
             # show/hide technical items work correctly
             if exact_pkgname_query and len(matches) == 1:
-                self.nr_apps += 1
-                self.nr_pkgs -= 2
+                request.nr_apps += 1
+                request.nr_pkgs -= 2
 
             # add matches, but don't duplicate docids
             with ExecutionTime("append new matches to existing ones:"):
@@ -231,13 +428,47 @@ class AppEnquire(GObject.GObject):
         # if we have no results, try forcing pkgs to be displayed
         # if not NonAppVisibility.NEVER_VISIBLE is set
         if (not _matches and
-            self.nonapps_visible not in (NonAppVisibility.ALWAYS_VISIBLE,
-                                         NonAppVisibility.NEVER_VISIBLE)):
-            self.nonapps_visible = NonAppVisibility.ALWAYS_VISIBLE
-            self._blocking_perform_search()
-
-        # wake up the UI if run in a search thread
-        self._perform_search_complete = True
+            request.nonapps_visible not in (NonAppVisibility.ALWAYS_VISIBLE,
+                                            NonAppVisibility.NEVER_VISIBLE)):
+            request.nonapps_visible = NonAppVisibility.ALWAYS_VISIBLE
+            self._blocking_perform_search(request)
+
+    def _sort_by_ratings(self, matches, ratings, limit):
+        """ return the (first limit) matches sorted by their rating in
+            the docid indexed ratings array
+        """
+        nr_ratings = len(ratings)
+
+        def _get_rating(match):
+            if match.docid < nr_ratings:
+                return ratings[match.docid]
+            return 0
+        if limit == 0:
+            return sorted(matches, key=_get_rating, reverse=True)
+        return heapq.nlargest(limit, matches, key=_get_rating)
+
+    def _get_result_cache_key(self):
+        """ return the key for the result cache or None if the current
+            query can not be cached
+        """
+        # the top rated order depends on the review stats and not
+        # only on the database
+        if self.sortmode == SortMethods.BY_TOP_RATED:
+            return None
+        if self.filter and self.filter.required:
+            filter_state = self.filter.get_state()
+        else:
+            filter_state = None
+        return (repr(self.search_query), self.sortmode, self.limit,
+                filter_state, self.nonapps_visible)
+
+    def _set_from_cached_result(self, result):
+        self._matches = [CachedMSetItem(self.db, docid)
+                         for docid in result.docids]
+        self.match_docids = set(result.docids)
+        self.nr_apps = result.nr_apps
+        self.nr_pkgs = result.nr_pkgs
+        self.nonapps_visible = result.nonapps_visible
 
     def get_estimated_matches_count(self, query):
         with ExecutionTime("estimate item count for query: '%s'" % query):
@@ -282,7 +513,30 @@ class AppEnquire(GObject.GObject):
         - 'persistent_duplicate_filter': if True allows filtering of duplicate
                                          matches across multiple queries
         """
+        return self._set_query(search_query, limit, sortmode, filter, exact,
+                               nonapps_visible, nonblocking_load,
+                               persistent_duplicate_filter, wait=True)
+
+    def set_query_async(self, search_query,
+                        limit=DEFAULT_SEARCH_LIMIT,
+                        sortmode=SortMethods.UNSORTED,
+                        filter=None,
+                        exact=False,
+                        nonapps_visible=NonAppVisibility.MAYBE_VISIBLE,
+                        persistent_duplicate_filter=False):
+        """
+        Set a new query like set_query() but return right away, the
+        "query-complete" signal is emitted once the matches are available.
+        A new query cancels a pending one, the cancelled query does not
+        emit "query-complete".
+        """
+        return self._set_query(search_query, limit, sortmode, filter, exact,
+                               nonapps_visible, True,
+                               persistent_duplicate_filter, wait=False)
 
+    def _set_query(self, search_query, limit, sortmode, filter, exact,
+                   nonapps_visible, nonblocking_load,
+                   persistent_duplicate_filter, wait):
         self.search_query = SearchQuery(search_query)
         self.limit = limit
         self.sortmode = sortmode
@@ -303,20 +557,119 @@ class AppEnquire(GObject.GObject):
 
         # flush old query matches
         self._matches = []
+        self.facets = OrderedDict()
         if not persistent_duplicate_filter:
             self.match_docids = set()
 
+        # the result of a persistent duplicate filter query depends on
+        # the previous queries so it can not be cached
+        cache_key = None
+        if not persistent_duplicate_filter:
+            cache_key = self._get_result_cache_key()
+        if cache_key is not None:
+            result = self.result_cache.get(cache_key)
+            if result is not None:
+                LOG.debug("query cache hit (%s)" %
+                          self.result_cache.get_stats())
+                # a pending query is superseded by this one
+                self.cancel_query()
+                self._serial += 1
+                self._set_from_cached_result(result)
+                if self.nonblocking_load:
+                    self.emit("query-complete")
+                return True
+
+        request = self._new_request(persistent_duplicate_filter)
+
+        if self.nonblocking_load and not wait:
+            self._threaded_perform_search(request, cache_key)
+            return True
+
         # we support single and list search_queries,
         # if list we append them one by one
         with ExecutionTime("populate model from query: '%s' (threaded: %s)" % (
                 " ; ".join([str(q) for q in self.search_query]),
                 self.nonblocking_load), with_traceback=False):
             if self.nonblocking_load:
-                self._threaded_perform_search()
+                # don't block the UI while the worker is running, the
+                # loop is quit from the completion callback
+                loop = GObject.MainLoop()
+                self._threaded_perform_search(request, cache_key, loop)
+                loop.run()
+                # a newer query may have been started from the loop
+                if self._is_current_request(request):
+                    self.emit("query-complete")
             else:
-                self._blocking_perform_search()
+                self._blocking_perform_search(request)
+                self._apply_request(request, cache_key)
         return True
 
+    def set_faceted_query(self, facets,
+                          sortmode=SortMethods.UNSORTED,
+                          filter=None,
+                          nonapps_visible=NonAppVisibility.MAYBE_VISIBLE):
+        """
+        Run the query for the union of the given facets once (weighted,
+        sorted and filtered like set_query()) and bucket its matches by
+        facet. The buckets come from a boolean, unsorted query for the
+        docids of each facet, this is a lot cheaper than a full query
+        for each facet with a persistent_duplicate_filter
+
+        :Parameters:
+        - `facets`: a list of (key, xapian.Query) tuples (e.g. the
+                    untranslated category names and their queries)
+        - `sortmode`, `filter`, `nonapps_visible`: see set_query()
+
+        Afterwards self.matches are all the matches and self.facets maps
+        the key of each facet that has matches to the list of its matches
+        (in the sort order). A match that is part of several facets only
+        goes into the first one.
+        """
+        if not facets:
+            self.facets = OrderedDict()
+            self._matches = []
+            self.match_docids = set()
+            return True
+        query = xapian.Query(xapian.Query.OP_OR,
+                             [facet_query for (key, facet_query) in facets])
+        self.set_query(query, limit=0, sortmode=sortmode, filter=filter,
+                       nonapps_visible=nonapps_visible,
+                       nonblocking_load=False)
+        with ExecutionTime("bucket %i matches by facet" % len(self._matches)):
+            facet_docids = self._get_facet_docids(facets)
+            for match in self._matches:
+                for (key, docids) in facet_docids:
+                    if match.docid in docids:
+                        self.facets.setdefault(key, []).append(match)
+                        break
+        return True
+
+    def _get_facet_docids(self, facets):
+        """ return a list of (key, set of docids) for the facets, only
+            the docids are needed so no weights are calculated and the
+            matches are not sorted
+        """
+        enquire = xapian.Enquire(self.db.xapiandb)
+        enquire.set_weighting_scheme(xapian.BoolWeight())
+        enquire.set_docid_order(xapian.Enquire.DONT_CARE)
+        filter_query = None
+        if self.filter and self.filter.required:
+            filter_query = self.filter.get_query()
+        facet_docids = []
+        for (key, facet_query) in facets:
+            if filter_query is not None:
+                facet_query = xapian.Query(xapian.Query.OP_FILTER,
+                                           facet_query, filter_query)
+            enquire.set_query(facet_query)
+            facet_docids.append((key, set(
+                m.docid for m in enquire.get_mset(0, len(self.db)))))
+        return facet_docids
+
+    def get_facet_documents(self, key):
+        """ get the xapian.Document objects of the matches of a facet """
+        xdb = self.db.xapiandb
+        return [xdb.get_document(m.docid) for m in self.facets.get(key, [])]
+
 #    def get_pkgnames(self):
 #        xdb = self.db.xapiandb
 #        pkgnames = []
@@ -42,6 +42,7 @@ LOG = logging.getLogger(__name__)
 from softwarecenter.paths import SOFTWARE_CENTER_CACHE_DIR
 from softwarecenter.utils import ExecutionTime
 from softwarecenter.db.history import Transaction, PackageHistory
+from softwarecenter.db.history_impl.termlog import TerminalLogIndex
 
 
 def ascii_lower(key):
@@ -78,21 +79,78 @@ class AptTransaction(Transaction):
         return s
 
 
+def read_history_stanzas(f, offset=0, complete_at_eof=True):
+    """ yield a (offset, section) tuple for each stanza of the apt history
+        file object f (that is at offset), section is a dict of the fields
+
+        apt only writes a blank line before a stanza, so a stanza is
+        complete once the next one starts or if it has a End-Date. At the
+        end of the file a stanza without End-Date is only returned if
+        complete_at_eof is True (e.g. it is not for the live log that
+        apt may still be writing to).
+    """
+    section = {}
+    section_offset = offset
+    key = None
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        line_offset = offset
+        offset += len(line)
+        if not line.strip():
+            if section:
+                yield (section_offset, section)
+            section = {}
+            key = None
+            continue
+        if not section:
+            section_offset = line_offset
+        if line[0] in " \t" and key is not None:
+            section[key] += "\n" + line.strip()
+        elif ":" in line:
+            (key, value) = line.split(":", 1)
+            section[key] = value.strip()
+        else:
+            # something bogus, make sure it is not mistaken as a stanza
+            section[line.strip()] = ""
+    if section and (complete_at_eof or "End-Date" in section):
+        yield (section_offset, section)
+
+
 class AptHistory(PackageHistory):
+    """ The apt history, it is kept in a index that is persistent so that
+        only the parts of the logs that are new need to be parsed
+
+        The index has the transactions, a map of pkgnames to their
+        (start_date, action) events and for each log the offsets of its
+        stanzas. The live log is parsed from the last complete stanza on,
+        rotated logs are recognized by size and mtime (that stay the same
+        on renames) and are only parsed once.
+    """
+
+    INDEX_VERSION = 2
+
+    # the events that are recorded by pkgname
+    PKG_EVENTS = ["install", "upgrade", "downgrade", "remove", "purge"]
 
     def __init__(self, use_cache=True):
         LOG.debug("AptHistory.__init__()")
         self.main_context = GObject.main_context_default()
         self.history_file = apt_pkg.config.find_file("Dir::Log::History")
+        self.index_file = os.path.join(SOFTWARE_CENTER_CACHE_DIR,
+                                       "apthistory.p")
         #Copy monitoring of history file changes from historypane.py
         self.logfile = Gio.File.new_for_path(self.history_file)
         self.monitor = self.logfile.monitor_file(0, None)
         self.monitor.connect("changed", self._on_apt_history_changed)
         self.update_callback = None
+        self._term_log_index = None
         LOG.debug("init history")
-        # this takes a long time, run it in the idle handler
-        self._transactions = []
+        self._use_cache = use_cache
+        self._reset_index()
         self._history_ready = False
+        # this takes a long time, run it in the idle handler
         GObject.idle_add(self._rescan, use_cache)
 
     @property
@@ -106,59 +164,177 @@ class AptHistory(PackageHistory):
     def _mtime_cmp(self, a, b):
         return cmp(os.path.getmtime(a), os.path.getmtime(b))
 
+    def _reset_index(self):
+        # newest first
+        self._transactions = []
+        self._transactions_by_date = {}
+        # pkgname -> [(start_date, action), ...]
+        self._pkg_events = {}
+        # log key -> {"inode": inode, "offsets": [(offset, start_date)]}
+        self._logs = {}
+
+    def _load_index(self):
+        try:
+            with open(self.index_file) as f:
+                index = pickle.load(f)
+        except IOError:
+            return
+        except Exception:
+            LOG.exception("failed to load cache")
+            return
+        if (not isinstance(index, dict) or
+                index.get("version") != self.INDEX_VERSION):
+            LOG.debug("ignoring old history index")
+            return
+        self._transactions = index["transactions"]
+        self._pkg_events = index["pkg_events"]
+        self._logs = index["logs"]
+        self._transactions_by_date = dict(
+            (trans.start_date, trans) for trans in self._transactions)
+
+    def _save_index(self):
+        index = {"version": self.INDEX_VERSION,
+                 "transactions": self._transactions,
+                 "pkg_events": self._pkg_events,
+                 "logs": self._logs,
+                }
+        tmp_file = self.index_file + ".new"
+        try:
+            with open(tmp_file, "w") as f:
+                pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, self.index_file)
+        except (IOError, OSError):
+            LOG.exception("failed to save cache")
+
     def _rescan(self, use_cache=True):
         self._history_ready = False
-        self._transactions = []
-        p = os.path.join(SOFTWARE_CENTER_CACHE_DIR, "apthistory.p")
-        cachetime = 0
-        if os.path.exists(p) and use_cache:
-            with ExecutionTime("loading pickle cache"):
-                try:
-                    self._transactions = pickle.load(open(p))
-                    cachetime = os.path.getmtime(p)
-                except:
-                    LOG.exception("failed to load cache")
-        for history_gz_file in sorted(glob.glob(self.history_file + ".*.gz"),
-                                      cmp=self._mtime_cmp):
-            if os.path.getmtime(history_gz_file) < cachetime:
-                LOG.debug("skipping already cached '%s'" % history_gz_file)
-                continue
+        self._reset_index()
+        if use_cache:
+            with ExecutionTime("loading history index"):
+                self._load_index()
+        history_gz_files = sorted(glob.glob(self.history_file + ".*.gz"),
+                                  cmp=self._mtime_cmp)
+        for history_gz_file in history_gz_files:
             self._scan(history_gz_file)
         self._scan(self.history_file)
+        # forget about the offsets of the logs that are gone, their
+        # transactions are kept
+        keys = set(self._get_log_key(path)
+                   for path in history_gz_files + [self.history_file])
+        for key in set(self._logs) - keys:
+            del self._logs[key]
         if use_cache:
-            pickle.dump(self._transactions, open(p, "w"))
+            self._save_index()
         self._history_ready = True
 
-    def _scan(self, history_file, rescan=False):
-        LOG.debug("_scan: '%s' (%s)" % (history_file, rescan))
+    def _get_log_key(self, history_file):
+        if history_file == self.history_file:
+            return history_file
         try:
-            tagfile = apt_pkg.TagFile(open(history_file))
-        except (IOError, SystemError) as ioe:
-            LOG.debug(ioe)
+            st = os.stat(history_file)
+        except OSError:
+            return None
+        return ("rotated", st.st_size, int(st.st_mtime))
+
+    def _get_scan_offset(self, history_file, log):
+        """ return the offset of the last complete stanza of the live log
+            that is in the index or 0 if the log was replaced
+        """
+        if not log["offsets"]:
+            return 0
+        # make sure the stanza is still where it was, apt only appends
+        # to the live log
+        (offset, start_date) = log["offsets"][-1]
+        try:
+            with open(history_file) as f:
+                f.seek(offset)
+                for (stanza_offset, section) in read_history_stanzas(
+                        f, offset):
+                    if AptTransaction(section).start_date == start_date:
+                        return offset
+                    break
+        except (IOError, KeyError, ValueError):
+            pass
+        return 0
+
+    def _scan(self, history_file):
+        LOG.debug("_scan: '%s'" % history_file)
+        is_live = history_file == self.history_file
+        try:
+            st = os.stat(history_file)
+        except OSError as e:
+            LOG.debug(e)
+            return
+        key = self._get_log_key(history_file)
+        log = self._logs.get(key)
+        if log is not None and not is_live:
+            LOG.debug("skipping already indexed '%s'" % history_file)
             return
-        for stanza in tagfile:
-            # keep the UI alive
-            while self.main_context.pending():
-                self.main_context.iteration()
-            # ignore records with
-            try:
-                trans = AptTransaction(stanza)
-            except (KeyError, ValueError):
-                continue
-            # ignore the ones we have already
-            if (rescan and
-                len(self._transactions) > 0 and
-                trans.start_date <= self._transactions[0].start_date):
-                continue
-            # add it
-            # FIXME: this is a list, so potentially slow, but its sorted
-            #        so we could (and should) do a binary search
-            if not trans in self._transactions:
-                self._transactions.insert(0, trans)
+        offset = 0
+        if log is not None and log["inode"] == st.st_ino:
+            offset = self._get_scan_offset(history_file, log)
+        if offset:
+            # the last stanza is read again to find its end
+            log["offsets"].pop()
+        else:
+            log = {"inode": st.st_ino, "offsets": []}
+        try:
+            if history_file.endswith(".gz"):
+                f = gzip.open(history_file)
+            else:
+                f = open(history_file)
+            f.seek(offset)
+        except IOError as e:
+            LOG.debug(e)
+            return
+        new_transactions = []
+        with f:
+            # the live log may have a stanza that apt is still writing,
+            # it is parsed on the next change
+            for (stanza_offset, section) in read_history_stanzas(
+                    f, offset, complete_at_eof=not is_live):
+                # keep the UI alive
+                while self.main_context.pending():
+                    self.main_context.iteration()
+                # ignore records with
+                try:
+                    trans = AptTransaction(section)
+                except (KeyError, ValueError):
+                    continue
+                log["offsets"].append((stanza_offset, trans.start_date))
+                # ignore the ones we have already
+                if trans.start_date in self._transactions_by_date:
+                    continue
+                self._transactions_by_date[trans.start_date] = trans
+                new_transactions.append(trans)
+        self._logs[key] = log
+        self._add_transactions(new_transactions)
+
+    def _add_transactions(self, new_transactions):
+        if not new_transactions:
+            return
+        for trans in new_transactions:
+            for action in self.PKG_EVENTS:
+                for pkg in getattr(trans, action):
+                    pkgname = pkg.split(" ")[0]
+                    self._pkg_events.setdefault(pkgname, []).append(
+                        (trans.start_date, action))
+        oldest = new_transactions[0].start_date
+        if (not self._transactions or
+                (oldest > self._transactions[0].start_date and
+                 new_transactions == sorted(new_transactions))):
+            # the common case, new transactions were appended to the log
+            new_transactions.reverse()
+            self._transactions[0:0] = new_transactions
+        else:
+            self._transactions.extend(new_transactions)
+            self._transactions.sort(reverse=True)
 
     def _on_apt_history_changed(self, monitor, afile, other_file, event):
         if event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
-            self._scan(self.history_file, rescan=True)
+            self._scan(self.history_file)
+            if self._use_cache:
+                self._save_index()
             if self.update_callback:
                 self.update_callback()
 
@@ -167,36 +343,16 @@ class AptHistory(PackageHistory):
 
     def get_installed_date(self, pkg_name):
         installed_date = None
-        for trans in self._transactions:
-            for pkg in trans.install:
-                if pkg.split(" ")[0] == pkg_name:
-                    installed_date = trans.start_date
-                    return installed_date
+        for (start_date, action) in self._pkg_events.get(pkg_name, []):
+            if (action == "install" and
+                    (installed_date is None or start_date > installed_date)):
+                installed_date = start_date
         return installed_date
 
-    def _find_in_terminal_log(self, date, term_file):
-        found = False
-        term_lines = []
-        for line in term_file:
-            if line.startswith("Log started: %s" % date):
-                found = True
-            elif line.endswith("Log ended") or line.startswith("Log started"):
-                found = False
-            if found:
-                term_lines.append(line)
-        return term_lines
-
     def find_terminal_log(self, date):
-        """Find the terminal log part for the given transaction
-           (this can be rather slow)
-        """
-        # FIXME: try to be more clever here with date/file timestamps
-        term = apt_pkg.config.find_file("Dir::Log::Terminal")
-        term_lines = self._find_in_terminal_log(date, open(term))
-        # now search the older history
-        if not term_lines:
-            for f in glob.glob(term + ".*.gz"):
-                term_lines = self._find_in_terminal_log(date, gzip.open(f))
-                if term_lines:
-                    return term_lines
-        return term_lines
+        """Find the terminal log part for the given transaction"""
+        if self._term_log_index is None:
+            self._term_log_index = TerminalLogIndex(
+                apt_pkg.config.find_file("Dir::Log::Terminal"),
+                os.path.join(SOFTWARE_CENTER_CACHE_DIR, "apt-term-log"))
+        return self._term_log_index.get(date)
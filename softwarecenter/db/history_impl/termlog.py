@@ -0,0 +1,272 @@
+# Copyright (C) 2012 Canonical
+#
+# Authors:
+#  Michael Vogt
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""
+A index of the apt terminal logs (term.log)
+
+Each run of apt starts a section with a "Log started: <date>" line. The
+index maps the date of each section to where its text is, so the
+terminal output of a transaction is found with a single seek:
+
+ - sections of the live term.log are read directly from it (offset and
+   length in the file)
+ - rotated logs are gzip compressed and can not be read from the
+   middle, so when they are indexed (once) each of their sections is
+   compressed on its own into a data file next to the index, that file
+   is removed together with the index entries once the rotated log is
+   gone
+
+The rotated logs are only readable by root and adm, so the cache dir
+and its files are only readable by the user.
+"""
+
+import glob
+import gzip
+import logging
+import os
+import zlib
+
+try:
+    import cPickle as pickle
+    pickle  # pyflakes
+except ImportError:
+    import pickle
+
+LOG = logging.getLogger(__name__)
+
+LOG_STARTED = "Log started: "
+
+
+def read_term_log_sections(f, offset=0):
+    """ yield a (date, offset, lines) tuple for each section of the
+        terminal log file object f (that is at offset)
+    """
+    date = None
+    section_offset = offset
+    lines = []
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        if line.startswith(LOG_STARTED):
+            if date is not None:
+                yield (date, section_offset, lines)
+            date = line[len(LOG_STARTED):].strip()
+            section_offset = offset
+            lines = []
+        offset += len(line)
+        if date is not None:
+            lines.append(line)
+    if date is not None:
+        yield (date, section_offset, lines)
+
+
+def _open_private(path):
+    """ open path for writing, the file is only readable by the user """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    return os.fdopen(fd, "wb")
+
+
+class TerminalLogIndex(object):
+    """ The index of the sections of the live terminal log and its
+        rotated (term.log.*.gz) versions, it is updated incrementally
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, term_file, cachedir):
+        self.term_file = term_file
+        self.cachedir = cachedir
+        self.index_file = os.path.join(cachedir, "index.p")
+        # date -> (log key, offset, length)
+        self._sections = {}
+        # log key -> {"inode", "size", "end"} for the live log and
+        #            {"data_file": path} for rotated ones
+        self._logs = {}
+        self._loaded = False
+
+    def _load(self):
+        self._loaded = True
+        try:
+            with open(self.index_file) as f:
+                index = pickle.load(f)
+        except IOError:
+            return
+        except Exception:
+            LOG.exception("failed to load terminal log index")
+            return
+        if index.get("version") == self.INDEX_VERSION:
+            self._sections = index["sections"]
+            self._logs = index["logs"]
+
+    def _ensure_cachedir(self):
+        if not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir, 0o700)
+        # it may be from a version that did not restrict it
+        os.chmod(self.cachedir, 0o700)
+
+    def _save(self):
+        self._ensure_cachedir()
+        index = {"version": self.INDEX_VERSION,
+                 "sections": self._sections,
+                 "logs": self._logs,
+                }
+        tmp_file = self.index_file + ".new"
+        try:
+            with _open_private(tmp_file) as f:
+                pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, self.index_file)
+        except (IOError, OSError):
+            LOG.exception("failed to save terminal log index")
+
+    @staticmethod
+    def _get_rotated_key(path):
+        # logrotate keeps the size and mtime when it renames a log
+        st = os.stat(path)
+        return ("rotated", st.st_size, int(st.st_mtime))
+
+    def _index_rotated(self, path, key):
+        data_file = os.path.join(
+            self.cachedir, "rotated-%s-%s.dat" % (key[1], key[2]))
+        offset = 0
+        with _open_private(data_file) as data, gzip.open(path) as f:
+            for (date, section_offset, lines) in read_term_log_sections(f):
+                compressed = zlib.compress("".join(lines))
+                data.write(compressed)
+                self._sections[date] = (key, offset, len(compressed))
+                offset += len(compressed)
+        self._logs[key] = {"data_file": data_file}
+
+    def _index_live(self, st):
+        log = self._logs.get(self.term_file)
+        offset = 0
+        if (log is not None and log["inode"] == st.st_ino and
+                st.st_size >= log["size"]):
+            offset = log["end"]
+        else:
+            # it was rotated or replaced
+            self._sections = dict(
+                (date, entry) for (date, entry) in self._sections.items()
+                if entry[0] != self.term_file)
+        with open(self.term_file) as f:
+            f.seek(offset)
+            for (date, offset, lines) in read_term_log_sections(f, offset):
+                self._sections[date] = (
+                    self.term_file, offset, sum(len(l) for l in lines))
+        # the last section may still grow, it is read again next time
+        self._logs[self.term_file] = {"inode": st.st_ino,
+                                      "size": st.st_size,
+                                      "end": offset,
+                                     }
+
+    def update(self):
+        """ index what is new in the terminal logs """
+        if not self._loaded:
+            self._load()
+        changed = False
+        keys = set()
+        for path in glob.glob(self.term_file + ".*.gz"):
+            try:
+                self._ensure_cachedir()
+                key = self._get_rotated_key(path)
+                keys.add(key)
+                if key not in self._logs:
+                    self._index_rotated(path, key)
+                    changed = True
+            except (IOError, OSError, zlib.error) as e:
+                LOG.warn("failed to index '%s': %s" % (path, e))
+        try:
+            st = os.stat(self.term_file)
+            log = self._logs.get(self.term_file)
+            if (log is None or
+                    (log["inode"], log["size"]) != (st.st_ino, st.st_size)):
+                self._index_live(st)
+                changed = True
+            keys.add(self.term_file)
+        except (IOError, OSError) as e:
+            LOG.debug("failed to index '%s': %s" % (self.term_file, e))
+        # drop the logs that are gone
+        for key in set(self._logs) - keys:
+            log = self._logs.pop(key)
+            if "data_file" in log:
+                try:
+                    os.remove(log["data_file"])
+                except OSError:
+                    pass
+            changed = True
+        if changed:
+            self._sections = dict(
+                (date, entry) for (date, entry) in self._sections.items()
+                if entry[0] in self._logs)
+            self._save()
+
+    def _read(self, entry):
+        (key, offset, length) = entry
+        if key == self.term_file:
+            with open(self.term_file) as f:
+                f.seek(offset)
+                return f.read(length)
+        with open(self._logs[key]["data_file"], "rb") as f:
+            f.seek(offset)
+            return zlib.decompress(f.read(length))
+
+    def _is_stale(self, entry):
+        """ return True if entry is from the live log and that changed
+            since it was indexed (e.g. the last section grew or the log
+            was rotated)
+        """
+        if entry[0] != self.term_file:
+            return False
+        log = self._logs[self.term_file]
+        try:
+            st = os.stat(self.term_file)
+        except OSError:
+            return True
+        return (st.st_ino, st.st_size) != (log["inode"], log["size"])
+
+    def _find(self, date, prefix):
+        entry = self._sections.get(date)
+        if entry is None and prefix:
+            # the date may be just the start of the one in the log, use
+            # the newest section that matches
+            for section_date in sorted(self._sections, reverse=True):
+                if section_date.startswith(date):
+                    return self._sections[section_date]
+        return entry
+
+    def get(self, date):
+        """ return the lines of the section that starts with
+            "Log started: <date>" or a empty list
+
+            The logs are only indexed again if there is no such section
+            yet or it is in the live log and that changed.
+        """
+        if not self._loaded:
+            self._load()
+        entry = self._find(date, prefix=False)
+        if entry is None or self._is_stale(entry):
+            self.update()
+            entry = self._find(date, prefix=True)
+        if entry is None:
+            return []
+        try:
+            return self._read(entry).splitlines(True)
+        except (IOError, OSError, zlib.error) as e:
+            LOG.warn("failed to read terminal log for '%s': %s" % (date, e))
+            return []
@@ -0,0 +1,161 @@
+# Copyright (C) 2012 Canonical
+#
+# Authors:
+#  Michael Vogt
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import array
+import logging
+import threading
+import weakref
+
+from collections import OrderedDict
+
+LOG = logging.getLogger(__name__)
+
+# the default bounds of the cache
+DEFAULT_MAX_ENTRIES = 64
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# rough per entry overhead (key, tuple, counters) in bytes
+ENTRY_OVERHEAD = 512
+
+
+class CachedMSetItem(object):
+    """ A xapian.MSetItem lookalike for a cached result, the document
+        is only fetched from the database when it is accessed
+    """
+
+    __slots__ = ("docid", "_db")
+
+    def __init__(self, db, docid):
+        self.docid = docid
+        self._db = db
+
+    @property
+    def document(self):
+        return self._db.xapiandb.get_document(self.docid)
+
+
+class QueryResult(object):
+    """ The cached result of a AppEnquire query """
+
+    __slots__ = ("docids", "nr_apps", "nr_pkgs", "nonapps_visible")
+
+    def __init__(self, docids, nr_apps, nr_pkgs, nonapps_visible):
+        # a compact array instead of a list of python ints
+        self.docids = array.array("I", docids)
+        self.nr_apps = nr_apps
+        self.nr_pkgs = nr_pkgs
+        self.nonapps_visible = nonapps_visible
+
+    @property
+    def nbytes(self):
+        return (self.docids.itemsize * len(self.docids) + ENTRY_OVERHEAD)
+
+
+class QueryResultCache(object):
+    """ A LRU cache for the results of AppEnquire queries
+
+        It is bounded by the number of entries and by the (estimated)
+        memory used by the entries. It is thread-safe as the queries
+        run in threads.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, key):
+        """ return the QueryResult for key or None """
+        with self._lock:
+            result = self._entries.pop(key, None)
+            if result is None:
+                self.misses += 1
+                return None
+            # re-insert to mark it as most recently used
+            self._entries[key] = result
+            self.hits += 1
+            return result
+
+    def add(self, key, result):
+        """ add a QueryResult for key, this may evict older entries """
+        if result.nbytes > self.max_bytes:
+            LOG.debug("not caching result with %i docids, too big" %
+                      len(result.docids))
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            self._entries[key] = result
+            self._nbytes += result.nbytes
+            while (len(self._entries) > self.max_entries or
+                   self._nbytes > self.max_bytes):
+                (evicted_key, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def clear(self, *args):
+        """ flush the cache (can be used as signal callback) """
+        with self._lock:
+            LOG.debug("flushing query cache (%s)" % self.get_stats())
+            self._entries.clear()
+            self._nbytes = 0
+
+    def get_stats(self):
+        """ return a dict with the hit/miss counters and the size """
+        with self._lock:
+            lookups = self.hits + self.misses
+            if lookups:
+                hit_rate = float(self.hits) / lookups
+            else:
+                hit_rate = 0.0
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": hit_rate,
+                    "entries": len(self._entries),
+                    "bytes": self._nbytes,
+                   }
+
+
+# one cache per StoreDatabase
+_query_result_caches = weakref.WeakKeyDictionary()
+
+
+def get_query_result_cache(db, cache):
+    """ return the QueryResultCache for the given StoreDatabase, the
+        query cache is flushed when the database is reopened or the
+        apt cache changes
+    """
+    if db not in _query_result_caches:
+        query_cache = QueryResultCache()
+        db.connect("reopen", query_cache.clear)
+        cache.connect("cache-ready", query_cache.clear)
+        cache.connect("cache-invalid", query_cache.clear)
+        _query_result_caches[db] = query_cache
+    return _query_result_caches[db]
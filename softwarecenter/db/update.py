@@ -17,21 +17,24 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import hashlib
 import logging
 import json
 import re
 import os
 import string
 import shutil
+import tempfile
 import time
 import xapian
 
 from aptsources.sourceslist import SourceEntry
+from collections import defaultdict
 from gi.repository import GObject
 from piston_mini_client import PistonResponseObject
 
 from softwarecenter.distro import get_distro
-from softwarecenter.utils import utf8
+from softwarecenter.utils import ExecutionTime, utf8
 
 # py3 compat
 try:
@@ -60,7 +63,11 @@ from softwarecenter.enums import (XapianValues,
                                   AVAILABLE_FOR_PURCHASE_MAGIC_CHANNEL_NAME,
                                   PURCHASED_NEEDS_REINSTALL_MAGIC_CHANNEL_NAME,
                                   )
-from softwarecenter.db.database import parse_axi_values_file
+from softwarecenter.db.database import (
+    get_collation_locale,
+    get_sort_key,
+    parse_axi_values_file,
+    )
 
 from locale import getdefaultlocale
 import gettext
@@ -80,6 +87,10 @@ WEIGHT_APT_PKGNAME = 8
 WEIGHT_APT_SUMMARY = 5
 WEIGHT_APT_DESCRIPTION = 1
 
+# the default number of documents that are written in a single
+# transaction during a rebuild
+DEFAULT_FLUSH_THRESHOLD = 1000
+
 # some globals (FIXME: that really need to go into a new Update class)
 popcon_max = 0
 seen = set()
@@ -561,9 +572,10 @@ def update(db, cache, datadir=None):
 def update_from_json_string(db, cache, json_string, origin):
     """ index from a json string, should include origin url (free form string)
     """
+    session = IndexingSession(db)
     for sec in json.loads(json_string):
         parser = JsonTagSectionParser(sec, origin)
-        index_app_info_from_parser(parser, db, cache)
+        index_app_info_from_parser(parser, db, cache, session)
     return True
 
 
@@ -576,39 +588,66 @@ def update_from_var_lib_apt_lists(db, cache, listsdir=None):
     if not listsdir:
         listsdir = apt_pkg.config.find_dir("Dir::State::lists")
     context = GObject.main_context_default()
+    session = IndexingSession(db)
     for appinfo in glob("%s/*AppInfo" % listsdir):
         LOG.debug("processing %s" % appinfo)
         # process events
         while context.pending():
             context.iteration()
-        tagf = apt_pkg.TagFile(open(appinfo))
-        for section in tagf:
-            parser = DesktopTagSectionParser(section, appinfo)
-            index_app_info_from_parser(parser, db, cache)
+        update_from_single_appinfo_file(db, cache, appinfo, session)
     return True
 
 
-def update_from_single_appstream_file(db, cache, filename):
+def update_from_single_appinfo_file(db, cache, appinfo, session=None):
+    """ index a single /var/lib/apt/lists/*AppInfo file and return
+        the list of docids that got added
+    """
+    import apt_pkg
+    if session is None:
+        session = IndexingSession(db)
+    docids = []
+    session.start_phase("read")
+    tagf = apt_pkg.TagFile(open(appinfo))
+    for section in tagf:
+        parser = DesktopTagSectionParser(section, appinfo)
+        docid = index_app_info_from_parser(parser, db, cache, session)
+        if docid:
+            docids.append(docid)
+        session.start_phase("read")
+    session.stop_phase()
+    return docids
+
+
+def update_from_single_appstream_file(db, cache, filename, session=None):
     from lxml import etree
 
+    if session is None:
+        session = IndexingSession(db)
+    docids = []
+    session.start_phase("read")
     tree = etree.parse(open(filename))
     root = tree.getroot()
+    session.stop_phase()
     if not root.tag == "applications":
         LOG.error("failed to read '%s' expected Applications root tag" %
             filename)
-        return
+        return docids
     for appinfo in root.iter("application"):
         parser = AppStreamXMLParser(appinfo, filename)
-        index_app_info_from_parser(parser, db, cache)
+        docid = index_app_info_from_parser(parser, db, cache, session)
+        if docid:
+            docids.append(docid)
+    return docids
 
 
 def update_from_appstream_xml(db, cache, xmldir=None):
     if not xmldir:
         xmldir = softwarecenter.paths.APPSTREAM_XML_PATH
     context = GObject.main_context_default()
+    session = IndexingSession(db)
 
     if os.path.isfile(xmldir):
-        update_from_single_appstream_file(db, cache, xmldir)
+        update_from_single_appstream_file(db, cache, xmldir, session)
         return True
 
     for appstream_xml in glob(os.path.join(xmldir, "*.xml")):
@@ -616,7 +655,7 @@ def update_from_appstream_xml(db, cache, xmldir=None):
         # process events
         while context.pending():
             context.iteration()
-        update_from_single_appstream_file(db, cache, appstream_xml)
+        update_from_single_appstream_file(db, cache, appstream_xml, session)
     return True
 
 
@@ -625,28 +664,44 @@ def update_from_app_install_data(db, cache, datadir=None):
     if not datadir:
         datadir = softwarecenter.paths.APP_INSTALL_DESKTOP_PATH
     context = GObject.main_context_default()
+    session = IndexingSession(db)
     for desktopf in glob(datadir + "/*.desktop"):
         LOG.debug("processing %s" % desktopf)
         # process events
         while context.pending():
             context.iteration()
-        try:
-            parser = DesktopConfigParser()
-            parser.read(desktopf)
-            index_app_info_from_parser(parser, db, cache)
-        except Exception as e:
-            # Print a warning, no error (Debian Bug #568941)
-            LOG.debug("error processing: %s %s" % (desktopf, e))
-            warning_text = _(
-                "The file: '%s' could not be read correctly. The application "
-                "associated with this file will not be included in the "
-                "software catalog. Please consider raising a bug report "
-                "for this issue with the maintainer of that "
-                "application") % desktopf
-            LOG.warning(warning_text)
+        update_from_single_desktop_file(db, cache, desktopf, session)
     return True
 
 
+def update_from_single_desktop_file(db, cache, desktopf, session=None):
+    """ index a single app-install-data .desktop file and return the
+        list of docids that got added
+    """
+    if session is None:
+        session = IndexingSession(db)
+    try:
+        session.start_phase("read")
+        parser = DesktopConfigParser()
+        parser.read(desktopf)
+        docid = index_app_info_from_parser(parser, db, cache, session)
+    except Exception as e:
+        session.stop_phase()
+        # Print a warning, no error (Debian Bug #568941)
+        LOG.debug("error processing: %s %s" % (desktopf, e))
+        warning_text = _(
+            "The file: '%s' could not be read correctly. The application "
+            "associated with this file will not be included in the "
+            "software catalog. Please consider raising a bug report "
+            "for this issue with the maintainer of that "
+            "application") % desktopf
+        LOG.warning(warning_text)
+        return []
+    if docid:
+        return [docid]
+    return []
+
+
 def add_from_purchased_but_needs_reinstall_data(
     purchased_but_may_need_reinstall_list, db, cache):
     """Add application that have been purchased but may require a reinstall
@@ -658,6 +713,7 @@ def add_from_purchased_but_needs_reinstall_data(
     """
     # magic
     db_purchased = xapian.inmemory_open()
+    session = IndexingSession(db_purchased)
     # go over the items we have
     for item in purchased_but_may_need_reinstall_list:
         # FIXME: what to do with duplicated entries? we will end
@@ -675,7 +731,7 @@ def add_from_purchased_but_needs_reinstall_data(
         # index the item
         try:
             parser = SCAPurchasedApplicationParser(item)
-            index_app_info_from_parser(parser, db_purchased, cache)
+            index_app_info_from_parser(parser, db_purchased, cache, session)
         except Exception as e:
             LOG.exception("error processing: %s " % e)
     # add new in memory db to the main db
@@ -718,6 +774,7 @@ def update_from_software_center_agent(db, cache, ignore_cache=False,
     loop = GObject.MainLoop(context)
     loop.run()
     # process data
+    session = IndexingSession(db)
     for entry in sca.available:
         # process events
         while context.pending():
@@ -725,7 +782,7 @@ def update_from_software_center_agent(db, cache, ignore_cache=False,
         try:
             # now the normal parser
             parser = SCAApplicationParser(entry)
-            index_app_info_from_parser(parser, db, cache)
+            index_app_info_from_parser(parser, db, cache, session)
         except Exception as e:
             LOG.warning("error processing: %s " % e)
     # return true if we have updated entries (this can also be an empty list)
@@ -783,6 +840,11 @@ def make_doc_from_parser(parser, cache):
     # display name
     if "display_name" in axi_values:
         doc.add_value(axi_values["display_name"], name)
+    # precomputed collation key for the alphabetical sort
+    try:
+        doc.add_value(XapianValues.SORT_KEY, get_sort_key(name))
+    except ValueError as e:
+        LOG.warn("can not create sort key for '%s': %s" % (name, e))
     # cataloged_times
     if "catalogedtime" in axi_values:
         if pkgname in cataloged_times:
@@ -900,6 +962,7 @@ def make_doc_from_parser(parser, cache):
     if parser.has_option_desktop("Type"):
         type = parser.get_desktop("Type")
         doc.add_term("AT" + type.lower())
+        doc.add_value(XapianValues.DOCUMENT_TYPE, type.lower())
     # check gettext domain
     if parser.has_option_desktop("X-Ubuntu-Gettext-Domain"):
         domain = parser.get_desktop("X-Ubuntu-Gettext-Domain")
@@ -959,9 +1022,42 @@ def make_doc_from_parser(parser, cache):
     return doc
 
 
-def index_app_info_from_parser(parser, db, cache):
-        term_generator = xapian.TermGenerator()
-        term_generator.set_database(db)
+class IndexingSession(object):
+    """ The state that is shared by all documents of a indexing run
+
+        This is a single TermGenerator for the database (the database
+        capabilities are only probed once), the batching of the writes
+        into transactions and the time spend in the different phases
+        (read, make_doc, index_text, add_document, commit) of indexing.
+    """
+
+    def __init__(self, db, flush_threshold=0):
+        """ Create a new indexing session for db
+
+        :Parameters:
+        - `db`: the xapian.WritableDatabase to index into
+        - `flush_threshold`: if set to N > 0 the documents are written in
+                             transactions that get committed every N
+                             documents, see begin()
+        """
+        self.db = db
+        self.flush_threshold = flush_threshold
+        self.term_generator = xapian.TermGenerator()
+        self.term_generator.set_database(db)
+        if self._db_supports_spelling(db):
+            # this enables the flag for it (we only reach this line if
+            # the db supports spelling suggestions)
+            self.term_generator.set_flags(
+                xapian.TermGenerator.FLAG_SPELLING)
+        self.nr_docs = 0
+        self.timings = defaultdict(float)
+        self._in_transaction = False
+        self._pending = 0
+        self._phase = None
+        self._phase_start = 0
+
+    @staticmethod
+    def _db_supports_spelling(db):
         try:
             # this tests if we have spelling suggestions (there must be
             # a better way?!?) - this is needed as inmemory does not have
@@ -969,15 +1065,87 @@ def index_app_info_from_parser(parser, db, cache):
             # raise a exception much later
             db.add_spelling("test")
             db.remove_spelling("test")
-            # this enables the flag for it (we only reach this line if
-            # the db supports spelling suggestions)
-            term_generator.set_flags(xapian.TermGenerator.FLAG_SPELLING)
+            return True
         except xapian.UnimplementedError:
-            pass
+            return False
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, type, value, stack):
+        if type is None:
+            self.commit()
+        else:
+            self.cancel()
+        self.log_timings()
+
+    def begin(self):
+        """ start a transaction (if a flush_threshold is set) """
+        if self.flush_threshold > 0:
+            self.db.begin_transaction()
+            self._in_transaction = True
+
+    def commit(self):
+        """ commit the pending documents of the current transaction """
+        if not self._in_transaction:
+            return
+        self.start_phase("commit")
+        self.db.commit_transaction()
+        self._in_transaction = False
+        self._pending = 0
+        self.stop_phase()
+
+    def cancel(self):
+        """ throw away the pending documents of the current transaction """
+        if self._in_transaction:
+            self.db.cancel_transaction()
+            self._in_transaction = False
+            self._pending = 0
+
+    def add_document(self, doc):
+        """ add the document to the database and return its docid """
+        self.start_phase("add_document")
+        docid = self.db.add_document(doc)
+        self.nr_docs += 1
+        if self._in_transaction:
+            self._pending += 1
+            if self._pending >= self.flush_threshold:
+                self.commit()
+                self.begin()
+        self.stop_phase()
+        return docid
+
+    def start_phase(self, name):
+        """ account the time since the last start_phase() call to the
+            previous phase and start timing phase "name"
+        """
+        now = time.time()
+        if self._phase:
+            self.timings[self._phase] += now - self._phase_start
+        self._phase = name
+        self._phase_start = now
+
+    def stop_phase(self):
+        self.start_phase(None)
+
+    def log_timings(self):
+        LOG.info("indexed %i documents (%s)" % (self.nr_docs, ", ".join(
+            ["%s: %.2fs" % (phase, duration)
+             for (phase, duration) in sorted(self.timings.items())])))
+
+
+def index_app_info_from_parser(parser, db, cache, session=None):
+        if session is None:
+            session = IndexingSession(db)
+        term_generator = session.term_generator
+        session.start_phase("make_doc")
         doc = make_doc_from_parser(parser, cache)
         if not doc:
+            session.stop_phase()
             LOG.debug("make_doc_from_parser() returned '%s', ignoring" % doc)
             return
+        session.start_phase("index_text")
         term_generator.set_document(doc)
         name = doc.get_data()
 
@@ -1034,10 +1202,428 @@ def index_app_info_from_parser(parser, db, cache):
                     term_generator.index_text_without_positions(s,
                         WEIGHT_DESKTOP_KEYWORD)
         # now add it
-        db.add_document(doc)
+        return session.add_document(doc)
 
 
-def rebuild_database(pathname, debian_sources=True, appstream_sources=False):
+# the different kind of sources that can be indexed in a parallel
+# rebuild, see get_index_sources()
+class IndexSourceKinds:
+    DESKTOP = "desktop"
+    APPINFO = "appinfo"
+    APPSTREAM = "appstream"
+
+
+def get_index_sources(debian_sources=True, appstream_sources=False,
+                      datadir=None, listsdir=None, xmldir=None):
+    """ return a ordered list of (kind, path) tuples of all the files
+        that a rebuild would index, the order is the same that the
+        serial update() and update_from_appstream_xml() use
+    """
+    sources = []
+    if debian_sources:
+        if not datadir:
+            datadir = softwarecenter.paths.APP_INSTALL_DESKTOP_PATH
+        for desktopf in glob(datadir + "/*.desktop"):
+            sources.append((IndexSourceKinds.DESKTOP, desktopf))
+        try:
+            import apt_pkg
+            if not listsdir:
+                listsdir = apt_pkg.config.find_dir("Dir::State::lists")
+            for appinfo in glob("%s/*AppInfo" % listsdir):
+                sources.append((IndexSourceKinds.APPINFO, appinfo))
+        except ImportError:
+            pass
+    if appstream_sources:
+        if not xmldir:
+            xmldir = softwarecenter.paths.APPSTREAM_XML_PATH
+        if os.path.isfile(xmldir):
+            sources.append((IndexSourceKinds.APPSTREAM, xmldir))
+        else:
+            for appstream_xml in glob(os.path.join(xmldir, "*.xml")):
+                sources.append((IndexSourceKinds.APPSTREAM, appstream_xml))
+    return sources
+
+
+def update_from_source(db, cache, kind, path, session=None):
+    """ index a single source file as returned by get_index_sources()
+        and return the list of docids that got added
+    """
+    if kind == IndexSourceKinds.DESKTOP:
+        return update_from_single_desktop_file(db, cache, path, session)
+    elif kind == IndexSourceKinds.APPINFO:
+        return update_from_single_appinfo_file(db, cache, path, session)
+    elif kind == IndexSourceKinds.APPSTREAM:
+        return update_from_single_appstream_file(db, cache, path, session)
+    raise ValueError("unknown source kind '%s'" % kind)
+
+
+def update_from_sources(db, cache, sources,
+                        flush_threshold=DEFAULT_FLUSH_THRESHOLD):
+    """ index the given sources (see get_index_sources()) one after
+        another and return a list with the docids for each source
+    """
+    context = GObject.main_context_default()
+    docids_per_source = []
+    with IndexingSession(db, flush_threshold) as session:
+        for (kind, path) in sources:
+            LOG.debug("processing %s" % path)
+            # process events
+            while context.pending():
+                context.iteration()
+            docids_per_source.append(
+                update_from_source(db, cache, kind, path, session))
+    return docids_per_source
+
+
+# the cache used by the parallel rebuild workers, it is set before the
+# worker pool is created so that the (forked) workers inherit a already
+# opened cache instead of opening their own one
+_shard_worker_cache = None
+
+
+def _index_sources_into_shard(args):
+    """ worker function for update_from_sources_parallel() that indexes
+        the given sources into a new shard database at shard_path
+    """
+    (shard_path, sources, flush_threshold) = args
+    global popcon_max
+    popcon_max = 0
+    nr_docs_per_source = []
+    db = xapian.WritableDatabase(shard_path, xapian.DB_CREATE_OR_OVERWRITE)
+    session = IndexingSession(db, flush_threshold)
+    with session:
+        for (kind, path) in sources:
+            LOG.debug("processing %s (%s)" % (path, shard_path))
+            docids = update_from_source(
+                db, _shard_worker_cache, kind, path, session)
+            nr_docs_per_source.append(len(docids))
+    db.flush()
+    return (shard_path, popcon_max, nr_docs_per_source,
+            dict(session.timings))
+
+
+def _merge_shard_into_database(db, shard_path, session):
+    """ copy all documents and spelling data of the shard into db and
+        return the list of the new docids (in shard order)
+    """
+    docids = []
+    shard = xapian.Database(shard_path)
+    for m in shard.postlist(""):
+        docids.append(session.add_document(shard.get_document(m.docid)))
+    try:
+        for spelling in shard.spellings():
+            db.add_spelling(spelling.term, spelling.termfreq)
+    except xapian.UnimplementedError:
+        # inmemory dbs do not support spelling suggestions
+        pass
+    return docids
+
+
+def update_from_sources_parallel(db, cache, sources, workers=None,
+                                 shard_dir=None,
+                                 flush_threshold=DEFAULT_FLUSH_THRESHOLD):
+    """ index the given sources (see get_index_sources()) using a pool
+        of worker processes
+
+        Each worker writes a shard database, the shards are merged into
+        db in the order of the sources so that the resulting documents
+        (and their docids) are the same as with a serial update. The
+        shard_dir (a temporary directory if not given) is removed when
+        done.
+
+        :return: a list with the docids for each source
+    """
+    import multiprocessing
+    global popcon_max, _shard_worker_cache
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    if not sources:
+        return []
+    # use a few more chunks than workers so that a slow chunk does not
+    # keep the other workers idle
+    nr_chunks = min(len(sources), workers * 4)
+    chunk_size = (len(sources) + nr_chunks - 1) // nr_chunks
+    if shard_dir is None:
+        shard_dir = tempfile.mkdtemp(prefix="software-center-shards-")
+    elif not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    jobs = []
+    for i in range(0, len(sources), chunk_size):
+        shard_path = os.path.join(shard_dir, "shard-%04i" % len(jobs))
+        jobs.append((shard_path, sources[i:i + chunk_size], flush_threshold))
+    LOG.debug("indexing %i sources in %i shards with %i workers" % (
+        len(sources), len(jobs), workers))
+    docids_per_source = []
+    try:
+        _shard_worker_cache = cache
+        pool = multiprocessing.Pool(workers)
+        try:
+            result = pool.map_async(_index_sources_into_shard, jobs)
+            # keep the main context alive while the workers are busy (e.g.
+            # to process dbus querries)
+            context = GObject.main_context_default()
+            while not result.ready():
+                while context.pending():
+                    context.iteration()
+                result.wait(0.1)
+            shards = result.get()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _shard_worker_cache = None
+        # the time the workers spend in the indexing phases (summed up
+        # over all workers)
+        worker_timings = defaultdict(float)
+        # merge in source order
+        with IndexingSession(db, flush_threshold) as session:
+            for (shard_path, shard_popcon_max, nr_docs_per_source,
+                 timings) in shards:
+                docids = _merge_shard_into_database(db, shard_path, session)
+                for nr_docs in nr_docs_per_source:
+                    docids_per_source.append(docids[:nr_docs])
+                    docids = docids[nr_docs:]
+                popcon_max = max(popcon_max, shard_popcon_max)
+                for (phase, duration) in timings.items():
+                    worker_timings[phase] += duration
+        LOG.info("time spend in the workers (%s)" % ", ".join(
+            ["%s: %.2fs" % (phase, duration)
+             for (phase, duration) in sorted(worker_timings.items())]))
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    return docids_per_source
+
+
+class IndexManifest(object):
+    """ The list of indexed source files with their mtime, content hash
+        and the docids of the documents that were created from them.
+
+        It is stored as json in the metadata of the xapian database and
+        used by update_database() to only re-index the changed sources.
+    """
+
+    METADATA_KEY = "index-manifest"
+
+    def __init__(self, options=None, entries=None):
+        # the options that the database was build with (e.g. if
+        # appstream sources are included)
+        self.options = options or {}
+        # source path -> {"mtime": mtime, "hash": hash, "docids": docids}
+        self.entries = entries or {}
+
+    @classmethod
+    def load(cls, db):
+        """ load the manifest from db, returns None if there is none """
+        raw = db.get_metadata(cls.METADATA_KEY)
+        if not raw:
+            return None
+        try:
+            data = json.loads(raw)
+            return cls(data["options"], data["entries"])
+        except (ValueError, KeyError) as e:
+            LOG.warn("failed to read index manifest: %s" % e)
+            return None
+
+    def save(self, db):
+        """ store the manifest in the metadata of db """
+        db.set_metadata(self.METADATA_KEY, json.dumps(
+            {"options": self.options, "entries": self.entries}))
+
+    def add(self, path, stamp, docids):
+        """ add (or replace) the entry for path, stamp is a (mtime, hash)
+            tuple as returned by get_source_stamp()
+        """
+        (mtime, content_hash) = stamp
+        self.entries[path] = {"mtime": mtime,
+                              "hash": content_hash,
+                              "docids": list(docids),
+                             }
+
+
+def get_source_stamp(path):
+    """ return a (mtime, hash) tuple for the given source file """
+    mtime = os.path.getmtime(path)
+    return (mtime, hashlib.md5(open(path, "rb").read()).hexdigest())
+
+
+def get_apt_lists_stamp(listsdir=None):
+    """ return a stamp (as string) of the apt lists, it changes when the
+        lists are changed by e.g. a apt-get update
+    """
+    if not listsdir:
+        try:
+            import apt_pkg
+        except ImportError:
+            return ""
+        listsdir = apt_pkg.config.find_dir("Dir::State::lists")
+    stamp = hashlib.md5()
+    for path in sorted(glob(os.path.join(listsdir, "*"))):
+        if not os.path.isfile(path) or path.endswith("lock"):
+            continue
+        st = os.stat(path)
+        stamp.update("%s\0%s\0%s\n" % (path, st.st_mtime, st.st_size))
+    return stamp.hexdigest()
+
+
+def _get_index_options(debian_sources, appstream_sources):
+    # the sort keys depend on the collation locale and the origins,
+    # summaries and sections of the documents on the apt lists
+    return {"debian_sources": debian_sources,
+            "appstream_sources": appstream_sources,
+            "collation_locale": get_collation_locale(),
+            "apt_lists": get_apt_lists_stamp(),
+           }
+
+
+def _get_appstream_xmldir():
+    # use the appstream data from the checkout if there is one
+    if os.path.exists('./data/app-stream/appdata.xml'):
+        return './data/app-stream/appdata.xml'
+    return None
+
+
+def _get_app_install_mo_time():
+    """ return the mo file stamp (as string) for the langpack checks """
+    mofile = gettext.find("app-install-data")
+    if mofile:
+        return str(os.path.getctime(mofile))
+    return ""
+
+
+def _delete_documents(db, docids):
+    for docid in docids:
+        try:
+            db.delete_document(docid)
+        except xapian.DocNotFoundError:
+            LOG.debug("document '%s' already deleted" % docid)
+
+
+def update_from_sources_incremental(db, cache, sources, manifest):
+    """ index the sources (see get_index_sources()) that are new or got
+        changed since the manifest was written and remove the documents
+        of sources that got changed or removed
+
+        The manifest is updated to the new state.
+
+        :return: the number of sources that got (re-)indexed or removed
+    """
+    context = GObject.main_context_default()
+    # no flush_threshold here, the caller decides about the transaction
+    session = IndexingSession(db)
+    old_entries = manifest.entries
+    manifest.entries = {}
+    nr_changed = 0
+    for (kind, path) in sources:
+        # process events
+        while context.pending():
+            context.iteration()
+        entry = old_entries.pop(path, None)
+        mtime = os.path.getmtime(path)
+        if entry and entry["mtime"] == mtime:
+            manifest.entries[path] = entry
+            continue
+        stamp = get_source_stamp(path)
+        if entry and entry["hash"] == stamp[1]:
+            # only touched, no need to re-index
+            manifest.add(path, stamp, entry["docids"])
+            continue
+        if entry:
+            LOG.debug("re-indexing changed source '%s'" % path)
+            _delete_documents(db, entry["docids"])
+        else:
+            LOG.debug("indexing new source '%s'" % path)
+        docids = update_from_source(db, cache, kind, path, session)
+        manifest.add(path, stamp, docids)
+        nr_changed += 1
+    # whats left are sources that are no longer there
+    for (path, entry) in old_entries.items():
+        LOG.debug("removing documents of deleted source '%s'" % path)
+        _delete_documents(db, entry["docids"])
+        nr_changed += 1
+    session.log_timings()
+    return nr_changed
+
+
+def update_database(pathname, debian_sources=True, appstream_sources=False,
+                    workers=1, force_rebuild=False,
+                    flush_threshold=DEFAULT_FLUSH_THRESHOLD):
+    """ update the database at pathname by only re-indexing the source
+        files that got added, changed or removed since the last update
+
+        If that is not possible (e.g. no database yet or a different
+        schema version) or force_rebuild is given a full rebuild with
+        rebuild_database() is done instead.
+    """
+    def _rebuild(reason):
+        LOG.info("full rebuild of '%s': %s" % (pathname, reason))
+        return rebuild_database(pathname, debian_sources, appstream_sources,
+                                workers, flush_threshold)
+    if force_rebuild:
+        return _rebuild("forced")
+    try:
+        db = xapian.WritableDatabase(pathname, xapian.DB_OPEN)
+    except xapian.Error as e:
+        return _rebuild("can not open database (%s)" % e)
+    manifest = IndexManifest.load(db)
+    if db.get_metadata("db-schema-version") != DB_SCHEMA_VERSION:
+        reason = "schema version changed"
+    elif manifest is None:
+        reason = "no index manifest"
+    elif manifest.options.get("apt_lists") != get_apt_lists_stamp():
+        reason = "apt lists changed"
+    elif manifest.options != _get_index_options(debian_sources,
+                                                appstream_sources):
+        reason = "index options changed"
+    elif db.get_metadata("app-install-mo-time") != _get_app_install_mo_time():
+        reason = "translations changed"
+    else:
+        reason = None
+    if reason:
+        # release the lock before rebuilding
+        del db
+        return _rebuild(reason)
+
+    cache = get_pkg_info()
+    cache.open()
+    sources = get_index_sources(debian_sources, appstream_sources,
+                                xmldir=_get_appstream_xmldir())
+    global popcon_max
+    popcon_max = 0
+    if db.get_metadata("popcon_max_desktop"):
+        popcon_max = xapian.sortable_unserialise(
+            db.get_metadata("popcon_max_desktop"))
+    # readers will only see the new state once everything is committed
+    db.begin_transaction()
+    try:
+        with ExecutionTime("incremental update of %i sources" % len(
+                sources)):
+            nr_changed = update_from_sources_incremental(
+                db, cache, sources, manifest)
+        manifest.save(db)
+        if debian_sources:
+            db.set_metadata("popcon_max_desktop",
+                xapian.sortable_serialise(float(popcon_max)))
+        db.commit_transaction()
+    except Exception as e:
+        db.cancel_transaction()
+        LOG.warn("Incremental update of '%s' failed: %s" % (pathname, e))
+        return False
+    LOG.info("incremental update: %i of %i sources changed" % (
+        nr_changed, len(sources)))
+    return True
+
+
+def rebuild_database(pathname, debian_sources=True, appstream_sources=False,
+                     workers=1, flush_threshold=DEFAULT_FLUSH_THRESHOLD):
+    """ rebuild the database at pathname
+
+        If workers is not 1 the sources are parsed and indexed in
+        parallel by a pool of worker processes (workers=0 or None means
+        one worker per CPU). The documents are written in transactions
+        of flush_threshold documents.
+    """
     #cache = apt.Cache(memonly=True)
     cache = get_pkg_info()
     cache.open()
@@ -1073,22 +1659,47 @@ def rebuild_database(pathname, debian_sources=True, appstream_sources=False):
     # write it
     db = xapian.WritableDatabase(rebuild_path, xapian.DB_CREATE_OR_OVERWRITE)
 
+    sources = get_index_sources(debian_sources, appstream_sources,
+                                xmldir=_get_appstream_xmldir())
+    # record the state of the sources *before* indexing them so that a
+    # change while we index is picked up by the next incremental update
+    manifest = IndexManifest(_get_index_options(debian_sources,
+                                                appstream_sources))
+    stamps = [get_source_stamp(path) for (kind, path) in sources]
+
+    if workers == 1:
+        docids_per_source = update_from_sources(db, cache, sources,
+                                                flush_threshold)
+    else:
+        try:
+            with ExecutionTime("parallel index of %i sources" % len(
+                    sources)):
+                docids_per_source = update_from_sources_parallel(
+                    db, cache, sources, workers,
+                    shard_dir=rebuild_path + "_shards",
+                    flush_threshold=flush_threshold)
+        except Exception as e:
+            LOG.warn("Parallel rebuild of '%s' failed: %s" % (pathname, e))
+            return False
+    for ((kind, path), stamp, docids) in zip(sources, stamps,
+                                             docids_per_source):
+        manifest.add(path, stamp, docids)
+    manifest.save(db)
+
     if debian_sources:
-        update(db, cache)
-    if appstream_sources:
-        if os.path.exists('./data/app-stream/appdata.xml'):
-            update_from_appstream_xml(db, cache,
-                './data/app-stream/appdata.xml')
-        else:
-            update_from_appstream_xml(db, cache)
+        # add db global meta-data
+        LOG.debug("adding popcon_max_desktop '%s'" % popcon_max)
+        db.set_metadata("popcon_max_desktop",
+            xapian.sortable_serialise(float(popcon_max)))
 
     # write the database version into the filep
     db.set_metadata("db-schema-version", DB_SCHEMA_VERSION)
+    # the locale of the precomputed sort keys
+    db.set_metadata("sort-key-locale", get_collation_locale())
     # update the mo file stamp for the langpack checks
-    mofile = gettext.find("app-install-data")
-    if mofile:
-        mo_time = os.path.getctime(mofile)
-        db.set_metadata("app-install-mo-time", str(mo_time))
+    mo_time = _get_app_install_mo_time()
+    if mo_time:
+        db.set_metadata("app-install-mo-time", mo_time)
     db.flush()
 
     # use shutil.move() instead of os.rename() as this will automatically
@@ -0,0 +1,342 @@
+# Copyright (C) 2012 Canonical
+#
+# Authors:
+#  Michael Vogt
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""
+A size bounded cache of downloaded files
+
+The files are stored in a flat directory (named after their url) and
+a index keeps for each of them:
+
+ - the url it was downloaded from
+ - its ETag and Last-Modified time (if the server has them)
+ - the time it was downloaded
+ - its size and the time it was last used
+ - the time it was last checked against the server
+
+A cached file is used right away, once it was not checked for a while
+it is revalidated in the background (see revalidate()). If the files
+are bigger than the budget the least recently used ones are removed.
+The files are written atomically, so a file that exists is complete.
+"""
+
+import logging
+import os
+import time
+
+from collections import OrderedDict
+
+from gi.repository import GObject, Gio
+
+try:
+    import cPickle as pickle
+    pickle  # pyflakes
+except ImportError:
+    import pickle
+
+from softwarecenter.paths import SOFTWARE_CENTER_DOWNLOAD_CACHE_DIR
+
+LOG = logging.getLogger(__name__)
+
+# the default budget for the files of the cache
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# the default time (in seconds) a file is used without checking if it
+# is still current
+DEFAULT_REVALIDATE_AFTER = 24 * 60 * 60
+
+INDEX_FILE = "index.p"
+
+
+class DownloadCache(object):
+    """ The cache of the files downloaded by the SimpleFileDownloader,
+        all its methods are called from the main loop
+    """
+
+    INDEX_VERSION = 1
+
+    # seconds to wait before writing the changed index
+    SAVE_DELAY = 5
+
+    def __init__(self, cachedir, max_bytes=DEFAULT_MAX_BYTES,
+                 revalidate_after=DEFAULT_REVALIDATE_AFTER):
+        self.cachedir = cachedir
+        self.index_file = os.path.join(cachedir, INDEX_FILE)
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.hits = 0
+        self.misses = 0
+        # filename -> entry, the least recently used first
+        self._entries = None
+        self._nbytes = 0
+        self._save_source_id = None
+        # the paths that are revalidated right now
+        self._revalidating = set()
+
+    @property
+    def nbytes(self):
+        self._get_entries()
+        return self._nbytes
+
+    def _get_entries(self):
+        if self._entries is None:
+            self._entries = self._load()
+            self._nbytes = sum(e["size"] for e in self._entries.values())
+        return self._entries
+
+    def _load(self):
+        entries = {}
+        try:
+            with open(self.index_file, "rb") as f:
+                index = pickle.load(f)
+            if index.get("version") == self.INDEX_VERSION:
+                entries = index["entries"]
+        except IOError:
+            pass
+        except Exception:
+            LOG.exception("failed to load download cache index")
+        # the index may be behind the files (e.g. it was not saved on
+        # exit or the files are from a version without index), files
+        # that it does not know are added without validators
+        try:
+            names = set(name for name in os.listdir(self.cachedir)
+                        if name != INDEX_FILE and
+                        not name.endswith(".new") and
+                        os.path.isfile(os.path.join(self.cachedir, name)))
+        except OSError:
+            names = set()
+        for name in set(entries) - names:
+            del entries[name]
+        for name in names - set(entries):
+            st = os.stat(os.path.join(self.cachedir, name))
+            entries[name] = self._make_entry(
+                None, st.st_size, atime=st.st_mtime, validated=0,
+                fetched=st.st_mtime)
+        return OrderedDict(
+            sorted(entries.items(), key=lambda item: item[1]["atime"]))
+
+    def _queue_save(self):
+        if self._save_source_id is None:
+            self._save_source_id = GObject.timeout_add_seconds(
+                self.SAVE_DELAY, self.save)
+
+    def save(self):
+        """ write the index (it is done automatically shortly after a
+            change)
+        """
+        if self._save_source_id is not None:
+            GObject.source_remove(self._save_source_id)
+            self._save_source_id = None
+        if self._entries is None:
+            return False
+        index = {"version": self.INDEX_VERSION,
+                 "entries": dict(self._entries),
+                }
+        tmp_file = self.index_file + ".new"
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            with open(tmp_file, "wb") as f:
+                pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, self.index_file)
+        except (IOError, OSError):
+            LOG.exception("failed to save download cache index")
+        return False
+
+    @staticmethod
+    def _make_entry(url, size, etag=None, last_modified=None, atime=None,
+                    validated=None, fetched=None):
+        now = time.time()
+        return {"url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "size": size,
+                "atime": now if atime is None else atime,
+                "validated": now if validated is None else validated,
+                "fetched": now if fetched is None else fetched,
+               }
+
+    def _get_name(self, path):
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(
+                self.cachedir):
+            raise ValueError("'%s' is not in '%s'" % (path, self.cachedir))
+        return os.path.basename(path)
+
+    def lookup(self, path):
+        """ return the entry of the cached file at path (and mark it as
+            used) or None if it is not cached
+        """
+        entries = self._get_entries()
+        name = self._get_name(path)
+        entry = entries.pop(name, None)
+        if entry is not None and not os.path.exists(path):
+            # removed behind our back
+            self._nbytes -= entry["size"]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        entry["atime"] = time.time()
+        entries[name] = entry
+        self.hits += 1
+        self._queue_save()
+        return entry
+
+    def needs_revalidation(self, path):
+        entry = self._get_entries().get(self._get_name(path))
+        if entry is None:
+            return False
+        return entry["validated"] + self.revalidate_after < time.time()
+
+    def store(self, url, path, content, etag=None, last_modified=None):
+        """ write content as the cached file at path (atomically),
+            returns False if that failed
+        """
+        entries = self._get_entries()
+        name = self._get_name(path)
+        tmp_path = path + ".new"
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            LOG.warn("failed to cache '%s': %s" % (url, e))
+            return False
+        old = entries.pop(name, None)
+        if old is not None:
+            self._nbytes -= old["size"]
+        entries[name] = self._make_entry(url, len(content), etag,
+                                         last_modified)
+        self._nbytes += len(content)
+        self._expunge()
+        self._queue_save()
+        return True
+
+    def set_validated(self, path, etag=None, last_modified=None):
+        """ the cached file at path is still current, remember the
+            validators of the server if it did not have them before
+        """
+        entry = self._get_entries().get(self._get_name(path))
+        if entry is None:
+            return
+        entry["validated"] = time.time()
+        entry["etag"] = etag or entry["etag"]
+        entry["last_modified"] = last_modified or entry["last_modified"]
+        self._queue_save()
+
+    def is_current(self, path, etag, last_modified):
+        """ return True if the given validators of the server match the
+            ones of the cached file at path
+        """
+        entry = self._get_entries().get(self._get_name(path))
+        if entry is None:
+            return False
+        if etag and entry["etag"]:
+            return etag == entry["etag"]
+        if last_modified and entry["last_modified"]:
+            return last_modified == entry["last_modified"]
+        # the Last-Modified time is not known for a first download (Gio
+        # only gives the ETag), but it must be older than the file (it
+        # is in seconds, so a change in the second of the download does
+        # not count)
+        if last_modified and entry.get("fetched"):
+            return last_modified + 1 <= entry["fetched"]
+        # nothing to compare, so it must be downloaded again
+        return False
+
+    def _expunge(self):
+        """ remove the least recently used files until the cache is in
+            its budget, the most recently used file is always kept
+        """
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            (name, entry) = self._entries.popitem(last=False)
+            self._nbytes -= entry["size"]
+            LOG.debug("expunging '%s' from the download cache" % name)
+            try:
+                os.remove(os.path.join(self.cachedir, name))
+            except OSError:
+                pass
+
+    def revalidate(self, url, path):
+        """ check in the background if the cached file at path is still
+            the current content of url, if not it is downloaded again
+            (with a low priority) and replaces the cached file once it
+            is complete
+        """
+        if path in self._revalidating:
+            return
+        self._revalidating.add(path)
+        attributes = ",".join([Gio.FILE_ATTRIBUTE_ETAG_VALUE,
+                               Gio.FILE_ATTRIBUTE_TIME_MODIFIED])
+        f = Gio.File.new_for_uri(url)
+        f.query_info_async(attributes, 0, GObject.PRIORITY_LOW, None,
+                           self._on_revalidate_query_info, (url, path))
+
+    def _on_revalidate_query_info(self, f, result, data):
+        from softwarecenter.utils import (DownloadScheduler,
+                                          get_download_scheduler)
+        (url, path) = data
+        try:
+            info = f.query_info_finish(result)
+        except GObject.GError as e:
+            # most likely offline, try again later
+            LOG.debug("failed to revalidate '%s': %s" % (url, e))
+            self._revalidating.discard(path)
+            self.set_validated(path)
+            return
+        etag = info.get_etag()
+        last_modified = None
+        if info.has_attribute(Gio.FILE_ATTRIBUTE_TIME_MODIFIED):
+            last_modified = info.get_attribute_uint64(
+                Gio.FILE_ATTRIBUTE_TIME_MODIFIED)
+        if self.is_current(path, etag, last_modified):
+            LOG.debug("'%s' is current" % url)
+            self._revalidating.discard(path)
+            self.set_validated(path, etag, last_modified)
+            return
+
+        def _on_download_complete(url, content, download_etag, error):
+            self._revalidating.discard(path)
+            if error is not None:
+                LOG.debug("failed to refresh '%s': %s" % (url, error))
+                self.set_validated(path)
+                return
+            self.store(url, path, content, download_etag or etag,
+                       last_modified)
+        LOG.debug("'%s' changed, downloading it again" % url)
+        get_download_scheduler().download(
+            url, _on_download_complete, DownloadScheduler.PRIORITY_PREFETCH)
+
+    def get_stats(self):
+        self._get_entries()
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+               }
+
+
+_download_cache = None
+
+
+def get_download_cache():
+    global _download_cache
+    if _download_cache is None:
+        _download_cache = DownloadCache(SOFTWARE_CENTER_DOWNLOAD_CACHE_DIR)
+    return _download_cache
@@ -61,7 +61,7 @@ SOFTWARE_CENTER_TOS_LINK_NO_HEADER = "https://apps.ubuntu.com/cat/tos/plain/ "
 
 # version of the database, every time something gets added (like
 # terms for mime-type) increase this (but keep as a string!)
-DB_SCHEMA_VERSION = "6"
+DB_SCHEMA_VERSION = "7"
 
 # the default limit for a search
 DEFAULT_SEARCH_LIMIT = 10000
@@ -165,6 +165,9 @@ class XapianValues:
     SUPPORT_SITE_URL = 197
     VERSION_INFO = 198
     SC_SUPPORTED_DISTROS = 199
+    DOCUMENT_TYPE = 200               # the desktop file Type, lowercase
+    SORT_KEY = 201                    # locale.strxfrm() of the display name
+    SORT_KEY_LOCALE = 202             # the locale of SORT_KEY (a-x-i only)
 
 
 # fake channels
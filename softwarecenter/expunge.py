@@ -20,8 +20,89 @@ import logging
 import os
 import time
 
+from multiprocessing.pool import ThreadPool
+
 from softwarecenter.utils import get_lock, release_lock
 
+# the name of the index of the cache files in each cache dir
+INDEX_FILE = ".expunge-index"
+
+# the number of threads that stat and read the cache files
+DEFAULT_WORKERS = 4
+
+
+class ExpungeIndex(object):
+    """ The httplib2 status header, mtime and size of the cache files of
+        a directory
+
+        The writers of the cache append a line for each file they write
+        (or delete), so the ExpungeCache does not need to open every
+        file to read its header. The ExpungeCache rewrites the index
+        with the files that are left after each run. A entry is only
+        trusted if the mtime and size of the file still match, so a
+        file written by something that does not update the index is
+        read again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_file = os.path.join(path, INDEX_FILE)
+
+    def _append(self, line):
+        try:
+            with open(self.index_file, "a") as f:
+                f.write(line)
+        except IOError as e:
+            logging.debug("can not update '%s': %s" % (self.index_file, e))
+
+    def add(self, name, header):
+        """ add the cache file name (in path) that was just written with
+            the given status header (e.g. "status: 200")
+        """
+        try:
+            st = os.stat(os.path.join(self.path, name))
+        except OSError:
+            return
+        self._append("%s\t%s\t%i\t%i\n" % (
+                name, header.strip(), int(st.st_mtime), st.st_size))
+
+    def remove(self, name):
+        self._append("%s\t\t0\t0\n" % name)
+
+    def load(self):
+        """ return a dict of name -> (header, mtime, size) """
+        entries = {}
+        try:
+            f = open(self.index_file)
+        except IOError:
+            return entries
+        with f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                # a line may be cut short by a crash
+                if len(fields) != 4:
+                    continue
+                (name, header, mtime, size) = fields
+                if not header:
+                    entries.pop(name, None)
+                    continue
+                try:
+                    entries[name] = (header, int(mtime), int(size))
+                except ValueError:
+                    continue
+        return entries
+
+    def write(self, entries):
+        """ replace the index with the given entries """
+        tmp_file = self.index_file + ".new"
+        try:
+            with open(tmp_file, "w") as f:
+                for name, (header, mtime, size) in sorted(entries.items()):
+                    f.write("%s\t%s\t%i\t%i\n" % (name, header, mtime, size))
+            os.rename(tmp_file, self.index_file)
+        except (IOError, OSError) as e:
+            logging.warn("can not write '%s': %s" % (self.index_file, e))
+
 
 class ExpungeCache(object):
     """ Expunge a httplib2 cache dir based on either age of the cache
@@ -29,46 +110,95 @@ class ExpungeCache(object):
     """
 
     def __init__(self, dirs, by_days, by_unsuccessful_http_states,
-                 dry_run=False):
+                 dry_run=False, workers=DEFAULT_WORKERS):
         self.dirs = dirs
         # days to keep data in the cache (0 == disabled)
         self.keep_time = 60 * 60 * 24 * by_days
         self.keep_only_http200 = by_unsuccessful_http_states
         self.dry_run = dry_run
+        self.workers = workers
+        # the bytes of the files that were deleted
+        self.reclaimed = 0
 
-    def _rm(self, f):
+    def _rm(self, f, size=0):
         if self.dry_run:
             print "Would delete: %s" % f
+            self.reclaimed += size
         else:
             logging.debug("Deleting: %s" % f)
             try:
                 os.unlink(f)
+                self.reclaimed += size
             except OSError as e:
                 logging.warn("When expunging the cache, could not unlink "
                              "file '%s' (%s)'" % (f, e))
 
+    @staticmethod
+    def _scan_file(fullpath, entry):
+        """ return the (header, mtime, size) of the cache file, the
+            header is taken from the index entry if it is up-to-date
+        """
+        try:
+            st = os.stat(fullpath)
+            if entry is not None and entry[1:] == (int(st.st_mtime),
+                                                   st.st_size):
+                header = entry[0]
+            else:
+                with open(fullpath) as f:
+                    header = f.readline().strip()
+        except (IOError, OSError) as e:
+            logging.debug("Skipping '%s': %s" % (fullpath, e))
+            return None
+        return (header, st.st_mtime, st.st_size)
+
+    def _is_expired(self, header, mtime, now):
+        if self.keep_only_http200 and header != "status: 200":
+            return True
+        if self.keep_time and (mtime + self.keep_time) < now:
+            return True
+        return False
+
     def _cleanup_dir(self, path):
         """ cleanup the given directory (and subdirectories) using the
             age or http state of the cache
         """
         now = time.time()
-        for root, dirs, files in os.walk(path):
-            for f in files:
-                fullpath = os.path.join(root, f)
-                header = open(fullpath).readline().strip()
-                if not header.startswith("status:"):
-                    logging.debug(
-                        "Skipping files with unknown header: '%s'" % f)
-                    continue
-                if self.keep_only_http200 and header != "status: 200":
-                    self._rm(fullpath)
-                if self.keep_time:
-                    mtime = os.path.getmtime(fullpath)
-                    logging.debug("mtime of '%s': '%s" % (f, mtime))
-                    if (mtime + self.keep_time) < now:
-                        self._rm(fullpath)
+        pool = ThreadPool(self.workers)
+        try:
+            for root, dirs, files in os.walk(path):
+                self._cleanup_files(pool, root, files, now)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _cleanup_files(self, pool, root, files, now):
+        index = ExpungeIndex(root)
+        indexed = index.load()
+        files = [f for f in files if f != INDEX_FILE]
+        results = pool.map(
+            lambda f: self._scan_file(os.path.join(root, f), indexed.get(f)),
+            files)
+        entries = {}
+        for (f, result) in zip(files, results):
+            if result is None:
+                continue
+            (header, mtime, size) = result
+            if not header.startswith("status:"):
+                logging.debug(
+                    "Skipping files with unknown header: '%s'" % f)
+                continue
+            if self._is_expired(header, mtime, now):
+                self._rm(os.path.join(root, f), size)
+            else:
+                entries[f] = (header, int(mtime), size)
+        # only dirs with httplib2 files get a index
+        if (entries or indexed) and not self.dry_run:
+            index.write(entries)
 
     def clean(self):
+        """ clean the directories and return the number of bytes that
+            were reclaimed
+        """
         # go over the directories
         for d in self.dirs:
             lock = get_lock(os.path.join(d, "expunge.lock"))
@@ -77,3 +207,5 @@ class ExpungeCache(object):
                 release_lock(lock)
             else:
                 logging.info("dir '%s' locked by another process" % d)
+        logging.info("reclaimed %i bytes" % self.reclaimed)
+        return self.reclaimed
@@ -120,3 +120,10 @@ SOFTWARE_CENTER_CONFIG_FILE = os.path.join(
     SOFTWARE_CENTER_CONFIG_DIR, "softwarecenter.cfg")
 SOFTWARE_CENTER_ICON_CACHE_DIR = os.path.join(
     SOFTWARE_CENTER_CACHE_DIR, "icons")
+# the icons of the theme scaled to the sizes that are used (not on the
+# icon search path)
+SOFTWARE_CENTER_SCALED_ICON_CACHE_DIR = os.path.join(
+    SOFTWARE_CENTER_CACHE_DIR, "scaled-icons")
+# the files that are downloaded with the SimpleFileDownloader cache
+SOFTWARE_CENTER_DOWNLOAD_CACHE_DIR = os.path.join(
+    SOFTWARE_CENTER_CACHE_DIR, "download-cache")
@@ -22,6 +22,7 @@ from gi.repository import Gtk, GdkPixbuf
 import logging
 import os
 
+from collections import OrderedDict
 from gettext import gettext as _
 
 from softwarecenter.enums import (Icons,
@@ -29,7 +30,6 @@ from softwarecenter.enums import (Icons,
 
 
 from softwarecenter.utils import (
-    ExecutionTime,
     SimpleFileDownloader,
     split_icon_ext,
     capitalize_first_word,
@@ -38,14 +38,26 @@ from softwarecenter.utils import (
     )
 from softwarecenter.backend import get_install_backend
 from softwarecenter.backend.reviews import get_review_loader
-from softwarecenter.paths import SOFTWARE_CENTER_ICON_CACHE_DIR
+from softwarecenter.paths import (SOFTWARE_CENTER_ICON_CACHE_DIR,
+                                  SOFTWARE_CENTER_SCALED_ICON_CACHE_DIR,
+                                  )
+from softwarecenter.ui.gtk3.models.iconcache import (
+    IconLoader,
+    PixbufCache,
+    ScaledIconDiskCache,
+    get_icon_theme_key,
+    )
 
 import softwarecenter.paths
 from softwarecenter.db.categories import (
-    category_subcat, category_cat, CategoriesParser)
+    category_subcat, category_cat, get_category_registry)
 
 # global cache icons to speed up rendering
-_app_icon_cache = {}
+_app_icon_cache = PixbufCache()
+
+# the budget of the icon cache of a AppPropertiesHelper that does not use
+# the global one
+LOCAL_ICON_CACHE_BYTES = 2 * 1024 * 1024
 
 
 LOG = logging.getLogger(__name__)
@@ -104,9 +116,10 @@ class AppPropertiesHelper(GObject.GObject):
         self.cache = cache
 
         # get all categories
-        cat_parser = CategoriesParser(db)
-        self.all_categories = cat_parser.parse_applications_menu(
-            softwarecenter.paths.APP_INSTALL_PATH)
+        self.all_categories = get_category_registry().get_categories(
+            db, softwarecenter.paths.APP_INSTALL_PATH)
+        self._categories_by_name = dict(
+            (cat.untranslated_name, cat) for cat in self.all_categories)
 
         # reviews stats loader
         self.review_loader = get_review_loader(cache, db)
@@ -116,10 +129,19 @@ class AppPropertiesHelper(GObject.GObject):
         self.icon_size = icon_size
 
         self._missing_icon = None  # delay this until actually needed
+        # icons are loaded synchronously unless a subclass sets a loader
+        self.icon_loader = None
         if global_icon_cache:
             self.icon_cache = _app_icon_cache
         else:
-            self.icon_cache = {}
+            self.icon_cache = PixbufCache(LOCAL_ICON_CACHE_BYTES)
+        self.scaled_icon_cache = ScaledIconDiskCache(
+            SOFTWARE_CENTER_SCALED_ICON_CACHE_DIR, get_icon_theme_key(icons))
+        self.icons.connect("changed", self._on_icon_theme_changed)
+
+    def _on_icon_theme_changed(self, icons):
+        self.icon_cache.clear()
+        self.scaled_icon_cache.theme_key = get_icon_theme_key(icons)
 
     def _download_icon_and_show_when_ready(self, url, pkgname, icon_file_name):
         LOG.debug("did not find the icon locally, must download %s" %
@@ -133,7 +155,7 @@ class AppPropertiesHelper(GObject.GObject):
             # replace the icon in the icon_cache now that we've got the real
             # one
             icon_file = split_icon_ext(os.path.basename(image_file_path))
-            self.icon_cache[icon_file] = pb
+            self.icon_cache[(icon_file, self.icon_size)] = pb
             self.emit("needs-refresh", pkgname)
 
         if url is not None:
@@ -215,17 +237,32 @@ class AppPropertiesHelper(GObject.GObject):
             icon_file_name = split_icon_ext(full_icon_file_name)
             if icon_file_name:
                 icon_name = icon_file_name
-                if icon_name in self.icon_cache:
-                    return self.icon_cache[icon_name]
+                key = (icon_name, self.icon_size)
+                icon = self.icon_cache.get(key)
+                if icon is not None:
+                    return icon
+                # the IconLoader of the store is about to deliver it
+                if (self.icon_loader is not None and
+                        self.icon_loader.is_pending(key)):
+                    return self.missing_icon
                 # icons.load_icon takes between 0.001 to 0.01s on my
                 # machine, this is a significant burden because get_value
-                # is called *a lot*. caching is the only option
+                # is called *a lot*. caching is the only option, the
+                # scaled icons on disk avoid the lookups on a cold start
+                icon = self.scaled_icon_cache.get(icon_name, self.icon_size)
+                if icon is not None:
+                    self.icon_cache[key] = icon
+                    return icon
 
                 # look for the icon on the iconpath
-                if self.icons.has_icon(icon_name):
-                    icon = self.icons.load_icon(icon_name, self.icon_size, 0)
+                info = self.icons.lookup_icon(icon_name, self.icon_size, 0)
+                if info is not None:
+                    icon = info.load_icon()
                     if icon:
-                        self.icon_cache[icon_name] = icon
+                        self.icon_cache[key] = icon
+                        self.scaled_icon_cache.set(
+                            icon_name, self.icon_size, icon,
+                            info.get_filename())
                         return icon
                 elif self.db.get_icon_download_url(doc):
                     url = self.db.get_icon_download_url(doc)
@@ -234,11 +271,17 @@ class AppPropertiesHelper(GObject.GObject):
                         self.get_pkgname(doc),
                         full_icon_file_name)
                     # display the missing icon while the real one downloads
-                    self.icon_cache[icon_name] = self.missing_icon
+                    self.icon_cache[key] = self.missing_icon
         except GObject.GError as e:
             LOG.debug("get_icon returned '%s'" % e)
         return self.missing_icon
 
+    def get_icon_cache_stats(self):
+        """ return the hit rate statistics of the icon caches """
+        return {"memory": self.icon_cache.get_stats(),
+                "disk": self.scaled_icon_cache.get_stats(),
+               }
+
     def get_review_stats(self, doc):
         return self.review_loader.get_review_stats(self.get_application(doc))
 
@@ -254,9 +297,9 @@ class AppPropertiesHelper(GObject.GObject):
             otherwise it resorts to plain gettext
         """
         # look into parsed categories that use .directory translation
-        for cat in self.all_categories:
-            if cat.untranslated_name == catname:
-                return cat.name
+        cat = self._categories_by_name.get(catname)
+        if cat is not None:
+            return cat.name
         # try normal translation first
         translated_catname = _(catname)
         if translated_catname == catname:
@@ -305,6 +348,10 @@ class AppGenericStore(AppPropertiesHelper):
     # the amount of items to initially lo
     LOAD_INITIAL = 75
 
+    # the amount of rows around the visible ones whose icons are loaded
+    # in the background
+    ICON_PREFETCH = 50
+
     def __init__(self, db, cache, icons, icon_size, global_icon_cache):
         AppPropertiesHelper.__init__(self, db, cache, icons, icon_size,
                                      global_icon_cache)
@@ -317,6 +364,8 @@ class AppGenericStore(AppPropertiesHelper):
             self._on_transaction_started)
         self.backend.connect("transaction-finished",
             self._on_transaction_finished)
+        self.review_loader.connect("review-stats-changed",
+            self._on_review_stats_changed)
 
         # keep track of paths for transactions in progress
         self.transaction_path_map = {}
@@ -324,6 +373,11 @@ class AppGenericStore(AppPropertiesHelper):
         # active row path
         self.active_row = None
 
+        # load the icons of the visible rows in the background
+        self.icon_loader = IconLoader(self._on_icon_loaded)
+        # the rows that wait for a icon from the loader by icon key
+        self._icon_rows = {}
+
         self._in_progress = False
         self._break = False
 
@@ -368,43 +422,121 @@ class AppGenericStore(AppPropertiesHelper):
             self.row_changed(path, it)
             del self.transaction_path_map[pkgname]
 
-    def buffer_icons(self):
-
-        def buffer_icons():
-            #~ print "Buffering icons ..."
-            #t0 = GObject.get_current_time()
-            if self.current_matches is None:
-                return False
-            db = self.db.xapiandb
-            for m in self.current_matches:
-                doc = db.get_document(m.docid)
-
-                # calling get_icon is enough to cache the icon
-                self.get_icon(doc)
-
-                while Gtk.events_pending():
-                    Gtk.main_iteration()
+    def _on_review_stats_changed(self, review_loader, pkgnames):
+        # only redraw the loaded rows of the changed pkgs
+        def update_row(model, path, it, data):
+            doc = model.get_value(it, self.COL_ROW_DATA)
+            if (doc is not None and
+                    not isinstance(doc, CategoryRowReference) and
+                    self.get_pkgname(doc) in pkgnames):
+                self.row_changed(path, it)
+            return False
+        self.foreach(update_row, None)
+
+    def get_document_at(self, index):
+        """ return the document of the (top level) row at index or None,
+            used for the background icon loading
+        """
+        # stub
+        return None
 
-            #~ import sys
-            #~ t_lapsed = round(GObject.get_current_time() - t0, 3)
-            #~ print "Appstore buffered icons in %s seconds" % t_lapsed
-            #from softwarecenter.utils import get_nice_size
-            #~ cache_size = get_nice_size(sys.getsizeof(_app_icon_cache))
-            #~ print "Number of icons in cache: %s consuming: %sb" % (
-                #~ len(_app_icon_cache), cache_size)
-            return False    # remove from sources on completion
+    def get_n_documents(self):
+        # stub
+        return 0
 
-        if self.current_matches is not None:
-            GObject.idle_add(buffer_icons)
+    def _get_icon_prefetch_order(self, start, end):
+        """ return the row indices from start to end (inclusive) followed
+            by the ICON_PREFETCH ones around them
+        """
+        n_rows = self.get_n_documents()
+        end = min(end, n_rows - 1)
+        indices = range(max(start, 0), end + 1)
+        before = start - 1
+        after = end + 1
+        while (len(indices) < end - start + 1 + self.ICON_PREFETCH and
+               (before >= 0 or after < n_rows)):
+            # scrolling down is more likely so prefer the rows below
+            if after < n_rows:
+                indices.append(after)
+                after += 1
+            if before >= 0:
+                indices.append(before)
+                before -= 1
+        return indices
+
+    def _get_icon_job(self, doc):
+        """ return the (key, func, args) job for the IconLoader for the
+            icon of doc or None if it is cached or can not be loaded from
+            a file
+        """
+        icon_name = split_icon_ext(self.db.get_iconname(doc))
+        if not icon_name:
+            return None
+        key = (icon_name, self.icon_size)
+        if key in self.icon_cache:
+            return None
+        # the theme lookup is cheap, the loading and scaling is not
+        info = self.icons.lookup_icon(icon_name, self.icon_size, 0)
+        if info is None or not info.get_filename():
+            return None
+        return (key, self._load_icon_file, (icon_name, info.get_filename()))
+
+    def _load_icon_file(self, icon_name, filename):
+        # this runs in the IconLoader thread, so no Gtk calls in here
+        icon = self.scaled_icon_cache.get(icon_name, self.icon_size)
+        if icon is None:
+            icon = GdkPixbuf.Pixbuf.new_from_file_at_size(
+                filename, self.icon_size, self.icon_size)
+            self.scaled_icon_cache.set(
+                icon_name, self.icon_size, icon, filename)
+        return icon
+
+    def set_visible_range(self, start, end):
+        """ load the icons of the rows from start to end (inclusive) in
+            the background first and then those of the rows around them,
+            the icons of rows that are no longer in this window are not
+            loaded anymore
+        """
+        jobs = []
+        self._icon_rows = {}
+        for i in self._get_icon_prefetch_order(start, end):
+            doc = self.get_document_at(i)
+            if doc is None:
+                continue
+            job = self._get_icon_job(doc)
+            if job is None:
+                continue
+            key = job[0]
+            if key not in self._icon_rows:
+                jobs.append(job)
+                self._icon_rows[key] = []
+            self._icon_rows[key].append(i)
+        self.icon_loader.set_jobs(jobs)
+
+    def _on_icon_loaded(self, key, icon):
+        if icon is not None:
+            self.icon_cache[key] = icon
+        # if the icon could not be loaded get_icon() will try it again
+        for i in self._icon_rows.pop(key, []):
+            if i < len(self):
+                path = Gtk.TreePath(i)
+                self.row_changed(path, self.get_iter(path))
+        if len(self.icon_loader) == 0:
+            LOG.debug("icon cache stats: %s" % self.get_icon_cache_stats())
+
+    def cancel_icon_loading(self):
+        self._icon_rows = {}
+        self.icon_loader.cancel()
 
     def load_range(self, indices, step):
         # stub
         pass
 
 
-class AppListStore(Gtk.ListStore, AppGenericStore):
-    """ use for flat applist views. for large lists this appends rows approx
-        three times faster than the AppTreeStore equivalent
+class AppListStore(AppGenericStore, Gtk.TreeModel):
+    """ use for flat applist views. the rows are not stored, they are
+        created on demand from the matches, so setting even a big list
+        of matches is cheap
     """
 
     __gsignals__ = {
@@ -419,73 +551,170 @@ class AppListStore(Gtk.ListStore, AppGenericStore):
                             ),
         }
 
+    # the amount of created rows that are kept around
+    ROW_CACHE_SIZE = 500
+
     def __init__(self, db, cache, icons, icon_size=AppGenericStore.ICON_SIZE,
                  global_icon_cache=True):
         AppGenericStore.__init__(
             self, db, cache, icons, icon_size, global_icon_cache)
-        Gtk.ListStore.__init__(self)
-        self.set_column_types(self.COL_TYPES)
 
         self.current_matches = None
+        self._n_rows = 0
+        # the created rows (xapian.Document) by index, oldest first
+        self._rows = OrderedDict()
+        # the iters of the previous content get invalid on a change
+        self._stamp = 0
+
+    def _has_row_listeners(self):
+        """ return True if something (e.g. a view) listens to the row
+            signals
+        """
+        signal_id = GObject.signal_lookup("row-inserted", Gtk.TreeModel)
+        return GObject.signal_has_handler_pending(self, signal_id, 0, False)
+
+    def _set_n_rows(self, n_rows):
+        self._stamp += 1
+        self._rows.clear()
+        if not self._has_row_listeners():
+            self._n_rows = n_rows
+            return
+        # a attached view needs to know about each row, display_matches()
+        # detaches the view to avoid this
+        for i in reversed(range(n_rows, self._n_rows)):
+            self._n_rows = i
+            self.row_deleted(Gtk.TreePath(i))
+        for i in range(self._n_rows, n_rows):
+            self._n_rows = i + 1
+            path = Gtk.TreePath(i)
+            self.row_inserted(path, self.get_iter(path))
 
     def set_from_matches(self, matches):
         """ set the content of the liststore based on a list of
             xapian.MSetItems
         """
         LOG.debug("set_from_matches len(matches)='%s'" % len(matches))
+        self._set_n_rows(0)
         self.current_matches = matches
         n_matches = len(matches)
         if n_matches == 0:
             return
+        self._set_n_rows(n_matches)
 
         extent = min(self.LOAD_INITIAL, n_matches)
-
-        with ExecutionTime("store.append_initial"):
-            for doc in [m.document for m in matches][:extent]:
-                doc.available = doc.installed = doc.purchasable = None
-                self.append((doc,))
+        # until the view tells us what is visible
+        self.set_visible_range(0, extent - 1)
 
         if n_matches == extent:
             return
-
-        with ExecutionTime("store.append_placeholders"):
-            for i in range(n_matches - extent):
-                self.append()
-
         self.emit('appcount-changed', len(matches))
-        self.buffer_icons()
+
+    def _get_row(self, index):
+        """ return the document of the row at index, it is created if it
+            is not in the row cache
+        """
+        doc = self._rows.pop(index, None)
+        if doc is None:
+            doc = self.db.xapiandb.get_document(
+                self.current_matches[index].docid)
+            doc.available = doc.installed = doc.purchasable = None
+            if len(self._rows) >= self.ROW_CACHE_SIZE:
+                self._rows.popitem(last=False)
+        self._rows[index] = doc
+        return doc
 
     def load_range(self, indices, step):
+        """ create the rows from indices[0] on in advance """
         LOG.debug("load_range: %s %s" % (indices, step))
-        db = self.db.xapiandb
-        matches = self.current_matches
-
-        n_matches = len(matches or [])
-
         start = indices[0]
-        end = start + step
-
-        if end >= n_matches:
-            end = n_matches
-
+        end = min(start + step, self._n_rows)
         for i in range(start, end):
-            try:
-                row_content = self[(i,)][0]
-            except IndexError as e:
-                LOG.warn("failed to load rows: '%s'" % e)
-                break
-
-            if row_content:
-                continue
-            doc = db.get_document(matches[i].docid)
-            doc.available = doc.installed = doc.purchasable = None
-            self[(i,)][0] = doc
+            self._get_row(i)
+
+    def get_document_at(self, index):
+        doc = self._rows.get(index)
+        if doc is None and 0 <= index < self._n_rows:
+            # this does not add it to the row cache
+            doc = self.db.xapiandb.get_document(
+                self.current_matches[index].docid)
+        return doc
+
+    def get_n_documents(self):
+        return self._n_rows
+
+    def _on_review_stats_changed(self, review_loader, pkgnames):
+        # only rows that were created can be on the screen
+        for (i, doc) in self._rows.items():
+            if self.get_pkgname(doc) in pkgnames:
+                path = Gtk.TreePath(i)
+                self.row_changed(path, self.get_iter(path))
 
     def clear(self):
         # reset the tranaction map because it will now be invalid
         self.transaction_path_map = {}
+        self.cancel_icon_loading()
+        self._set_n_rows(0)
         self.current_matches = None
-        Gtk.ListStore.clear(self)
+
+    # Gtk.TreeModel implementation, the row index is kept in the
+    # user_data of the iter (+1 as a NULL user_data is not a valid iter)
+    def _make_iter(self, index):
+        it = Gtk.TreeIter()
+        it.stamp = self._stamp
+        it.user_data = index + 1
+        return it
+
+    def _get_index(self, it):
+        return it.user_data - 1
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return len(self.COL_TYPES)
+
+    def do_get_column_type(self, column):
+        return self.COL_TYPES[column]
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if len(indices) == 1 and 0 <= indices[0] < self._n_rows:
+            return (True, self._make_iter(indices[0]))
+        return (False, None)
+
+    def do_get_path(self, it):
+        return Gtk.TreePath(self._get_index(it))
+
+    def do_get_value(self, it, column):
+        return self._get_row(self._get_index(it))
+
+    def do_iter_next(self, it):
+        index = self._get_index(it) + 1
+        if index < self._n_rows:
+            it.user_data = index + 1
+            return True
+        return False
+
+    def do_iter_children(self, parent):
+        if parent is None and self._n_rows > 0:
+            return (True, self._make_iter(0))
+        return (False, None)
+
+    def do_iter_has_child(self, it):
+        return False
+
+    def do_iter_n_children(self, it):
+        if it is None:
+            return self._n_rows
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None and 0 <= n < self._n_rows:
+            return (True, self._make_iter(n))
+        return (False, None)
+
+    def do_iter_parent(self, child):
+        return (False, None)
 
 
 class AppTreeStore(Gtk.TreeStore, AppGenericStore):
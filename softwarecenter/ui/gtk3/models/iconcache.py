@@ -0,0 +1,334 @@
+# Copyright (C) 2012 Canonical
+#
+# Authors:
+#  Michael Vogt
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from gi.repository import GObject, GdkPixbuf, Gtk
+
+LOG = logging.getLogger(__name__)
+
+# the default budget for the pixel data of a PixbufCache
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# the default budget for the png files of a ScaledIconDiskCache
+DEFAULT_DISK_MAX_BYTES = 16 * 1024 * 1024
+
+
+def _get_hit_rate(hits, misses):
+    lookups = hits + misses
+    if lookups:
+        return float(hits) / lookups
+    return 0.0
+
+
+class PixbufCache(object):
+    """ A LRU cache of pixbufs (keyed by e.g. (icon name, size)) that is
+        bounded by the size of their pixel data
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+
+    @staticmethod
+    def get_pixbuf_size(pixbuf):
+        return pixbuf.get_rowstride() * pixbuf.get_height()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        pixbuf = self._entries.pop(key, None)
+        if pixbuf is None:
+            self.misses += 1
+            return default
+        # re-insert to mark it as most recently used
+        self._entries[key] = pixbuf
+        self.hits += 1
+        return pixbuf
+
+    def __getitem__(self, key):
+        pixbuf = self.get(key)
+        if pixbuf is None:
+            raise KeyError(key)
+        return pixbuf
+
+    def __setitem__(self, key, pixbuf):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._nbytes -= self.get_pixbuf_size(old)
+        self._entries[key] = pixbuf
+        self._nbytes += self.get_pixbuf_size(pixbuf)
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            (evicted_key, evicted) = self._entries.popitem(last=False)
+            self._nbytes -= self.get_pixbuf_size(evicted)
+
+    def clear(self, *args):
+        """ flush the cache (can be used as signal callback) """
+        self._entries.clear()
+        self._nbytes = 0
+
+    def get_stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": _get_hit_rate(self.hits, self.misses),
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+               }
+
+
+def get_icon_theme_key(icons):
+    """ return a string that identifies the theme and the search path of
+        the given Gtk.IconTheme
+    """
+    theme_name = ""
+    settings = Gtk.Settings.get_default()
+    if settings is not None:
+        theme_name = settings.get_property("gtk-icon-theme-name") or ""
+    return "%s:%s" % (theme_name, ":".join(icons.get_search_path()))
+
+
+class ScaledIconDiskCache(object):
+    """ Icons that are already looked up in the theme and scaled, stored
+        as png files keyed by theme, icon name and size
+
+        The file the icon was loaded from and its mtime are stored in
+        the png, an entry is only used if that file is unchanged. So a
+        cold start costs a png load and a stat() per icon instead of a
+        theme lookup.
+
+        The files are bounded by max_bytes, the least recently used ones
+        (by mtime, a hit touches the file) are removed first. That also
+        removes the files of a previous theme key as they are never hit.
+    """
+
+    def __init__(self, cachedir, theme_key, max_bytes=DEFAULT_DISK_MAX_BYTES):
+        self.cachedir = cachedir
+        self.theme_key = theme_key
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # filename -> [mtime, size], read from the cachedir on first set()
+        self._files = None
+        self._nbytes = 0
+        # the files that got their mtime updated in this run
+        self._touched = set()
+        # get() and set() are used from the IconLoader thread too
+        self._lock = threading.Lock()
+
+    def _get_path(self, icon_name, size):
+        key = "%s\0%s\0%s" % (self.theme_key, icon_name, size)
+        return os.path.join(
+            self.cachedir, hashlib.md5(key).hexdigest() + ".png")
+
+    def get(self, icon_name, size):
+        """ return the pixbuf for icon_name at size or None """
+        path = self._get_path(icon_name, size)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+            source = pixbuf.get_option("tEXt::source")
+            valid = (source and pixbuf.get_option("tEXt::mtime") ==
+                     "%f" % os.path.getmtime(source))
+        except (GObject.GError, OSError) as e:
+            LOG.debug("can not use cached icon '%s': %s" % (path, e))
+            valid = False
+        if not valid:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(path)
+        return pixbuf
+
+    def _touch(self, path):
+        """ mark the file at path as recently used """
+        if path in self._touched:
+            return
+        self._touched.add(path)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return
+        with self._lock:
+            name = os.path.basename(path)
+            if self._files is not None and name in self._files:
+                self._files[name][0] = time.time()
+
+    def _load_files(self):
+        self._files = {}
+        self._nbytes = 0
+        try:
+            names = os.listdir(self.cachedir)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith(".png"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cachedir, name))
+            except OSError:
+                continue
+            self._files[name] = [st.st_mtime, st.st_size]
+            self._nbytes += st.st_size
+
+    def _add_file(self, path):
+        """ account for the file at path and prune the cache """
+        with self._lock:
+            if self._files is None:
+                # the first write of this run, this picks up path too
+                self._load_files()
+            else:
+                name = os.path.basename(path)
+                old = self._files.pop(name, None)
+                if old is not None:
+                    self._nbytes -= old[1]
+                st = os.stat(path)
+                self._files[name] = [st.st_mtime, st.st_size]
+                self._nbytes += st.st_size
+            self._prune()
+
+    def _prune(self):
+        """ remove the least recently used files until the cache is
+            within max_bytes
+        """
+        if self._nbytes <= self.max_bytes:
+            return
+        by_age = sorted(self._files, key=lambda name: self._files[name][0])
+        # the newest file is always kept
+        for name in by_age[:-1]:
+            if self._nbytes <= self.max_bytes:
+                break
+            (mtime, size) = self._files.pop(name)
+            self._nbytes -= size
+            try:
+                os.remove(os.path.join(self.cachedir, name))
+            except OSError as e:
+                LOG.debug("can not remove cached icon '%s': %s" % (name, e))
+
+    def set(self, icon_name, size, pixbuf, source):
+        """ store the pixbuf that was loaded from the file source """
+        if not source:
+            return
+        path = self._get_path(icon_name, size)
+        tmp_path = path + ".new"
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            pixbuf.savev(tmp_path, "png",
+                         ["tEXt::source", "tEXt::mtime"],
+                         [source, "%f" % os.path.getmtime(source)])
+            os.rename(tmp_path, path)
+            self._add_file(path)
+        except (GObject.GError, OSError) as e:
+            LOG.debug("can not cache icon '%s': %s" % (icon_name, e))
+
+    def get_stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": _get_hit_rate(self.hits, self.misses),
+                "bytes": self._nbytes,
+               }
+
+
+class IconLoader(object):
+    """ Run icon loading jobs in a worker thread in the order of their
+        priority
+
+        The jobs are replaced as a whole by set_jobs() (e.g. whenever the
+        visible rows change), pending jobs that are not part of the new
+        set are cancelled. The callback is run from the main loop with
+        the key and the result of each job that finished.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._cond = threading.Condition()
+        self._jobs = OrderedDict()
+        # the keys of the jobs that are running or not yet delivered
+        self._running = set()
+        self._thread = None
+        self.cancelled = 0
+
+    def __len__(self):
+        with self._cond:
+            return len(self._jobs) + len(self._running)
+
+    def is_pending(self, key):
+        with self._cond:
+            return key in self._jobs or key in self._running
+
+    def set_jobs(self, jobs):
+        """ replace the pending jobs, jobs is a list of (key, func, args)
+            tuples with the most important first
+        """
+        with self._cond:
+            new_jobs = OrderedDict()
+            for (key, func, args) in jobs:
+                if key not in new_jobs and key not in self._running:
+                    new_jobs[key] = (func, args)
+            self.cancelled += len(set(self._jobs) - set(new_jobs))
+            self._jobs = new_jobs
+            if new_jobs and self._thread is None:
+                # we need to call idle_add from the worker thread
+                GObject.threads_init()
+                self._thread = threading.Thread(target=self._run,
+                                                name="IconLoader")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def cancel(self):
+        """ drop all the pending jobs """
+        self.set_jobs([])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                (key, (func, args)) = self._jobs.popitem(last=False)
+                self._running.add(key)
+            try:
+                result = func(*args)
+            except Exception:
+                LOG.exception("loading '%s' failed" % (key,))
+                result = None
+            GObject.idle_add(self._deliver, key, result)
+
+    def _deliver(self, key, result):
+        with self._cond:
+            self._running.discard(key)
+        self._callback(key, result)
+        return False
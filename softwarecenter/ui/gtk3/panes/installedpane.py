@@ -33,7 +33,8 @@ from softwarecenter.enums import (NonAppVisibility,
 from softwarecenter.utils import (
     wait_for_apt_cache_ready, utf8, ExecutionTime)
 from softwarecenter.db.categories import (CategoriesParser,
-                                          categories_sorted_by_name)
+                                          categories_sorted_by_name,
+                                          get_category_registry)
 from softwarecenter.ui.gtk3.models.appstore2 import (
     AppTreeStore, CategoryRowReference)
 from softwarecenter.ui.gtk3.widgets.menubutton import MenuButton
@@ -200,7 +201,8 @@ class InstalledPane(SoftwarePane, CategoriesParser):
         self.app_view.tree_view.connect("row-collapsed",
             self._on_row_collapsed)
 
-        self._all_cats = self.parse_applications_menu(APP_INSTALL_PATH)
+        self._all_cats = get_category_registry().get_categories(
+            self.db, APP_INSTALL_PATH)
         self._all_cats = categories_sorted_by_name(self._all_cats)
 
         # we do not support the search aid feature in the installedview
@@ -385,25 +387,23 @@ class InstalledPane(SoftwarePane, CategoriesParser):
             xfilter = AppFilter(self.db, self.cache)
             xfilter.set_installed_only(True)
 
-            for cat in self._all_cats:
-                # for each category do category query and append as a new
-                # node to tree_view
-                if not self._use_category(cat):
-                    continue
-                query = self.get_query_for_cat(cat)
-                LOG.debug("xfilter.installed_only: %s" %
-                    xfilter.installed_only)
-                enq.set_query(query,
-                              sortmode=SortMethods.BY_ALPHABET,
-                              nonapps_visible=self.nonapps_visible,
-                              filter=xfilter,
-                              nonblocking_load=False,
-                              persistent_duplicate_filter=(i > 0))
-
-                L = len(enq.matches)
-                if L:
-                    i += L
-                    docs = enq.get_documents()
+            # one sorted query for the installed apps of all categories,
+            # its matches are bucketed into the categories with a docid
+            # only query per category
+            cats = [cat for cat in self._all_cats if self._use_category(cat)]
+            enq.set_faceted_query(
+                [(cat.untranslated_name, self.get_query_for_cat(cat))
+                 for cat in cats],
+                sortmode=SortMethods.BY_ALPHABET,
+                nonapps_visible=self.nonapps_visible,
+                filter=xfilter)
+
+            for cat in cats:
+                # append each category with matches as a new node to
+                # tree_view
+                docs = enq.get_facet_documents(cat.untranslated_name)
+                if docs:
+                    i += len(docs)
                     self.cat_docid_map[cat.untranslated_name] = \
                                         set([doc.get_docid() for doc in docs])
                     model.set_category_documents(cat, docs)
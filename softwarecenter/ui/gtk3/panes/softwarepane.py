@@ -156,6 +156,9 @@ class SoftwarePane(Gtk.VBox, BasePane):
         self.enquirer = AppEnquire(cache, db)
         self._query_complete_handler = self.enquirer.connect(
                             "query-complete", self.on_query_complete)
+        # the blocking count queries (see quick_query_len) need their own
+        # enquirer, a new query cancels the pending one of the enquirer
+        self.count_enquirer = AppEnquire(cache, db)
 
         self.cache = cache
         self.db = db
@@ -422,13 +425,13 @@ class SoftwarePane(Gtk.VBox, BasePane):
             matches from this query
         """
         with ExecutionTime("enquirer.set_query() quick query"):
-            self.enquirer.set_query(
+            self.count_enquirer.set_query(
                                 query,
                                 limit=self.get_app_items_limit(),
                                 nonapps_visible=self.nonapps_visible,
                                 nonblocking_load=False,
                                 filter=self.state.filter)
-        return len(self.enquirer.matches)
+        return len(self.count_enquirer.matches)
 
     @wait_for_apt_cache_ready
     def _refresh_apps_with_apt_cache(self, query):
@@ -436,9 +439,10 @@ class SoftwarePane(Gtk.VBox, BasePane):
 
         self.app_view.configure_sort_method(self._is_in_search_mode())
 
-        # a nonblocking query calls on_query_complete once finished
-        with ExecutionTime("enquirer.set_query()"):
-            self.enquirer.set_query(
+        # a async query calls on_query_complete once finished, a newer
+        # query cancels the pending one
+        with ExecutionTime("enquirer.set_query_async()"):
+            self.enquirer.set_query_async(
                                 query,
                                 limit=self.get_app_items_limit(),
                                 sortmode=self.get_sort_mode(),
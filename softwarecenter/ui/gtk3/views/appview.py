@@ -191,10 +191,10 @@ class AppView(Gtk.VBox):
 
         model = self.get_model()
         # disconnect the model from the view before running
-        # set_from_matches to ensure that the _cell_data_func_cb is not
-        # run when the placeholder items are set, otherwise the purpose
-        # of the "load-on-demand" is gone and it leads to bugs like
-        # LP: #964433
+        # set_from_matches, the AppListStore then does not need to
+        # signal each row and the _cell_data_func_cb is not run for them,
+        # otherwise the purpose of the "load-on-demand" is gone and it
+        # leads to bugs like LP: #964433
         self.set_model(None)
         if model:
             model.set_from_matches(matches)
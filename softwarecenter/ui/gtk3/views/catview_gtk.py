@@ -52,6 +52,7 @@ from softwarecenter.db.enquire import AppEnquire
 from softwarecenter.db.categories import (Category,
                                           CategoriesParser,
                                           get_category_by_name,
+                                          get_category_registry,
                                           categories_sorted_by_name)
 from softwarecenter.db.utils import get_query_for_pkgnames
 from softwarecenter.distro import get_distro
@@ -242,13 +243,33 @@ class LobbyViewGtk(CategoriesViewGtk):
         # ensure that updates to the stats are reflected in the UI
         self.reviews_loader = get_review_loader(self.cache)
         self.reviews_loader.connect(
-            "refresh-review-stats-finished", self._on_refresh_review_stats)
+            "review-stats-changed", self._on_review_stats_changed)
 
     def _on_db_reopen(self, db):
         self._update_whats_new_content()
 
-    def _on_refresh_review_stats(self, reviews_loader, review_stats):
-        self._update_top_rated_content()
+    def _on_review_stats_changed(self, reviews_loader, pkgnames):
+        top_rated_cat = get_category_by_name(
+            self.categories, u"Top Rated")  # untranslated name
+        if top_rated_cat is None:
+            return
+        docs = top_rated_cat.get_documents(self.db)
+        tiles = self.top_rated.get_children()
+        pkgnames_shown = [tile.pkgname for tile in tiles]
+        helper = self.properties_helper
+        top_pkgnames = [helper.get_pkgname(doc)
+                        for doc in docs[:TOP_RATED_CAROUSEL_LIMIT]]
+        # a changed order needs a rebuild, otherwise only the tiles of
+        # the changed pkgs are updated
+        if top_pkgnames != pkgnames_shown:
+            self._update_top_rated_content()
+            return
+        for (tile, doc) in zip(tiles, docs):
+            if tile.pkgname not in pkgnames:
+                continue
+            if not tile.set_review_stats(helper.get_review_stats(doc)):
+                self._update_top_rated_content()
+                return
 
     def _build_homepage_view(self):
         # these methods add sections to the page
@@ -499,7 +520,8 @@ class LobbyViewGtk(CategoriesViewGtk):
         return
 
     def build(self, desktopdir):
-        self.categories = self.parse_applications_menu(desktopdir)
+        self.categories = get_category_registry().get_categories(
+            self.db, desktopdir)
         self.header = _('Departments')
         self._build_homepage_view()
         self.show_all()
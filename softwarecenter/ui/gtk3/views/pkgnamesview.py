@@ -22,7 +22,7 @@ from gi.repository import Pango
 import logging
 import os
 
-from softwarecenter.db.application import Application
+from softwarecenter.db.application import Application, AppDetails
 from softwarecenter.enums import Icons
 
 LOG = logging.getLogger(__name__)
@@ -47,14 +47,19 @@ class PackageNamesView(Gtk.TreeView):
         tr.set_property("ellipsize", Pango.EllipsizeMode.END)
         column = Gtk.TreeViewColumn(header, tr, markup=self.COL_TEXT)
         self.append_column(column)
-        for pkgname in sorted(pkgnames):
-            if (not pkgname in cache or
-                not cache[pkgname].installed):
-                continue
+        pkgnames = [pkgname for pkgname in sorted(pkgnames)
+                    if pkgname in cache and cache[pkgname].installed]
+        # look up the documents of all the packages at once
+        docs = db.get_xapian_documents(
+            [("", pkgname) for pkgname in pkgnames])
+        for (pkgname, doc) in zip(pkgnames, docs):
             s = "%s \n<small>%s</small>" % (
                 cache[pkgname].installed.summary.capitalize(), pkgname)
 
-            app_details = Application("", pkgname).get_details(db)
+            if doc is not None:
+                app_details = AppDetails(db, doc=doc)
+            else:
+                app_details = Application("", pkgname).get_details(db)
             proposed_icon = app_details.icon
             if not proposed_icon or not icons.has_icon(proposed_icon):
                 proposed_icon = Icons.MISSING_APP
@@ -18,6 +18,7 @@ from softwarecenter.netstatus import (get_network_watcher,
                                       network_state_is_connected)
 from softwarecenter.ui.gtk3.models.appstore2 import (
     AppGenericStore, CategoryRowReference)
+from softwarecenter.ui.gtk3.widgets.thumbnail import prefetch_screenshot
 
 
 LOG = logging.getLogger(__name__)
@@ -34,6 +35,10 @@ class AppTreeView(Gtk.TreeView):
 
     ACTION_BTNS = (VARIANT_REMOVE, VARIANT_INSTALL, VARIANT_PURCHASE)
 
+    # ms the selection has to stay on a row before the screenshots of
+    # the rows next to it are prefetched
+    SCREENSHOT_PREFETCH_DELAY = 500
+
     def __init__(self, app_view, db, icons, show_ratings, store=None):
         Gtk.TreeView.__init__(self)
         self._logger = logging.getLogger("softwarecenter.view.appview")
@@ -123,6 +128,18 @@ class AppTreeView(Gtk.TreeView):
         self._transactions_connected = False
         self.connect('realize', self._on_realize, self._renderer)
 
+        # tell the model which rows are visible so that it loads their
+        # icons first
+        self._visible_range_source_id = None
+        self._vadjustment_handler = None
+        self.connect("size-allocate", self._queue_visible_range_update)
+        self.connect("notify::vadjustment", self._on_vadjustment_changed)
+
+        # the screenshots of the rows next to the selected one are
+        # downloaded ahead of time
+        self._prefetch_source_id = None
+        self._prefetch_loaders = []
+
     @property
     def appmodel(self):
         model = self.get_model()
@@ -154,6 +171,7 @@ class AppTreeView(Gtk.TreeView):
         Gtk.TreeView.set_model(self, model)
         self._column.set_cell_data_func(
             self._renderer, self._cell_data_func_cb)
+        self._queue_visible_range_update()
 
     def expand_path(self, path):
         if path is not None and not isinstance(path, Gtk.TreePath):
@@ -182,6 +200,74 @@ class AppTreeView(Gtk.TreeView):
 
         model.row_changed(path, model.get_iter(path))
 
+    def _on_vadjustment_changed(self, view, pspec):
+        if self._vadjustment_handler is not None:
+            (adjustment, handler) = self._vadjustment_handler
+            adjustment.disconnect(handler)
+            self._vadjustment_handler = None
+        adjustment = self.get_vadjustment()
+        if adjustment is not None:
+            handler = adjustment.connect("value-changed",
+                                         self._queue_visible_range_update)
+            self._vadjustment_handler = (adjustment, handler)
+
+    def _queue_visible_range_update(self, *args):
+        # coalesce the updates of a scroll into one
+        if self._visible_range_source_id is None:
+            self._visible_range_source_id = GObject.idle_add(
+                self._update_visible_range)
+
+    def _update_visible_range(self):
+        self._visible_range_source_id = None
+        model = self.get_model()
+        visible_range = self.get_visible_range()
+        if model is None or not visible_range:
+            return False
+        (start, end) = visible_range
+        if isinstance(model, Gtk.TreeModelFilter):
+            start = model.convert_path_to_child_path(start)
+            end = model.convert_path_to_child_path(end)
+            model = model.get_model()
+        if start is not None and end is not None:
+            model.set_visible_range(start.get_indices()[0],
+                                    end.get_indices()[0])
+        return False
+
+    def _queue_screenshot_prefetch(self, model, path):
+        if self._prefetch_source_id is not None:
+            GObject.source_remove(self._prefetch_source_id)
+        self._prefetch_source_id = GObject.timeout_add(
+            self.SCREENSHOT_PREFETCH_DELAY, self._prefetch_screenshots,
+            model, path.copy())
+
+    def _prefetch_screenshots(self, model, path):
+        self._prefetch_source_id = None
+        # the neighbours of the previous selection are not needed anymore
+        for loader in self._prefetch_loaders:
+            loader.cancel()
+        self._prefetch_loaders = []
+        if model is not self.get_model():
+            return False
+        neighbours = []
+        prev_path = path.copy()
+        if prev_path.prev():
+            neighbours.append(prev_path)
+        next_path = path.copy()
+        next_path.next()
+        neighbours.append(next_path)
+        for neighbour in neighbours:
+            try:
+                rowref = model[neighbour][AppGenericStore.COL_ROW_DATA]
+            except (ValueError, IndexError):
+                continue
+            if rowref is None or self.rowref_is_category(rowref):
+                continue
+            app = self.appmodel.get_application(rowref)
+            loader = prefetch_screenshot(app.get_details(self.db))
+            if loader is not None:
+                self._prefetch_loaders.append(loader)
+        return False
+
     def get_scrolled_window_vadjustment(self):
         ancestor = self.get_ancestor(Gtk.ScrolledWindow)
         if ancestor:
@@ -328,6 +414,8 @@ class AppTreeView(Gtk.TreeView):
         if self.rowref_is_category(app):
             return False
 
+        self._queue_screenshot_prefetch(model, row)
+
         action_btn = tr.get_button_by_name(
                             CellButtonIDs.ACTION)
         #if not action_btn: return False
@@ -527,12 +615,6 @@ class AppTreeView(Gtk.TreeView):
     def _cell_data_func_cb(self, col, cell, model, it, user_data):
         path = model.get_path(it)
 
-        # this will pre-load data *only* on a AppListStore, it has
-        # no effect with a AppTreeStore
-        if model[path][0] is None:
-            indices = path.get_indices()
-            model.load_range(indices, 5)
-
         if path in self._needs_collapse:
             # collapse rows that were outside the visible range and
             # thus not immediately collapsed when expand_path was called
@@ -170,11 +170,13 @@ class FeaturedTile(TileButton):
 
     INSTALLED_OVERLAY_SIZE = 22
     _MARKUP = '<b><small>%s</small></b>'
+    _N_RATINGS_MARKUP = '<span font_desc="%i"> (%i)</span>'
 
     def __init__(self, helper, doc, icon_size=48):
         TileButton.__init__(self)
         self._pressed = False
 
+        self.pkgname = helper.get_pkgname(doc)
         label = helper.get_appname(doc)
         icon = helper.get_icon_at_size(doc, icon_size, icon_size)
         stats = helper.get_review_stats(doc)
@@ -223,8 +225,7 @@ class FeaturedTile(TileButton):
                 StockEms.SMALL)
             self.rating_box.pack_start(self.stars, False, False, 0)
             self.n_ratings = Gtk.Label.new(
-                '<span font_desc="%i"> (%i)</span>' % (
-                    em(0.45), stats.ratings_total))
+                self._N_RATINGS_MARKUP % (em(0.45), stats.ratings_total))
             self.n_ratings.set_use_markup(True)
             self.n_ratings.set_name("subtle-label")
             self.n_ratings.set_alignment(0.0, 0.5)
@@ -282,6 +283,17 @@ class FeaturedTile(TileButton):
         icon = helper.get_icon_at_size(doc, icon_size, icon_size)
         _update_icon(self.image, icon, icon_size)
 
+    def set_review_stats(self, stats):
+        """ update the displayed rating, returns False if the tile has
+            no rating to update and needs to be rebuild
+        """
+        if stats is None or not hasattr(self, "stars"):
+            return False
+        self.stars.set_rating(stats.ratings_average)
+        self.n_ratings.set_markup(
+            self._N_RATINGS_MARKUP % (em(0.45), stats.ratings_total))
+        return True
+
     def do_get_preferred_width(self):
         w = _global_featured_tile_width
         return w, w
@@ -24,7 +24,7 @@ import logging
 import os
 
 from softwarecenter.db.pkginfo import get_pkg_info
-from softwarecenter.utils import SimpleFileDownloader
+from softwarecenter.utils import DownloadScheduler, SimpleFileDownloader
 
 from imagedialog import SimpleShowImageDialog
 
@@ -161,6 +161,7 @@ class ScreenshotGallery(Gtk.VBox):
     def _on_destroy(self, widget):
         # we need to disconnect here otherwise gtk segfaults when it
         # tries to set a already destroyed gtk image
+        self.loader.cancel()
         self.loader.disconnect_by_func(
             self._on_screenshot_download_complete)
         self.loader.disconnect_by_func(
@@ -377,6 +378,21 @@ class ScreenshotGallery(Gtk.VBox):
         pass
 
 
+def prefetch_screenshot(app_details):
+    """ download the screenshot of app_details into the cache (with a low
+        priority) so that it is there once the app is shown, returns the
+        SimpleFileDownloader (to cancel it) or None
+    """
+    if not (ScreenshotGallery.USE_CACHING and
+            app_details.thumbnail and app_details.screenshot):
+        return None
+    loader = SimpleFileDownloader()
+    loader.download_file(app_details.screenshot,
+                         use_cache=True,
+                         priority=DownloadScheduler.PRIORITY_PREFETCH)
+    return loader
+
+
 class Thumbnail(Gtk.Button):
 
     def __init__(self, id_, url, cancellable, gallery):
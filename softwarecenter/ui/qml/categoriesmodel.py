@@ -29,7 +29,7 @@ from gi.repository import Gtk
 from PyQt4.QtCore import QAbstractListModel, QModelIndex
 #from PyQt4.QtGui import QIcon
 
-from softwarecenter.db.categories import CategoriesParser
+from softwarecenter.db.categories import get_category_registry
 from softwarecenter.db.database import StoreDatabase
 from softwarecenter.db.pkginfo import get_pkg_info
 from softwarecenter.paths import XAPIAN_BASE_PATH
@@ -54,9 +54,8 @@ class CategoriesModel(QAbstractListModel):
         db = StoreDatabase(pathname, cache)
         db.open()
         # /FIXME
-        self.catparser = CategoriesParser(db)
-        self._categories = self.catparser.parse_applications_menu(
-            softwarecenter.paths.APP_INSTALL_PATH)
+        self._categories = get_category_registry().get_categories(
+            db, softwarecenter.paths.APP_INSTALL_PATH)
 
     # QAbstractListModel code
     def rowCount(self, parent=QModelIndex()):
@@ -24,7 +24,7 @@ from PyQt4.QtCore import QAbstractListModel, QModelIndex, pyqtSlot
 
 from softwarecenter.db.database import StoreDatabase, Application
 from softwarecenter.db.pkginfo import get_pkg_info
-from softwarecenter.db.categories import CategoriesParser
+from softwarecenter.db.categories import get_category_registry
 from softwarecenter.paths import XAPIAN_BASE_PATH
 from softwarecenter.backend import get_install_backend
 from softwarecenter.backend.reviews import get_review_loader
@@ -58,9 +58,8 @@ class PkgListModel(QAbstractListModel):
                              self._on_backend_transaction_progress_changed)
         self.reviews = get_review_loader(self.cache)
         # FIXME: get this from a parent
-        self._catparser = CategoriesParser(self.db)
-        self._categories = self._catparser.parse_applications_menu(
-            '/usr/share/app-install')
+        self._categories = get_category_registry().get_categories(
+            self.db, '/usr/share/app-install')
 
     # QAbstractListModel code
     def rowCount(self, parent=QModelIndex()):
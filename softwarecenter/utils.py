@@ -20,6 +20,7 @@ import dbus
 import gettext
 from gi.repository import GObject
 from gi.repository import Gio
+import heapq
 import logging
 import math
 import os
@@ -38,7 +39,7 @@ except ImportError:
     from urlparse import urlsplit
 
 from enums import Icons, APP_INSTALL_PATH_DELIMITER
-from paths import SOFTWARE_CENTER_CACHE_DIR
+from softwarecenter.downloadcache import get_download_cache
 
 from config import get_config
 
@@ -735,6 +736,156 @@ def safe_makedirs(dir_path):
                 raise
 
 
+class DownloadScheduler(object):
+    """ Run the downloads of urls (with Gio) for the whole process
+
+        The number of downloads that run at the same time is limited in
+        total and per host, the waiting ones are started in the order of
+        their priority (lower values first). A url that is requested
+        again while its download is waiting or running is not downloaded
+        twice, the new callback is just added to it.
+    """
+
+    # for what the user is looking at and for what may be needed next
+    PRIORITY_VISIBLE = 0
+    PRIORITY_PREFETCH = 10
+
+    MAX_RUNNING = 6
+    MAX_RUNNING_PER_HOST = 2
+
+    def __init__(self, max_running=MAX_RUNNING,
+                 max_running_per_host=MAX_RUNNING_PER_HOST):
+        self.max_running = max_running
+        self.max_running_per_host = max_running_per_host
+        # url -> _DownloadRequest
+        self._requests = {}
+        # heap of (priority, serial, request), entries of requests that
+        # are running, cancelled or got a new priority are skipped
+        self._queue = []
+        self._serial = 0
+        self._running = 0
+        self._running_by_host = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def download(self, url, callback, priority=PRIORITY_VISIBLE):
+        """ download url and call callback(url, content, etag, error)
+            from the main loop, content is None if the download failed
+        """
+        request = self._requests.get(url)
+        if request is None:
+            request = _DownloadRequest(url, priority)
+            self._requests[url] = request
+            self._push(request)
+        else:
+            self.coalesced += 1
+            if priority < request.priority and not request.running:
+                request.priority = priority
+                self._push(request)
+        request.callbacks.append(callback)
+        self._run_queue()
+
+    def cancel(self, url, callback):
+        """ do not call callback for url, the download is stopped if no
+            other callback is waiting for it
+        """
+        request = self._requests.get(url)
+        if request is None or callback not in request.callbacks:
+            return
+        request.callbacks.remove(callback)
+        if not request.callbacks:
+            del self._requests[url]
+            if request.running:
+                request.cancellable.cancel()
+
+    def is_pending(self, url):
+        return url in self._requests
+
+    def _push(self, request):
+        self._serial += 1
+        heapq.heappush(self._queue,
+                       (request.priority, self._serial, request))
+
+    def _run_queue(self):
+        deferred = []
+        while self._queue and self._running < self.max_running:
+            entry = heapq.heappop(self._queue)
+            (priority, serial, request) = entry
+            if (self._requests.get(request.url) is not request or
+                    request.running or request.priority != priority):
+                continue
+            if (self._running_by_host.get(request.host, 0) >=
+                    self.max_running_per_host):
+                deferred.append(entry)
+                continue
+            self._start(request)
+        for entry in deferred:
+            heapq.heappush(self._queue, entry)
+
+    def _start(self, request):
+        LOG.debug("download '%s' (priority %s)" % (
+                request.url, request.priority))
+        request.running = True
+        request.cancellable = Gio.Cancellable()
+        self._running += 1
+        self._running_by_host[request.host] = (
+            self._running_by_host.get(request.host, 0) + 1)
+        self.started += 1
+        f = Gio.File.new_for_uri(request.url)
+        f.load_contents_async(
+            request.cancellable, self._on_download_complete, request)
+
+    def _on_download_complete(self, f, result, request):
+        self._running -= 1
+        self._running_by_host[request.host] -= 1
+        content = None
+        etag = None
+        error = None
+        try:
+            res, content, etag = f.load_contents_finish(result)
+        except Exception as e:
+            # this is a GObject.GError most of the time but e.g. a
+            # dbus error of gvfs was seen as well
+            error = e
+        if self._requests.get(request.url) is request:
+            del self._requests[request.url]
+            for callback in request.callbacks:
+                try:
+                    callback(request.url, content, etag, error)
+                except Exception:
+                    LOG.exception("callback for '%s' failed" % request.url)
+        self._run_queue()
+
+    def get_stats(self):
+        return {"started": self.started,
+                "coalesced": self.coalesced,
+                "running": self._running,
+                "waiting": len([r for r in self._requests.values()
+                                if not r.running]),
+               }
+
+
+class _DownloadRequest(object):
+
+    def __init__(self, url, priority):
+        self.url = url
+        self.host = urlsplit(url).netloc
+        self.priority = priority
+        self.callbacks = []
+        self.running = False
+        self.cancellable = None
+
+
+_download_scheduler = None
+
+
+def get_download_scheduler():
+    global _download_scheduler
+    if _download_scheduler is None:
+        _download_scheduler = DownloadScheduler()
+    return _download_scheduler
+
+
 class SimpleFileDownloader(GObject.GObject):
 
     LOG = logging.getLogger("softwarecenter.simplefiledownloader")
@@ -757,29 +908,29 @@ class SimpleFileDownloader(GObject.GObject):
     def __init__(self):
         GObject.GObject.__init__(self)
         self.tmpdir = None
-        self._cancellable = None
+        self.use_cache = False
+        self._pending_url = None
 
     def download_file(self, url, dest_file_path=None, use_cache=False,
-                      simple_quoting_for_webkit=False):
+                      simple_quoting_for_webkit=False,
+                      priority=DownloadScheduler.PRIORITY_VISIBLE):
         """ Download a url and emit the file-download-complete
             once the file is there. Note that calling this twice
             will cancel the previous pending operation.
             If dest_file_path is given, download to that specific
             local filename.
             If use_cache is given it will not use a tempdir, but
-            instead a permanent cache dir - no etag or timestamp
-            checks are performed.
+            instead the DownloadCache, a cached file is used right away
+            and revalidated in the background once it is old.
+            The download is run by the shared DownloadScheduler with
+            the given priority.
         """
         self.LOG.debug("download_file: %s %s %s" % (
                 url, dest_file_path, use_cache))
 
         # cancel anything pending to avoid race conditions
         # like bug #839462
-        if self._cancellable:
-            self._cancellable.cancel()
-            self._cancellable.reset()
-        else:
-            self._cancellable = Gio.Cancellable()
+        self.cancel()
 
         # no need to cache file urls and no need to really download
         # them, its enough to adjust the dest_file_path
@@ -789,11 +940,9 @@ class SimpleFileDownloader(GObject.GObject):
 
         # if the cache is used, we use that as the dest_file_path
         if use_cache:
-            cache_path = os.path.join(
-                SOFTWARE_CENTER_CACHE_DIR, "download-cache")
-            if not os.path.exists(cache_path):
-                os.makedirs(cache_path)
-            dest_file_path = os.path.join(cache_path, uri_to_filename(url))
+            cache = get_download_cache()
+            dest_file_path = os.path.join(
+                cache.cachedir, uri_to_filename(url))
             if simple_quoting_for_webkit:
                 dest_file_path = dest_file_path.replace("%", "")
                 dest_file_path = dest_file_path.replace("?", "")
@@ -806,59 +955,59 @@ class SimpleFileDownloader(GObject.GObject):
 
         self.url = url
         self.dest_file_path = dest_file_path
+        self.use_cache = use_cache
 
-        # FIXME: we actually need to do etag based checking here to see
-        #        if the source needs refreshing
-        if os.path.exists(self.dest_file_path):
+        if use_cache:
+            is_cached = cache.lookup(self.dest_file_path) is not None
+            if is_cached and cache.needs_revalidation(self.dest_file_path):
+                cache.revalidate(url, self.dest_file_path)
+        else:
+            is_cached = os.path.exists(self.dest_file_path)
+        if is_cached:
             self.emit('file-url-reachable', True)
             self.emit("file-download-complete", self.dest_file_path)
             return
 
-        f = Gio.File.new_for_uri(url)
-        # first check if the url is reachable
-        f.query_info_async(Gio.FILE_ATTRIBUTE_STANDARD_SIZE, 0, 0,
-                           self._cancellable,
-                           self._check_url_reachable_and_then_download_cb,
-                           None)
-
-    def _check_url_reachable_and_then_download_cb(self, f, result,
-                                                  user_data=None):
-        self.LOG.debug("_check_url_reachable_and_then_download_cb: %s" % f)
-        try:
-            info = f.query_info_finish(result)
-            etag = info.get_etag()
-            self.emit('file-url-reachable', True)
-            self.LOG.debug("file reachable %s %s %s" % (self.url,
-                                                        info,
-                                                        etag))
-            # url is reachable, now download the file
-            f.load_contents_async(
-                self._cancellable, self._file_download_complete_cb, None)
-        except GObject.GError as e:
-            self.LOG.debug("file *not* reachable %s" % self.url)
-            self.emit('file-url-reachable', False)
-            self.emit('error', GObject.GError, e)
-        del f
-
-    def _file_download_complete_cb(self, f, result, path=None):
-        self.LOG.debug("file download completed %s" % self.dest_file_path)
-        # The result from the download is actually a tuple with three
-        # elements (content, size, etag?)
-        # The first element is the actual content so let's grab that
-        try:
-            res, content, etag = f.load_contents_finish(result)
-        except Exception as e:
-            # i witnissed a strange error[1], so make the loader robust in this
-            # situation
+        # there is no separate reachability check, a url that is not
+        # reachable is reported once the download failed
+        self._pending_url = url
+        get_download_scheduler().download(
+            url, self._file_download_complete_cb, priority)
+
+    def cancel(self):
+        """ cancel the pending download (if any) """
+        if self._pending_url is not None:
+            get_download_scheduler().cancel(
+                self._pending_url, self._file_download_complete_cb)
+            self._pending_url = None
+
+    def _file_download_complete_cb(self, url, content, etag, error):
+        self._pending_url = None
+        if error is not None:
+            # i witnissed a strange error[1], so make the loader robust in
+            # this situation
             # 1. content = f.load_contents_finish(result)[0]
             #    Gio.Error: DBus error org.freedesktop.DBus.Error.NoReply
-            self.LOG.debug(e)
-            self.emit('error', Exception, e)
+            self.LOG.debug("file *not* reachable %s (%s)" % (url, error))
+            self.emit('file-url-reachable', False)
+            self.emit('error', GObject.GError, error)
             return
-        # write out the data
-        outputfile = open(self.dest_file_path, "w")
-        outputfile.write(content)
-        outputfile.close()
+        self.LOG.debug("file download completed %s" % self.dest_file_path)
+        self.emit('file-url-reachable', True)
+        # write out the data, atomically so that a partial file is
+        # never taken for a complete one
+        if self.use_cache:
+            stored = get_download_cache().store(
+                url, self.dest_file_path, content, etag)
+            if not stored:
+                self.emit('error', IOError,
+                          IOError("can not cache '%s'" % url))
+                return
+        else:
+            tmp_path = self.dest_file_path + ".new"
+            with open(tmp_path, "w") as outputfile:
+                outputfile.write(content)
+            os.rename(tmp_path, self.dest_file_path)
         self.emit('file-download-complete', self.dest_file_path)
 
 
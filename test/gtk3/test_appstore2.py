@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
+import time
 import unittest
 import xapian
 
@@ -49,26 +50,54 @@ class TestAppstore(unittest.TestCase):
         self.assertEqual(len(model), 0)
         model.set_from_matches(enquirer.matches)
         self.assertTrue(len(model) > 0)
+        self.assertEqual(len(model), len(enquirer.matches))
         # ensure the first row has a xapian doc type
         self.assertEqual(type(model[0][0]), xapian.Document)
-        # lazy loading of the docs
-        self.assertEqual(model[100][0], None)
+        # the rows are created on demand
+        self.assertFalse(100 in model._rows)
+        self.assertEqual(type(model[100][0]), xapian.Document)
+        self.assertTrue(100 in model._rows)
+        # the same row is returned until it drops out of the row cache
+        self.assertTrue(model[100][0] is model[100][0])
+        self.assertEqual(model.get_pkgname(model[100][0]),
+            self.db.get_pkgname(self.db.xapiandb.get_document(
+                enquirer.matches[100].docid)))
+        # iterating works
+        self.assertEqual(len([row for row in model]), len(model))
 
         # test the load range stuff
-        model.load_range(indices=[100], step=15)
-        self.assertEqual(type(model[100][0]), xapian.Document)
+        model.load_range(indices=[200], step=15)
+        self.assertTrue(214 in model._rows)
 
-        # ensure buffer_icons works and loads stuff into the cache
-        model.buffer_icons()
+        # ensure the icons of the visible rows are loaded in the background
+        model.set_visible_range(100, 110)
         self.assertEqual(len(model.icon_cache), 0)
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+        while len(model.icon_loader) > 0:
+            while Gtk.events_pending():
+                Gtk.main_iteration()
+            time.sleep(0.01)
         self.assertTrue(len(model.icon_cache) > 0)
 
         # ensure clear works
         model.clear()
         self.assertEqual(model.current_matches, None)
-        
+        self.assertEqual(len(model), 0)
+
+    def test_app_store_row_signals(self):
+        enquirer = AppEnquire(self.cache, self.db)
+        enquirer.set_query(xapian.Query(""))
+        model = AppListStore(self.db, self.cache, self.icons)
+        # a attached view is told about each row
+        signals = []
+        model.connect("row-inserted",
+            lambda model, path, it: signals.append("inserted"))
+        model.connect("row-deleted",
+            lambda model, path: signals.append("deleted"))
+        model.set_from_matches(enquirer.matches[:10])
+        self.assertEqual(signals, ["inserted"] * 10)
+        model.clear()
+        self.assertEqual(signals, ["inserted"] * 10 + ["deleted"] * 10)
+
 
 if __name__ == "__main__":
     import logging
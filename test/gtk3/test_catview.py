@@ -46,10 +46,53 @@ class CatViewBaseTestCase(unittest.TestCase):
 
 class TopAndWhatsNewTestCase(CatViewBaseTestCase):
 
+    def _make_review_stats(self, ratings_average, ratings_total):
+        stats = Mock()
+        stats.ratings_average = ratings_average
+        stats.ratings_total = ratings_total
+        return stats
+
     def test_top_rated(self):
-        # simulate review-stats refresh
-        self.lobby._update_top_rated_content = Mock()
-        self.lobby.reviews_loader.emit("refresh-review-stats-finished", [])
+        # the test db has no review stats, so use a fixed set of rated
+        # apps as the top rated ones
+        helper = self.lobby.properties_helper
+        xapiandb = self.db.xapiandb
+        docs_by_pkgname = {}
+        for item in xapiandb.postlist("ATapplication"):
+            doc = xapiandb.get_document(item.docid)
+            docs_by_pkgname.setdefault(helper.get_pkgname(doc), doc)
+        pkgnames = sorted(docs_by_pkgname)[:3]
+        self.assertEqual(len(pkgnames), 3)
+        docs = [docs_by_pkgname[pkgname] for pkgname in pkgnames]
+        top_rated_cat = catview_gtk.get_category_by_name(
+            self.lobby.categories, u"Top Rated")
+        self.addCleanup(patch.stopall)
+        get_documents = patch.object(top_rated_cat, "get_documents").start()
+        get_documents.return_value = docs
+        get_review_stats = patch.object(helper, "get_review_stats").start()
+        get_review_stats.return_value = self._make_review_stats(4, 10)
+        self.lobby._update_top_rated_content()
+        tiles = self.lobby.top_rated.get_children()
+        self.assertEqual([tile.pkgname for tile in tiles], pkgnames)
+
+        # simulate review-stats refresh, unrelated changes do not
+        # rebuild the top rated tiles
+        patch.object(self.lobby, "_update_top_rated_content").start()
+        self.lobby.reviews_loader.emit("review-stats-changed",
+                                       set(["no-such-pkg"]))
+        self.assertFalse(self.lobby._update_top_rated_content.called)
+        # and changes of a shown pkg only update its tile
+        get_review_stats.return_value = self._make_review_stats(5, 42)
+        self.lobby.reviews_loader.emit("review-stats-changed",
+                                       set([tiles[1].pkgname]))
+        self.assertFalse(self.lobby._update_top_rated_content.called)
+        self.assertEqual(self.lobby.top_rated.get_children(), tiles)
+        self.assertEqual(tiles[1].n_ratings.get_text(), " (42)")
+        self.assertEqual(tiles[0].n_ratings.get_text(), " (10)")
+        # a changed order rebuilds them
+        get_documents.return_value = list(reversed(docs))
+        self.lobby.reviews_loader.emit("review-stats-changed",
+                                       set([tiles[1].pkgname]))
         self.assertTrue(self.lobby._update_top_rated_content.called)
 
         # test clicking top_rated
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from gi.repository import GdkPixbuf, Gtk
+
+from testutils import setup_test_env
+setup_test_env()
+from softwarecenter.ui.gtk3.models.iconcache import (IconLoader,
+                                                     PixbufCache,
+                                                     ScaledIconDiskCache,
+                                                     )
+
+
+def make_pixbuf(size):
+    return GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8,
+                                size, size)
+
+
+class TestPixbufCache(unittest.TestCase):
+
+    def test_byte_budget(self):
+        pixbuf = make_pixbuf(16)
+        nbytes = PixbufCache.get_pixbuf_size(pixbuf)
+        cache = PixbufCache(max_bytes=2 * nbytes)
+        cache[("a", 16)] = pixbuf
+        cache[("b", 16)] = pixbuf
+        # use "a" so that "b" is the least recently used one
+        self.assertEqual(cache.get(("a", 16)), pixbuf)
+        cache[("c", 16)] = pixbuf
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 2 * nbytes)
+        self.assertTrue(("a", 16) in cache)
+        self.assertFalse(("b", 16) in cache)
+        # replacing a entry does not count it twice
+        cache[("c", 16)] = pixbuf
+        self.assertEqual(cache.nbytes, 2 * nbytes)
+
+    def test_stats(self):
+        cache = PixbufCache()
+        cache[("a", 16)] = make_pixbuf(16)
+        cache.get(("a", 16))
+        cache.get(("b", 16))
+        self.assertRaises(KeyError, cache.__getitem__, ("b", 16))
+        stats = cache.get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        self.assertAlmostEqual(stats["hit_rate"], 1.0 / 3)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+
+class TestScaledIconDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.source = os.path.join(self.tmpdir, "icon.png")
+        make_pixbuf(64).savev(self.source, "png", [], [])
+        self.cache = ScaledIconDiskCache(
+            os.path.join(self.tmpdir, "cache"), "theme")
+
+    def test_round_trip(self):
+        self.assertEqual(self.cache.get("icon", 32), None)
+        self.cache.set("icon", 32, make_pixbuf(32), self.source)
+        pixbuf = self.cache.get("icon", 32)
+        self.assertEqual(pixbuf.get_width(), 32)
+        # other sizes and themes are separate entries
+        self.assertEqual(self.cache.get("icon", 48), None)
+        self.cache.theme_key = "other-theme"
+        self.assertEqual(self.cache.get("icon", 32), None)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 3)
+
+    def test_source_changed(self):
+        self.cache.set("icon", 32, make_pixbuf(32), self.source)
+        mtime = os.path.getmtime(self.source)
+        os.utime(self.source, (mtime + 10, mtime + 10))
+        self.assertEqual(self.cache.get("icon", 32), None)
+        os.unlink(self.source)
+        self.assertEqual(self.cache.get("icon", 32), None)
+
+    def test_byte_budget(self):
+        cachedir = self.cache.cachedir
+        for (i, name) in enumerate(["a", "b", "c", "d"]):
+            self.cache.set(name, 32, make_pixbuf(32), self.source)
+            # make the age of the files independent of the clock
+            path = self.cache._get_path(name, 32)
+            os.utime(path, (1000 + i, 1000 + i))
+        self.assertEqual(len(os.listdir(cachedir)), 4)
+        file_size = os.path.getsize(self.cache._get_path("a", 32))
+        # a restart with a smaller budget and another theme
+        cache = ScaledIconDiskCache(cachedir, "theme", file_size * 2)
+        # a hit marks "a" as recently used
+        self.assertNotEqual(cache.get("a", 32), None)
+        cache.theme_key = "other-theme"
+        cache.set("a", 32, make_pixbuf(32), self.source)
+        self.assertEqual(len(os.listdir(cachedir)), 2)
+        self.assertTrue(cache.get_stats()["bytes"] <= file_size * 2)
+        cache.theme_key = "theme"
+        self.assertNotEqual(cache.get("a", 32), None)
+        for name in ["b", "c", "d"]:
+            self.assertEqual(cache.get(name, 32), None)
+
+
+class TestIconLoader(unittest.TestCase):
+
+    def test_priority_and_cancel(self):
+        delivered = []
+        loader = IconLoader(lambda key, result: delivered.append(result))
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+            return "block"
+
+        loader.set_jobs([("block", block, ())])
+        started.wait(5)
+        # "a" scrolled out of the visible range before it was loaded
+        loader.set_jobs([("a", str, ("a",)), ("b", str, ("b",))])
+        loader.set_jobs([("c", str, ("c",)), ("b", str, ("b",))])
+        self.assertTrue(loader.is_pending("block"))
+        self.assertFalse(loader.is_pending("a"))
+        release.set()
+        while len(loader) > 0:
+            while Gtk.events_pending():
+                Gtk.main_iteration()
+            time.sleep(0.01)
+        self.assertEqual(delivered, ["block", "c", "b"])
+        self.assertEqual(loader.cancelled, 1)
+
+    def test_failed_job(self):
+        delivered = []
+        loader = IconLoader(lambda key, result: delivered.append(result))
+        loader.set_jobs([("error", int, ("not a number",))])
+        while len(loader) > 0:
+            while Gtk.events_pending():
+                Gtk.main_iteration()
+            time.sleep(0.01)
+        self.assertEqual(delivered, [None])
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
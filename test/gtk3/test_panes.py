@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 from gi.repository import Gtk, GObject
+import time
 import unittest
 
 from testutils import setup_test_env
@@ -16,6 +17,27 @@ class TestPanes(unittest.TestCase):
         GObject.timeout_add(TIMEOUT, lambda: win.destroy())
         Gtk.main()
 
+    def test_availablepane_quick_query_len(self):
+        from softwarecenter.ui.gtk3.panes.availablepane import get_test_window
+        win = get_test_window()
+        self.addCleanup(win.destroy)
+        pane = win.get_data("pane")
+        results = []
+        pane.enquirer.connect("query-complete",
+                              lambda enquirer: results.append(len(enquirer)))
+        # the count of a subcategory does not cancel the pending refresh
+        # of the app list (see display_subcategory_page)
+        pane.refresh_apps()
+        n_matches = pane.quick_query_len(pane.get_query())
+        self.assertTrue(n_matches > 0)
+        context = GObject.main_context_default()
+        for i in range(100):
+            if results:
+                break
+            context.iteration(False)
+            time.sleep(0.05)
+        self.assertEqual(results, [n_matches])
+
     def test_globalpane(self):
         from softwarecenter.ui.gtk3.panes.globalpane import get_test_window
         win = get_test_window()
@@ -6,11 +6,15 @@ import apt
 import datetime
 import logging
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
 import time
 import unittest
 
+from mock import patch
+
 from testutils import setup_test_env
 setup_test_env()
 
@@ -25,8 +29,8 @@ class TestAptHistory(unittest.TestCase):
         apt.apt_pkg.Config.set("Dir::Log", self.basedir)
         #apt_pkg.Config.set("Dir::Log::History", "./")
 
-    def _get_apt_history(self):
-        history = AptHistory(use_cache=False)
+    def _get_apt_history(self, use_cache=False):
+        history = AptHistory(use_cache=use_cache)
         main_loop = GObject.main_context_default()
         while main_loop.pending():
            main_loop.iteration()
@@ -90,6 +94,52 @@ class TestAptHistory(unittest.TestCase):
                 raise
         os.remove(new_history+".gz")
 
+    def test_history_index(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        logdir = os.path.join(tmpdir, "log")
+        shutil.copytree(self.basedir, logdir)
+        apt.apt_pkg.Config.set("Dir::Log", logdir)
+        self.addCleanup(apt.apt_pkg.Config.set, "Dir::Log", self.basedir)
+        with patch("softwarecenter.db.history_impl.apthistory."
+                   "SOFTWARE_CENTER_CACHE_DIR", tmpdir):
+            history = self._get_apt_history(use_cache=True)
+        self.assertEqual(len(history.transactions), 186)
+        self.assertTrue(os.path.exists(history.index_file))
+        self.assertEqual(history.get_installed_date("gnuplot"),
+                         datetime.datetime(2010, 6, 1, 9, 21))
+        self.assertEqual(history.get_installed_date("no-such-pkg"), None)
+        # a stanza that apt is still writing is not picked up
+        with open(history.history_file, "a") as f:
+            f.write("\nStart-Date: 2010-06-10  10:00:00\n"
+                    "Install: 2vcard (0.5-3)\n")
+        history._scan(history.history_file)
+        self.assertEqual(len(history.transactions), 186)
+        with open(history.history_file, "a") as f:
+            f.write("End-Date: 2010-06-10  10:01:00\n")
+        history._scan(history.history_file)
+        self.assertEqual(len(history.transactions), 187)
+        self.assertEqual(history.get_installed_date("2vcard"),
+                         datetime.datetime(2010, 6, 10, 10, 0))
+        history._save_index()
+        # a new instance uses the index, even for logs that are gone
+        os.remove(os.path.join(logdir, "history.log.1.gz"))
+        with patch("softwarecenter.db.history_impl.apthistory."
+                   "SOFTWARE_CENTER_CACHE_DIR", tmpdir):
+            history = self._get_apt_history(use_cache=True)
+        self.assertEqual(len(history.transactions), 187)
+        self.assertEqual(history.transactions[0].install,
+                         ["2vcard (0.5-3)"])
+        # a rotated live log is parsed again from the start
+        os.rename(history.history_file, history.history_file + ".1")
+        with open(history.history_file, "w") as f:
+            f.write("\nStart-Date: 2010-06-11  10:00:00\n"
+                    "Remove: 2vcard (0.5-3)\n"
+                    "End-Date: 2010-06-11  10:01:00\n")
+        history._scan(history.history_file)
+        self.assertEqual(len(history.transactions), 188)
+        self.assertEqual(history.transactions[0].remove, ["2vcard (0.5-3)"])
+
     def test_no_history_log(self):
         # set to dir with no existing history.log
         apt.apt_pkg.Config.set("Dir::Log", "/")
@@ -1,5 +1,8 @@
 #!/usr/bin/python
 
+import os
+import shutil
+import tempfile
 import unittest
 import xapian
 from mock import patch
@@ -9,6 +12,7 @@ setup_test_env()
 
 from softwarecenter.db.categories import (
     CategoriesParser,
+    CategoryRegistry,
     RecommendedForYouCategory,
     get_category_by_name, get_query_for_category)
 from softwarecenter.testutils import (get_test_db,
@@ -105,6 +109,58 @@ class TestCategoryTemplates(unittest.TestCase):
             "Xapian::Query((<alldocuments> AND XTregion::us))")
 
 
+class TestCategoryRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.db = get_test_db()
+        self.datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.datadir)
+        shutil.copytree("./data/desktop",
+                        os.path.join(self.datadir, "desktop"))
+        self.registry = CategoryRegistry()
+
+    def test_cached(self):
+        cats = self.registry.get_categories(self.db, self.datadir)
+        self.assertTrue(len(cats) > 0)
+        with patch.object(CategoriesParser, "parse_applications_menu") as m:
+            self.assertTrue(
+                self.registry.get_categories(self.db, self.datadir) is cats)
+            self.assertFalse(m.called)
+        cat = self.registry.get_category_by_name(
+            self.db, cats[0].untranslated_name, self.datadir)
+        self.assertTrue(cat is cats[0])
+        self.assertEqual(self.registry.get_category_by_name(
+            self.db, "no-such-category", self.datadir), None)
+        # the lookup by name does not check the menu files again
+        with patch.object(self.registry, "_get_key") as m:
+            self.registry.get_category_by_name(
+                self.db, cats[0].untranslated_name, self.datadir)
+            self.assertFalse(m.called)
+
+    def test_menu_changed(self):
+        cats = self.registry.get_categories(self.db, self.datadir)
+        menu = os.path.join(self.datadir, "desktop", "software-center.menu")
+        mtime = os.path.getmtime(menu)
+        os.utime(menu, (mtime + 10, mtime + 10))
+        new_cats = self.registry.get_categories(self.db, self.datadir)
+        self.assertFalse(new_cats is cats)
+        self.assertEqual([cat.untranslated_name for cat in new_cats],
+                         [cat.untranslated_name for cat in cats])
+
+    @patch("softwarecenter.db.categories.get_region_cached")
+    def test_region_changed(self, mock_get_region_cached):
+        mock_get_region_cached.return_value = {"countrycode": "us"}
+        cat = self.registry.get_category_by_name(
+            self.db, "Dynamic", self.datadir)
+        mock_get_region_cached.return_value = {"countrycode": "de"}
+        self.registry.get_categories(self.db, self.datadir)
+        cat = self.registry.get_category_by_name(
+            self.db, "Dynamic", self.datadir)
+        self.assertEqual(
+            "%s" % cat.query,
+            "Xapian::Query((<alldocuments> AND XTregion::de))")
+
+
 if __name__ == "__main__":
     #import logging
     #logging.basicConfig(level=logging.DEBUG)
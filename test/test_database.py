@@ -3,6 +3,7 @@
 import apt
 import os
 import re
+import shutil
 import tempfile
 import time
 import unittest
@@ -16,16 +17,27 @@ setup_test_env()
 
 import softwarecenter.paths
 from softwarecenter.db.application import Application, AppDetails
-from softwarecenter.db.database import StoreDatabase
+from softwarecenter.db.database import (
+    get_collation_locale,
+    LocaleSorter,
+    StoreDatabase,
+    )
 from softwarecenter.db.enquire import AppEnquire
 from softwarecenter.db.database import parse_axi_values_file
 from softwarecenter.db.pkginfo import get_pkg_info
 from softwarecenter.db.update import (
+    get_apt_lists_stamp,
+    get_index_sources,
+    IndexingSession,
+    IndexManifest,
     make_doc_from_parser,
     update_from_app_install_data,
     update_from_var_lib_apt_lists,
     update_from_appstream_xml,
     update_from_software_center_agent,
+    update_from_source,
+    update_from_sources_incremental,
+    update_from_sources_parallel,
     SCAPurchasedApplicationParser,
     SCAApplicationParser,
     )
@@ -83,6 +95,108 @@ class TestDatabase(unittest.TestCase):
             i+=1
         self.assertEqual(i, 1)
 
+    def test_update_from_sources_parallel(self):
+        sources = get_index_sources(datadir="./data/desktop",
+                                    listsdir="./data/app-info/")
+        self.assertEqual(len(sources), 6)
+        serial_db = xapian.WritableDatabase("./data/test.db",
+                                            xapian.DB_CREATE_OR_OVERWRITE)
+        for (kind, path) in sources:
+            update_from_source(serial_db, self.cache, kind, path)
+        parallel_db = xapian.inmemory_open()
+        docids_per_source = update_from_sources_parallel(
+            parallel_db, self.cache, sources, workers=2)
+        self.assertEqual(len(docids_per_source), len(sources))
+        nr_docs = sum([len(docids) for docids in docids_per_source])
+        self.assertEqual(nr_docs, serial_db.get_doccount())
+        self.assertEqual(nr_docs, parallel_db.get_doccount())
+        # ensure the documents are identical (including the docids)
+        for m in serial_db.postlist(""):
+            doc1 = serial_db.get_document(m.docid)
+            doc2 = parallel_db.get_document(m.docid)
+            self.assertEqual(doc1.get_data(), doc2.get_data())
+            self.assertEqual([t.term for t in doc1.termlist()],
+                             [t.term for t in doc2.termlist()])
+            self.assertEqual([(v.num, v.value) for v in doc1.values()],
+                             [(v.num, v.value) for v in doc2.values()])
+
+    def test_indexing_session(self):
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        sources = get_index_sources(datadir="./data/desktop",
+                                    listsdir="./data/desktop")
+        with IndexingSession(db, flush_threshold=2) as session:
+            for (kind, path) in sources:
+                update_from_source(db, self.cache, kind, path, session)
+        self.assertEqual(session.nr_docs, 5)
+        self.assertEqual(db.get_doccount(), 5)
+        for phase in ["read", "make_doc", "index_text", "add_document",
+                      "commit"]:
+            self.assertTrue(phase in session.timings)
+        # a cancelled session does not write anything
+        try:
+            with IndexingSession(db, flush_threshold=100) as session:
+                update_from_source(db, self.cache, *sources[0],
+                                   session=session)
+                raise ValueError("cancel")
+        except ValueError:
+            pass
+        self.assertEqual(db.get_doccount(), 5)
+
+    def test_update_from_sources_incremental(self):
+        datadir = tempfile.mkdtemp()
+        for name in ["pay-app.desktop", "zynjacku.desktop"]:
+            shutil.copy(os.path.join("./data/desktop", name), datadir)
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        manifest = IndexManifest()
+        sources = get_index_sources(datadir=datadir, listsdir=datadir)
+        self.assertEqual(update_from_sources_incremental(
+            db, self.cache, sources, manifest), 2)
+        self.assertEqual(db.get_doccount(), 2)
+        # nothing changed, nothing gets indexed
+        self.assertEqual(update_from_sources_incremental(
+            db, self.cache, sources, manifest), 0)
+        # a touched file with the same content is not re-indexed
+        zynjacku = os.path.join(datadir, "zynjacku.desktop")
+        os.utime(zynjacku, (time.time() + 10, time.time() + 10))
+        self.assertEqual(update_from_sources_incremental(
+            db, self.cache, sources, manifest), 0)
+        # a changed file is re-indexed
+        with open(zynjacku, "a") as f:
+            f.write("Keywords=incrementaltest;\n")
+        self.assertEqual(update_from_sources_incremental(
+            db, self.cache, sources, manifest), 1)
+        self.assertEqual(db.get_doccount(), 2)
+        self.assertEqual(len(list(db.postlist("incrementaltest"))), 1)
+        # a removed file removes its documents
+        os.remove(zynjacku)
+        sources = get_index_sources(datadir=datadir, listsdir=datadir)
+        self.assertEqual(update_from_sources_incremental(
+            db, self.cache, sources, manifest), 1)
+        self.assertEqual(db.get_doccount(), 1)
+        self.assertEqual(manifest.entries.keys(),
+                         [os.path.join(datadir, "pay-app.desktop")])
+        # and the manifest survives a save/load roundtrip
+        manifest.save(db)
+        self.assertEqual(IndexManifest.load(db).entries, manifest.entries)
+        shutil.rmtree(datadir)
+
+    def test_get_apt_lists_stamp(self):
+        listsdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, listsdir)
+        lists = os.path.join(listsdir, "archive_dists_precise_Packages")
+        with open(lists, "w") as f:
+            f.write("Package: apt\n")
+        stamp = get_apt_lists_stamp(listsdir)
+        self.assertEqual(get_apt_lists_stamp(listsdir), stamp)
+        # the lock does not change it, a apt-get update does
+        open(os.path.join(listsdir, "lock"), "w").close()
+        self.assertEqual(get_apt_lists_stamp(listsdir), stamp)
+        with open(lists, "a") as f:
+            f.write("Package: software-center\n")
+        self.assertNotEqual(get_apt_lists_stamp(listsdir), stamp)
+
     def test_update_from_appstream_xml(self):
         db = xapian.WritableDatabase("./data/test.db",
                                      xapian.DB_CREATE_OR_OVERWRITE)
@@ -433,6 +547,91 @@ app-popcon	4	# app-install .desktop popcon rank
         self.assertTrue(len(enquirer.get_docids()) > 0)
         # FIXME: test more of the interface
 
+    def test_sort_keys(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        pathname = os.path.join(tmpdir, "xapian")
+        xdb = xapian.WritableDatabase(pathname,
+                                      xapian.DB_CREATE_OR_OVERWRITE)
+        update_from_app_install_data(xdb, self.cache, datadir="./data/desktop")
+        xdb.flush()
+        db = StoreDatabase(pathname, self.cache)
+        db.open(use_axi=False, use_agent=False)
+        # no sort keys for the current locale yet
+        self.assertFalse(db.has_sort_keys())
+        xdb.set_metadata("sort-key-locale", get_collation_locale())
+        xdb.flush()
+        db.open(use_axi=False, use_agent=False)
+        self.assertTrue(db.has_sort_keys())
+        # the value sort gives the same order as the KeyMaker
+        query = xapian.Query("ATapplication")
+        enquire = xapian.Enquire(db.xapiandb)
+        enquire.set_query(query)
+        enquire.set_sort_by_value(XapianValues.SORT_KEY, reverse=False)
+        by_value = [m.docid for m in enquire.get_mset(0, len(db))]
+        db.sort_keys_match_locale = lambda: False
+        db._axi_values = {"display_name": XapianValues.APPNAME}
+        enquire.set_sort_by_key(LocaleSorter(db), reverse=False)
+        by_key = [m.docid for m in enquire.get_mset(0, len(db))]
+        self.assertEqual(by_value, by_key)
+        self.assertTrue(len(by_value) > 1)
+        # the apps of the apt-xapian-index have sort keys too, they are
+        # only used if they are for the current locale
+        del db.sort_keys_match_locale
+        for (i, collation_locale) in enumerate(
+                [get_collation_locale(), "xx_XX.UTF-8"]):
+            axi_path = os.path.join(tmpdir, "axi%i" % i)
+            axi = xapian.WritableDatabase(axi_path,
+                                          xapian.DB_CREATE_OR_OVERWRITE)
+            doc = xapian.Document()
+            doc.add_term("ATapplication")
+            doc.add_value(XapianValues.SORT_KEY, "axi app")
+            doc.add_value(XapianValues.SORT_KEY_LOCALE, collation_locale)
+            axi.add_document(doc)
+            axi.flush()
+            axi = xapian.Database(axi_path)
+            db.add_database(axi)
+            self.assertEqual(db.has_sort_keys(), i == 0)
+            self.assertEqual(LocaleSorter(db)(doc) == "axi app", i == 0)
+            db.del_database(axi)
+
+    def test_get_xapian_documents(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        pathname = os.path.join(tmpdir, "xapian")
+        xdb = xapian.WritableDatabase(pathname,
+                                      xapian.DB_CREATE_OR_OVERWRITE)
+        update_from_app_install_data(xdb, self.cache, datadir="./data/desktop")
+        xdb.flush()
+        db = StoreDatabase(pathname, self.cache)
+        db.open(use_axi=False, use_agent=False)
+        apps = [(db.get_appname(doc), db.get_pkgname(doc)) for doc in db]
+        apps.reverse()
+        apps.insert(1, ("", "i+am-not-a-pkg"))
+        docs = db.get_xapian_documents(apps)
+        self.assertEqual(len(docs), len(apps))
+        self.assertEqual(docs[1], None)
+        for ((appname, pkgname), doc) in zip(apps, docs):
+            if doc is None:
+                continue
+            self.assertEqual(db.get_appname(doc), appname)
+            self.assertEqual(db.get_pkgname(doc), pkgname)
+            self.assertEqual(
+                doc.get_docid(),
+                db.get_xapian_document(appname, pkgname).get_docid())
+        self.assertRaises(IndexError, db.get_xapian_document,
+                          "", "i+am-not-a-pkg")
+        # the exact matches come from the same map
+        pkgnames = [pkgname for (appname, pkgname) in apps]
+        matches = db.get_exact_matches(pkgnames)
+        self.assertEqual(len(matches), len(pkgnames))
+        self.assertTrue(isinstance(matches[1].document, Application))
+        self.assertEqual(db.get_pkgname(matches[0].document), pkgnames[0])
+        # the map is built again when the database is opened
+        self.assertNotEqual(db._app_docs_by_pkgname, None)
+        db.open(use_axi=False, use_agent=False)
+        self.assertEqual(db._app_docs_by_pkgname, None)
+
     def test_is_pkgname_known(self):
         db = StoreDatabase(cache=self.cache)
         db.open()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+from gi.repository import GObject
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from testutils import setup_test_env
+setup_test_env()
+from softwarecenter.downloadcache import DownloadCache
+
+
+class TestDownloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cachedir = os.path.join(self.tmpdir, "download-cache")
+
+    def _path(self, name):
+        return os.path.join(self.cachedir, name)
+
+    def test_store_and_lookup(self):
+        cache = DownloadCache(self.cachedir)
+        self.assertEqual(cache.lookup(self._path("a")), None)
+        self.assertTrue(cache.store("http://example.com/a", self._path("a"),
+                                    "content", etag='"1"'))
+        self.assertEqual(open(self._path("a")).read(), "content")
+        self.assertEqual(os.listdir(self.cachedir), ["a"])
+        entry = cache.lookup(self._path("a"))
+        self.assertEqual(entry["etag"], '"1"')
+        self.assertEqual(entry["size"], len("content"))
+        self.assertEqual(cache.get_stats()["hits"], 1)
+        self.assertRaises(ValueError, cache.lookup, "/etc/passwd")
+
+    def test_budget(self):
+        cache = DownloadCache(self.cachedir, max_bytes=10)
+        cache.store("http://example.com/a", self._path("a"), "12345")
+        cache.store("http://example.com/b", self._path("b"), "12345")
+        # "a" is used, so "b" is the least recently used one
+        cache.lookup(self._path("a"))
+        cache.store("http://example.com/c", self._path("c"), "12345")
+        self.assertEqual(sorted(os.listdir(self.cachedir)), ["a", "c"])
+        self.assertEqual(cache.nbytes, 10)
+        # a file bigger than the budget is kept until the next one
+        cache.store("http://example.com/d", self._path("d"), "x" * 20)
+        self.assertEqual(os.listdir(self.cachedir), ["d"])
+
+    def test_index(self):
+        cache = DownloadCache(self.cachedir)
+        cache.store("http://example.com/a", self._path("a"), "a",
+                    etag='"1"')
+        cache.save()
+        # a file the index does not know about and one that is gone
+        with open(self._path("b"), "w") as f:
+            f.write("bb")
+        cache.store("http://example.com/c", self._path("c"), "c")
+        cache.save()
+        os.remove(self._path("c"))
+        cache = DownloadCache(self.cachedir)
+        self.assertEqual(cache.get_stats()["entries"], 2)
+        self.assertEqual(cache.nbytes, 3)
+        self.assertEqual(cache.lookup(self._path("a"))["etag"], '"1"')
+        self.assertEqual(cache.lookup(self._path("c")), None)
+        # unknown files are checked with the server first
+        self.assertTrue(cache.needs_revalidation(self._path("b")))
+        self.assertFalse(cache.needs_revalidation(self._path("a")))
+
+    def test_is_current(self):
+        cache = DownloadCache(self.cachedir)
+        cache.store("http://example.com/a", self._path("a"), "a",
+                    etag='"1"')
+        self.assertTrue(cache.is_current(self._path("a"), '"1"', None))
+        self.assertFalse(cache.is_current(self._path("a"), '"2"', None))
+        cache.store("http://example.com/b", self._path("b"), "b",
+                    last_modified=1000)
+        self.assertTrue(cache.is_current(self._path("b"), None, 1000))
+        self.assertFalse(cache.is_current(self._path("b"), None, 2000))
+        # without validators it is downloaded again
+        cache.store("http://example.com/c", self._path("c"), "c")
+        self.assertFalse(cache.is_current(self._path("c"), None, None))
+        # a server without ETag is compared by the time of the download
+        fetched = cache.lookup(self._path("c"))["fetched"]
+        self.assertTrue(cache.is_current(self._path("c"), None, fetched - 2))
+        self.assertFalse(cache.is_current(self._path("c"), None, fetched))
+        # and its Last-Modified is used from then on
+        cache.set_validated(self._path("c"), None, fetched - 2)
+        self.assertFalse(cache.is_current(self._path("c"), None,
+                                          fetched - 3))
+
+    def test_revalidate(self):
+        source = os.path.join(self.tmpdir, "source")
+        with open(source, "w") as f:
+            f.write("old")
+        url = "file://" + source
+        cache = DownloadCache(self.cachedir, revalidate_after=0)
+        cache.store(url, self._path("a"), "old")
+        with open(source, "w") as f:
+            f.write("new")
+        time.sleep(0.01)
+        self.assertTrue(cache.needs_revalidation(self._path("a")))
+        cache.revalidate(url, self._path("a"))
+        context = GObject.main_context_default()
+        while cache._revalidating:
+            context.iteration(True)
+        self.assertEqual(open(self._path("a")).read(), "new")
+        # now it has the validators of the file
+        entry = cache.lookup(self._path("a"))
+        self.assertNotEqual(entry["etag"], None)
+        self.assertNotEqual(entry["last_modified"], None)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
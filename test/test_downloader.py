@@ -3,12 +3,14 @@
 from gi.repository import GObject
 
 import os
+import shutil
+import tempfile
 import time
 import unittest
 
 from testutils import setup_test_env
 setup_test_env()
-from softwarecenter.utils import SimpleFileDownloader
+from softwarecenter.utils import DownloadScheduler, SimpleFileDownloader
 
 class TestImageDownloader(unittest.TestCase):
 
@@ -62,6 +64,76 @@ class TestImageDownloader(unittest.TestCase):
         self.assertTrue(self._image_is_reachable)
         self.assertTrue(os.path.exists(self.DOWNLOAD_FILENAME))
 
+
+class TestDownloadScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.done = []
+
+    def _get_url(self, name):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as f:
+            f.write(name)
+        return "file://" + path
+
+    def _cb(self, url, content, etag, error):
+        self.done.append(content)
+
+    def _wait(self, scheduler):
+        main_loop = GObject.main_context_default()
+        while scheduler.get_stats()["running"]:
+            while main_loop.pending():
+                main_loop.iteration()
+
+    def test_priority_and_coalescing(self):
+        scheduler = DownloadScheduler(max_running=1)
+        urls = [self._get_url(name) for name in ["a", "b", "c"]]
+        scheduler.download(urls[0], self._cb)
+        scheduler.download(urls[1], self._cb,
+                           priority=DownloadScheduler.PRIORITY_PREFETCH)
+        scheduler.download(urls[2], self._cb)
+        scheduler.download(urls[0], self._cb)
+        self._wait(scheduler)
+        # the prefetch goes last and "a" is downloaded once
+        self.assertEqual(self.done, ["a", "a", "c", "b"])
+        self.assertEqual(scheduler.get_stats()["started"], 3)
+        self.assertEqual(scheduler.get_stats()["coalesced"], 1)
+
+    def test_raise_priority(self):
+        scheduler = DownloadScheduler(max_running=1)
+        urls = [self._get_url(name) for name in ["a", "b", "c"]]
+        scheduler.download(urls[0], self._cb)
+        for url in urls[1:]:
+            scheduler.download(url, self._cb,
+                               priority=DownloadScheduler.PRIORITY_PREFETCH)
+        # the prefetched "c" is needed now
+        scheduler.download(urls[2], self._cb)
+        self._wait(scheduler)
+        self.assertEqual(self.done, ["a", "c", "c", "b"])
+
+    def test_cancel(self):
+        scheduler = DownloadScheduler()
+        url = self._get_url("a")
+        scheduler.download(url, self._cb)
+        scheduler.cancel(url, self._cb)
+        self.assertFalse(scheduler.is_pending(url))
+        self._wait(scheduler)
+        self.assertEqual(self.done, [])
+
+    def test_error(self):
+        errors = []
+
+        def _cb(url, content, etag, error):
+            errors.append(error)
+        scheduler = DownloadScheduler()
+        scheduler.download("file:///really-not-there", _cb)
+        self._wait(scheduler)
+        self.assertEqual(len(errors), 1)
+        self.assertNotEqual(errors[0], None)
+
+
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level=logging.DEBUG)
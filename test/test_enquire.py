@@ -2,14 +2,30 @@
 
 from gi.repository import Gtk
 
+import os
+import shutil
+import tempfile
 import time
 import unittest
 import xapian
+from mock import patch
 
 from testutils import setup_test_env
 setup_test_env()
-from softwarecenter.db.appfilter import AppFilter
+from softwarecenter.db.appfilter import (
+    AppFilter,
+    AppFilterIndex,
+    get_global_filter,
+    )
+from softwarecenter.db.database import StoreDatabase
 from softwarecenter.db.enquire import AppEnquire
+from softwarecenter.db.update import update_from_app_install_data
+from softwarecenter.distro import get_distro
+from softwarecenter.enums import (
+    NonAppVisibility,
+    SortMethods,
+    XapianValues,
+    )
 from softwarecenter.testutils import get_test_db, get_test_pkg_info
 
 class TestEnquire(unittest.TestCase):
@@ -36,6 +52,183 @@ class TestEnquire(unittest.TestCase):
         # give the threads a bit of time
         time.sleep(5)
 
+    def test_app_enquire_async(self):
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        enquirer = AppEnquire(cache, db)
+        completed = []
+        enquirer.connect("query-complete",
+                         lambda enq: completed.append(len(enq.matches)))
+        # the first query is superseded by the second one
+        enquirer.set_query_async(xapian.Query("ubuntu"), limit=0)
+        enquirer.set_query_async(xapian.Query(""), limit=0)
+        self.assertEqual(enquirer.matches, [])
+        while not completed:
+            self._p()
+        # give a stale completion the chance to show up
+        time.sleep(0.1)
+        self._p()
+        self.assertEqual(len(completed), 1)
+        self.assertTrue(completed[0] > 0)
+        # the blocking query gets the same result
+        matches = len(enquirer.matches)
+        enquirer.result_cache.clear()
+        enquirer.set_query(xapian.Query(""), limit=0, nonblocking_load=True)
+        self.assertEqual(len(enquirer.matches), matches)
+
+    def test_app_enquire_cancel(self):
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        enquirer = AppEnquire(cache, db)
+        completed = []
+        enquirer.connect("query-complete",
+                         lambda enq: completed.append(True))
+        enquirer.set_query_async(xapian.Query("ubuntu"), limit=0)
+        enquirer.cancel_query()
+        time.sleep(0.5)
+        self._p()
+        self.assertEqual(completed, [])
+
+    def _make_axi_db(self, path, document_type):
+        """ make a database with the documents of the apt-xapian-index
+            (plugin) for a app and a pkg
+        """
+        xdb = xapian.WritableDatabase(path, xapian.DB_CREATE_OR_OVERWRITE)
+        doc = xapian.Document()
+        doc.add_term("XPaxi-app")
+        doc.add_term("AAAxi App")
+        doc.add_term("ATapplication")
+        doc.add_value(XapianValues.APPNAME, "Axi App")
+        if document_type:
+            doc.add_value(XapianValues.DOCUMENT_TYPE, "application")
+        xdb.add_document(doc)
+        doc = xapian.Document()
+        doc.add_term("XPaxi-pkg")
+        xdb.add_document(doc)
+        xdb.flush()
+        return xapian.Database(path)
+
+    def _assert_estimates_equal(self, db, cache):
+        enquirer = AppEnquire(cache, db)
+        enquire = xapian.Enquire(db.xapiandb)
+        xfilter = AppFilter(db, cache)
+        xfilter.set_available_only(True)
+        for q in [xapian.Query(""),
+                  xapian.Query("ATapplication"),
+                  xapian.Query("APsoftware-center")]:
+            # with and without the filter, the way the search applies it
+            for query in [q, xapian.Query(xapian.Query.OP_FILTER,
+                                          q, xfilter.get_query())]:
+                self.assertEqual(
+                    enquirer._get_estimate_nr_apps_and_nr_pkgs(
+                        enquire, query),
+                    enquirer._get_estimate_nr_apps_and_nr_pkgs_two_pass(
+                        enquire, query))
+
+    def test_estimate_nr_apps_and_nr_pkgs(self):
+        cache = get_test_pkg_info()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        pathname = os.path.join(tmpdir, "xapian")
+        xdb = xapian.WritableDatabase(pathname,
+                                      xapian.DB_CREATE_OR_OVERWRITE)
+        update_from_app_install_data(xdb, cache, datadir="./data/desktop")
+        xdb.flush()
+        del xdb
+        db = StoreDatabase(pathname, cache)
+        db.open(use_axi=True, use_agent=False)
+        enquirer = AppEnquire(cache, db)
+        self.assertTrue(enquirer._has_document_type_values())
+        self._assert_estimates_equal(db, cache)
+        # the apps of a apt-xapian-index without the DOCUMENT_TYPE value
+        # are counted with the two pass estimate
+        axi = self._make_axi_db(os.path.join(tmpdir, "axi-old"), False)
+        db.add_database(axi)
+        self.assertFalse(enquirer._has_document_type_values())
+        self._assert_estimates_equal(db, cache)
+        # the plugin sets it now
+        db.del_database(axi)
+        axi = self._make_axi_db(os.path.join(tmpdir, "axi"), True)
+        db.add_database(axi)
+        self.assertTrue(enquirer._has_document_type_values())
+        self._assert_estimates_equal(db, cache)
+
+    def test_filter_query_matches_decider(self):
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        global_filter = get_global_filter()
+        self.addCleanup(setattr, global_filter, "supported_only",
+                        global_filter.supported_only)
+        enquire = xapian.Enquire(db.xapiandb)
+        query = xapian.Query("")
+        for attr, value in [("available_only", True),
+                            ("installed_only", True),
+                            ("not_installed_only", True),
+                            ("restricted_list", set(["software-center",
+                                                     "apt", "gedit"])),
+                            ("supported_only", True)]:
+            xfilter = AppFilter(db, cache)
+            if attr == "supported_only":
+                xfilter.set_supported_only(value)
+            else:
+                setattr(xfilter, attr, value)
+            enquire.set_query(query)
+            matches = enquire.get_mset(0, len(db), None, xfilter)
+            by_decider = set([m.docid for m in matches])
+            enquire.set_query(xapian.Query(xapian.Query.OP_FILTER,
+                                           query, xfilter.get_query()))
+            by_query = set([m.docid for m in enquire.get_mset(0, len(db))])
+            self.assertEqual(by_decider, by_query, attr)
+
+    def test_filter_index_cache_ready(self):
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        index = AppFilterIndex(db, cache)
+        unavailable = index.get_unavailable()
+        query = str(index.get_unavailable_query())
+        pkgname = sorted(index.get_pkgnames() - unavailable)[0]
+        # e.g. a apt-get update removed the pkg from the archive
+        with patch.object(index, "_is_available", lambda p: p != pkgname):
+            index._on_cache_ready(cache)
+            self.assertEqual(index.get_unavailable(),
+                             unavailable | set([pkgname]))
+            self.assertNotEqual(str(index.get_unavailable_query()), query)
+        # supported is answered from the origin terms
+        self.assertEqual(str(index.get_supported_query()),
+                         str(get_distro().get_supported_query()))
+
+    def test_faceted_query(self):
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        enquirer = AppEnquire(cache, db)
+        xfilter = AppFilter(db, cache)
+        xfilter.set_available_only(True)
+        # the "all" facet overlaps with the others
+        facets = [("game", xapian.Query("ACgame")),
+                  ("empty", xapian.Query("ACno-such-category")),
+                  ("all", xapian.Query("")),
+                  ("network", xapian.Query("ACnetwork"))]
+        enquirer.set_faceted_query(
+            facets,
+            sortmode=SortMethods.BY_ALPHABET,
+            filter=xfilter,
+            nonapps_visible=NonAppVisibility.NEVER_VISIBLE)
+        faceted = enquirer.facets
+        self.assertEqual(faceted.keys(), ["game", "all"])
+        self.assertEqual(sum(len(m) for m in faceted.values()),
+                         len(enquirer.matches))
+        # the same as one query per facet that skips the earlier matches
+        for (i, (key, query)) in enumerate(facets):
+            enquirer.set_query(query,
+                               limit=0,
+                               sortmode=SortMethods.BY_ALPHABET,
+                               filter=xfilter,
+                               nonapps_visible=NonAppVisibility.NEVER_VISIBLE,
+                               nonblocking_load=False,
+                               persistent_duplicate_filter=(i > 0))
+            docids = [m.docid for m in enquirer.matches]
+            self.assertEqual(docids, [m.docid for m in faceted.get(key, [])])
+
     def _p(self):
         while Gtk.events_pending():
             Gtk.main_iteration()
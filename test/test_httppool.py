@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+import BaseHTTPServer
+import hashlib
+import shutil
+import SocketServer
+import tempfile
+import threading
+import unittest
+
+from testutils import setup_test_env
+setup_test_env()
+
+from piston_mini_client import PistonAPI, returns_json
+
+from softwarecenter.backend.piston.httppool import (
+    HotCache,
+    HttpPool,
+    install_http_pool,
+    )
+
+
+class CountingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ serves the json in server.content with a ETag and counts the
+        connections, requests and the bytes of the bodies
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.stats["connections"] += 1
+
+    def do_GET(self):
+        stats = self.server.stats
+        stats["requests"] += 1
+        etag = '"%s"' % hashlib.md5(self.server.content).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            stats["not_modified"] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.server.content)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(self.server.content)
+        stats["bytes"] += len(self.server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ a local stand-in for the piston servers """
+
+    # the keep-alive connections are not closed by the clients
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ("127.0.0.1", 0), CountingHandler)
+        self.content = '{"hello": "world"}'
+        self.stats = {"connections": 0,
+                      "requests": 0,
+                      "not_modified": 0,
+                      "bytes": 0,
+                     }
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%i/api/1.0/" % self.server_port
+
+
+class TestAPI(PistonAPI):
+
+    @returns_json
+    def get_data(self):
+        return self._get("data/", scheme="http")
+
+
+class TestHttpPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer()
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        import piston_mini_client
+        self.addCleanup(setattr, piston_mini_client, "httplib2",
+                        piston_mini_client.httplib2)
+        self.pool = install_http_pool(HttpPool())
+        self.addCleanup(self.pool.close)
+
+    def test_keep_alive(self):
+        api = TestAPI(service_root=self.server.url)
+        for i in range(5):
+            self.assertEqual(api.get_data(), {"hello": "world"})
+        # the connection is shared by the api objects
+        api = TestAPI(service_root=self.server.url)
+        self.assertEqual(api.get_data(), {"hello": "world"})
+        self.assertEqual(self.server.stats["requests"], 6)
+        self.assertEqual(self.server.stats["connections"], 1)
+
+    def test_revalidation(self):
+        api = TestAPI(service_root=self.server.url, cachedir=self.tmpdir)
+        for i in range(3):
+            self.assertEqual(api.get_data(), {"hello": "world"})
+        # the body is only transferred once, then it is revalidated
+        stats = self.server.stats
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["not_modified"], 2)
+        self.assertEqual(stats["bytes"], len(self.server.content))
+        self.assertEqual(stats["connections"], 1)
+        # the cached entry comes from memory
+        self.assertTrue(self.pool.get_stats().values()[0]["hits"] > 0)
+        # a change is picked up
+        self.server.content = '{"hello": "again"}'
+        self.assertEqual(api.get_data(), {"hello": "again"})
+
+
+class TestHotCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_memory_tier(self):
+        cache = HotCache(self.tmpdir, max_bytes=10)
+        cache.set("a", "12345")
+        cache.set("b", "12345")
+        self.assertEqual(cache.get_stats()["entries"], 2)
+        # evicts "a" from memory, it is still on disk
+        cache.set("c", "12345")
+        self.assertEqual(cache.get_stats()["entries"], 2)
+        self.assertEqual(cache.get("a"), "12345")
+        self.assertEqual(cache.get_stats()["hits"], 1)
+        cache.delete("a")
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get_stats()["misses"], 1)
+
+    def test_without_file_cache(self):
+        cache = HotCache(max_bytes=10)
+        cache.set("a", "x" * 20)
+        self.assertEqual(cache.get("a"), None)
+        cache.set("b", "x")
+        self.assertEqual(cache.get("b"), "x")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
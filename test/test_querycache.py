@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+import unittest
+import xapian
+
+from testutils import setup_test_env
+setup_test_env()
+
+from softwarecenter.db.enquire import AppEnquire
+from softwarecenter.db.querycache import QueryResult, QueryResultCache
+from softwarecenter.enums import SortMethods
+from softwarecenter.testutils import get_test_db
+
+
+class TestQueryResultCache(unittest.TestCase):
+
+    def test_lru_max_entries(self):
+        cache = QueryResultCache(max_entries=2)
+        cache.add("a", QueryResult([1, 2], 2, 0, 0))
+        cache.add("b", QueryResult([3], 1, 0, 0))
+        # make "a" the most recently used one
+        self.assertEqual(list(cache.get("a").docids), [1, 2])
+        cache.add("c", QueryResult([4], 1, 0, 0))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("b"), None)
+        self.assertNotEqual(cache.get("a"), None)
+        self.assertNotEqual(cache.get("c"), None)
+        stats = cache.get_stats()
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_lru_max_bytes(self):
+        result = QueryResult(range(1000), 1000, 0, 0)
+        cache = QueryResultCache(max_bytes=int(result.nbytes * 2.5))
+        for key in ["a", "b", "c"]:
+            cache.add(key, QueryResult(range(1000), 1000, 0, 0))
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.nbytes <= cache.max_bytes)
+        # too big entries are not cached at all
+        cache.add("d", QueryResult(range(100000), 100000, 0, 0))
+        self.assertEqual(cache.get("d"), None)
+
+    def test_enquire_uses_cache(self):
+        db = get_test_db()
+        enquirer = AppEnquire(db._aptcache, db)
+        enquirer.result_cache.clear()
+        query = xapian.Query("ATapplication")
+        enquirer.set_query(query, sortmode=SortMethods.BY_ALPHABET,
+                           nonblocking_load=False)
+        docids = [m.docid for m in enquirer.matches]
+        hits = enquirer.result_cache.hits
+        enquirer.set_query(query, sortmode=SortMethods.BY_ALPHABET,
+                           nonblocking_load=False)
+        self.assertEqual(enquirer.result_cache.hits, hits + 1)
+        self.assertEqual([m.docid for m in enquirer.matches], docids)
+        self.assertEqual(enquirer.matches[0].document.get_docid(), docids[0])
+        # a reopen flushes the cache
+        db.reopen()
+        self.assertEqual(len(enquirer.result_cache), 0)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
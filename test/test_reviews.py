@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import xapian
+
+from testutils import setup_test_env
+setup_test_env()
+
+import softwarecenter.backend.reviews
+from softwarecenter.backend.reviews import (
+    ReviewLoader,
+    ReviewStats,
+    ReviewStatsCache,
+    )
+from softwarecenter.backend.reviews.statsstore import (
+    ReviewStatsStore,
+    ReviewStatsStoreError,
+    append_review_stats_journal,
+    read_review_stats_journal,
+    write_review_stats_store,
+    )
+from softwarecenter.db.application import Application
+from softwarecenter.db.enquire import AppEnquire
+from softwarecenter.enums import SortMethods
+from softwarecenter.testutils import get_test_db, get_test_pkg_info
+
+
+class TestReviewLoader(unittest.TestCase):
+    """ tests the review loader top rated support """
+
+    def setUp(self):
+        self.cache = get_test_pkg_info()
+        self.db = get_test_db()
+        self.loader = ReviewLoader(self.cache, self.db)
+        self.loader.REVIEW_STATS_CACHE = ReviewStatsCache()
+        # rate the first few apps of the db
+        self.pkgnames = []
+        xdb = self.db.xapiandb
+        for post in xdb.postlist("ATapplication"):
+            pkgname = self.db.get_pkgname(xdb.get_document(post.docid))
+            if pkgname and pkgname not in self.pkgnames:
+                self.pkgnames.append(pkgname)
+            if len(self.pkgnames) == 5:
+                break
+        for (i, pkgname) in enumerate(self.pkgnames):
+            app = Application("", pkgname)
+            stats = ReviewStats(app)
+            stats.dampened_rating = 1.0 + i
+            self.loader.update_review_stats(app, stats)
+
+    def test_dampened_ratings(self):
+        ratings = self.loader.get_dampened_ratings(self.db)
+        self.assertEqual(len(ratings), self.db.xapiandb.get_lastdocid() + 1)
+        for (i, pkgname) in enumerate(self.pkgnames):
+            doc = self.db.get_xapian_document("", pkgname)
+            self.assertEqual(ratings[doc.get_docid()], 1.0 + i)
+        # the ratings are cached until the stats change
+        self.assertTrue(self.loader.get_dampened_ratings(self.db) is ratings)
+        app = Application("", self.pkgnames[0])
+        stats = ReviewStats(app)
+        stats.dampened_rating = 10.0
+        self.loader.update_review_stats(app, stats)
+        ratings = self.loader.get_dampened_ratings(self.db)
+        doc = self.db.get_xapian_document("", self.pkgnames[0])
+        self.assertEqual(ratings[doc.get_docid()], 10.0)
+
+    def test_get_top_rated_apps(self):
+        top_rated = self.loader.get_top_rated_apps(quantity=3)
+        self.assertEqual([app.pkgname for app in top_rated],
+                         list(reversed(self.pkgnames))[:3])
+
+    def test_enquire_top_rated(self):
+        old_loader = softwarecenter.backend.reviews.review_loader
+        softwarecenter.backend.reviews.review_loader = self.loader
+        self.addCleanup(setattr, softwarecenter.backend.reviews,
+                        "review_loader", old_loader)
+        enquirer = AppEnquire(self.cache, self.db)
+        enquirer.set_query(xapian.Query(""),
+                           sortmode=SortMethods.BY_TOP_RATED,
+                           limit=3,
+                           nonblocking_load=False)
+        self.assertEqual(len(enquirer.matches), 3)
+        xdb = self.db.xapiandb
+        pkgnames = [self.db.get_pkgname(xdb.get_document(m.docid))
+                    for m in enquirer.matches]
+        self.assertEqual(pkgnames, list(reversed(self.pkgnames))[:3])
+
+
+class TestReviewStatsStore(unittest.TestCase):
+    """ tests the memory mapped review stats store """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "review-stats.bin")
+
+    def _make_stats(self, pkgname, spread):
+        stats = ReviewStats(Application("", pkgname))
+        stats.ratings_average = 3.5
+        stats.ratings_total = sum(spread)
+        stats.rating_spread = spread
+        stats.dampened_rating = 2.5
+        return stats
+
+    def test_round_trip(self):
+        records = [("b-pkg", 4.0, 2, [0, 0, 0, 1, 1], 3.5),
+                   ("a-pkg", None, 0, None, 3.0),
+                   (u"c-pkg", 1.5, 10, [5, 5, 0, 0, 0], 1.25)]
+        write_review_stats_store(self.path, records)
+        store = ReviewStatsStore(self.path)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(list(store), sorted(records))
+        self.assertEqual(store.get("b-pkg"), records[0])
+        self.assertEqual(store.get("a-pkg"), records[1])
+        self.assertEqual(store.get("c-pkg"), records[2])
+        self.assertEqual(store.get("d-pkg"), None)
+        self.assertFalse("0-pkg" in store)
+        store.close()
+
+    def test_lookup(self):
+        pkgnames = ["pkg-%04i" % i for i in range(500)]
+        write_review_stats_store(self.path, [
+                (pkgname, 3.0, i, None, 3.0)
+                for (i, pkgname) in enumerate(pkgnames)])
+        store = ReviewStatsStore(self.path)
+        for (i, pkgname) in enumerate(pkgnames):
+            self.assertEqual(store.get(pkgname)[2], i)
+        self.assertEqual(store.get("pkg-"), None)
+        self.assertEqual(store.get("pkg-9999"), None)
+
+    def test_invalid_store(self):
+        with open(self.path, "w") as f:
+            f.write("garbage, not a review stats store")
+        self.assertRaises(ReviewStatsStoreError, ReviewStatsStore, self.path)
+
+    def test_cache_changes_and_save(self):
+        cache = ReviewStatsCache()
+        cache[Application("", "a-pkg")] = self._make_stats(
+            "a-pkg", [1, 0, 0, 0, 0])
+        cache.save(self.path)
+        cache = ReviewStatsCache(ReviewStatsStore(self.path))
+        self.assertTrue(Application("", "a-pkg") in cache)
+        self.assertFalse(cache.has_missing_rating_spread())
+        # changes override the stored stats
+        cache[Application("", "a-pkg")] = self._make_stats(
+            "a-pkg", [0, 0, 0, 0, 4])
+        cache[Application("", "b-pkg")] = self._make_stats("b-pkg", None)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache[Application("", "a-pkg")].rating_spread,
+                         [0, 0, 0, 0, 4])
+        self.assertTrue(cache.has_missing_rating_spread())
+        cache.save(self.path)
+        self.assertEqual(
+            sorted(app.pkgname for app in cache.keys()), ["a-pkg", "b-pkg"])
+        self.assertEqual(cache[Application("", "a-pkg")].ratings_total, 4)
+        self.assertEqual(cache.get(Application("", "c-pkg")), None)
+
+    def test_journal(self):
+        cache = ReviewStatsCache()
+        cache[Application("", "a-pkg")] = self._make_stats(
+            "a-pkg", [1, 0, 0, 0, 0])
+        self.assertEqual(cache.save(self.path), None)
+        # unchanged stats are not part of the change set
+        changed = cache.update([
+                self._make_stats("a-pkg", [1, 0, 0, 0, 0]),
+                self._make_stats("b-pkg", [0, 2, 0, 0, 0])])
+        self.assertEqual(changed, set(["b-pkg"]))
+        # only the changes are appended to the journal
+        self.assertEqual(cache.save(self.path), set(["b-pkg"]))
+        journal = self.path + ReviewStatsCache.JOURNAL_SUFFIX
+        self.assertEqual(
+            [r[0] for r in read_review_stats_journal(journal)], ["b-pkg"])
+        self.assertEqual(len(ReviewStatsStore(self.path)), 1)
+        # and applied when the store is opened
+        cache = ReviewStatsCache.open(self.path)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache[Application("", "b-pkg")].rating_spread,
+                         [0, 2, 0, 0, 0])
+        # compaction writes a new store and removes the journal
+        self.assertEqual(cache.save(self.path, compact=True), None)
+        self.assertFalse(os.path.exists(journal))
+        self.assertEqual(len(ReviewStatsStore(self.path)), 2)
+
+    def test_journal_truncated(self):
+        journal = self.path + ReviewStatsCache.JOURNAL_SUFFIX
+        append_review_stats_journal(journal, [("a-pkg", None, 0, None, 3.0)])
+        with open(journal, "ab") as f:
+            f.write("\x05")
+        self.assertEqual(read_review_stats_journal(journal),
+                         [("a-pkg", None, 0, None, 3.0)])
+        append_review_stats_journal(journal, [("b-pkg", None, 0, None, 3.0)])
+        self.assertEqual(len(read_review_stats_journal(journal)), 2)
+
+    def test_migrate_pickle(self):
+        loader = ReviewLoader(get_test_pkg_info(), get_test_db())
+        loader.REVIEW_STATS_PICKLE_FILE = os.path.join(self.tmpdir, "rs.p")
+        loader.REVIEW_STATS_CACHE_FILE = self.path
+        app = Application("", "a-pkg")
+        pickle.dump({app: self._make_stats("a-pkg", [0, 1, 0, 0, 0])},
+                    open(loader.REVIEW_STATS_PICKLE_FILE, "w"))
+        mtime = os.path.getmtime(loader.REVIEW_STATS_PICKLE_FILE) - 3600
+        os.utime(loader.REVIEW_STATS_PICKLE_FILE, (mtime, mtime))
+        loader._migrate_review_stats_pickle()
+        self.assertFalse(os.path.exists(loader.REVIEW_STATS_PICKLE_FILE))
+        self.assertEqual(os.path.getmtime(self.path), mtime)
+        store = ReviewStatsStore(self.path)
+        self.assertEqual(store.get("a-pkg")[3], [0, 1, 0, 0, 0])
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
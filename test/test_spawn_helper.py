@@ -1,17 +1,25 @@
 #!/usr/bin/python
 
+import os
+import pickle
 import unittest
-from mock import patch
+from mock import Mock, patch
 
 from testutils import setup_test_env
 setup_test_env()
-from softwarecenter.backend.spawn_helper import SpawnHelper
+from softwarecenter.backend.spawn_helper import (
+    FrameDecoder,
+    PistonHelperDaemon,
+    SpawnHelper,
+    pack_frame,
+    )
 
 class TestSpawnHelper(unittest.TestCase):
 
     def test_spawn_helper_lp957599(self):
         days_delta = 6
         spawn_helper = SpawnHelper()
+        spawn_helper.use_daemon = False
         with patch.object(spawn_helper, "run") as mock_run:
             spawn_helper.run_generic_piston_helper(
                 "RatingsAndReviewsAPI", "review_stats", days=days_delta)
@@ -22,6 +30,76 @@ class TestSpawnHelper(unittest.TestCase):
             self.assertEqual(cmd[4], 'review_stats')
             self.assertEqual(cmd[5], '{"days": 6}')
 
+    @patch("softwarecenter.backend.spawn_helper.get_piston_helper_daemon")
+    def test_spawn_helper_daemon(self, mock_get_daemon):
+        spawn_helper = SpawnHelper()
+        spawn_helper.needs_auth = True
+        with patch.object(spawn_helper, "run") as mock_run:
+            spawn_helper.run_generic_piston_helper(
+                "RatingsAndReviewsAPI", "review_stats", days=6)
+            self.assertFalse(mock_run.called)
+        (helper, request) = mock_get_daemon().submit.call_args[0]
+        self.assertEqual(helper, spawn_helper)
+        self.assertEqual(request["klass"], "RatingsAndReviewsAPI")
+        self.assertEqual(request["func"], "review_stats")
+        self.assertEqual(request["kwargs"], {"days": 6})
+        self.assertTrue(request["needs_auth"])
+        # the response is emitted like the output of a helper process
+        results = []
+        spawn_helper.connect("data-available",
+                             lambda helper, data: results.append(data))
+        spawn_helper._on_daemon_response(
+            {"id": 1, "status": "ok", "data": pickle.dumps(["stats"])})
+        self.assertEqual(results, [["stats"]])
+
+    def _spawn_daemon(self, *args, **kwargs):
+        (stdin_r, stdin_w) = os.pipe()
+        (stdout_r, stdout_w) = os.pipe()
+        # the daemon does not answer
+        os.close(stdout_w)
+        self.addCleanup(os.close, stdin_r)
+        self.spawned.append(stdin_r)
+        return (100 + len(self.spawned), stdin_w, stdout_r, None)
+
+    @patch("softwarecenter.backend.spawn_helper.GObject")
+    def test_daemon_restart(self, mock_gobject):
+        self.spawned = []
+        mock_gobject.spawn_async.side_effect = self._spawn_daemon
+        daemon = PistonHelperDaemon()
+        helpers = [Mock() for i in range(3)]
+        for helper in helpers:
+            daemon.submit(helper, {"klass": "RatingsAndReviewsAPI",
+                                   "func": "review_stats"})
+        self.assertEqual(len(self.spawned), 1)
+        # the pending requests are sent again to a single new daemon
+        daemon._on_daemon_exited(101, 9)
+        self.assertEqual(len(self.spawned), 2)
+        self.assertEqual(daemon._pid, 102)
+        self.assertEqual(sorted(daemon._pending), [1, 2, 3])
+        # a exit of a daemon that was already replaced is ignored
+        daemon._on_daemon_exited(101, 9)
+        self.assertEqual(daemon._pid, 102)
+        self.assertEqual(len(daemon._pending), 3)
+        # they are only retried once
+        daemon._on_daemon_exited(102, 9)
+        self.assertEqual(len(self.spawned), 2)
+        self.assertFalse(daemon.running)
+        for helper in helpers:
+            response = helper._on_daemon_response.call_args[0][0]
+            self.assertEqual(response["status"], "error")
+
+    def test_frame_decoder(self):
+        data = "".join([pack_frame({"id": 1}),
+                        pack_frame({"id": 2, "data": "x" * 100000})])
+        decoder = FrameDecoder()
+        frames = []
+        # feed the stream in small chunks
+        for i in range(0, len(data), 333):
+            frames.extend(decoder.feed(data[i:i + 333]))
+        self.assertEqual([f["id"] for f in frames], [1, 2])
+        self.assertEqual(frames[1]["data"], "x" * 100000)
+        self.assertEqual(decoder.feed(""), [])
+
 
 
 if __name__ == "__main__":
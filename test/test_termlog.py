@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from testutils import setup_test_env
+setup_test_env()
+
+from softwarecenter.db.history_impl.termlog import TerminalLogIndex
+
+
+def make_section(date, output):
+    return "Log started: %s\n%s\nLog ended: %s\n\n" % (date, output, date)
+
+
+class TestTerminalLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.term_file = os.path.join(self.tmpdir, "term.log")
+        self.cachedir = os.path.join(self.tmpdir, "cache")
+        with gzip.open(self.term_file + ".1.gz", "w") as f:
+            f.write(make_section("2012-01-01  10:00:00", "old one"))
+            f.write(make_section("2012-01-02  10:00:00", "old two"))
+        with open(self.term_file, "w") as f:
+            f.write(make_section("2012-02-01  10:00:00", "new one"))
+
+    def _get_index(self):
+        return TerminalLogIndex(self.term_file, self.cachedir)
+
+    def test_get(self):
+        index = self._get_index()
+        self.assertEqual(index.get("2012-01-02  10:00:00"),
+                         ["Log started: 2012-01-02  10:00:00\n",
+                          "old two\n",
+                          "Log ended: 2012-01-02  10:00:00\n",
+                          "\n"])
+        self.assertEqual(index.get("2012-02-01  10:00:00")[1], "new one\n")
+        # a prefix of the date works too
+        self.assertEqual(index.get("2012-01-01")[1], "old one\n")
+        self.assertEqual(index.get("2011-01-01  10:00:00"), [])
+
+    def test_prefix_newest_first(self):
+        with open(self.term_file, "a") as f:
+            f.write(make_section("2012-02-01  11:00:00", "new two"))
+        index = self._get_index()
+        for i in range(3):
+            self.assertEqual(index.get("2012-02-01")[1], "new two\n")
+
+    def test_update_only_on_miss(self):
+        index = self._get_index()
+        index.get("2012-01-01  10:00:00")
+        with patch.object(index, "update") as mock_update:
+            self.assertEqual(index.get("2012-01-02  10:00:00")[1],
+                             "old two\n")
+            self.assertEqual(index.get("2012-02-01  10:00:00")[1],
+                             "new one\n")
+            self.assertFalse(mock_update.called)
+            index.get("2011-01-01  10:00:00")
+            self.assertTrue(mock_update.called)
+
+    def test_private(self):
+        old_umask = os.umask(0o022)
+        self.addCleanup(os.umask, old_umask)
+        self._get_index().update()
+        self.assertEqual(os.stat(self.cachedir).st_mode & 0o777, 0o700)
+        for name in os.listdir(self.cachedir):
+            st = os.stat(os.path.join(self.cachedir, name))
+            self.assertEqual(st.st_mode & 0o777, 0o600, name)
+
+    def test_incremental(self):
+        self._get_index().update()
+        # a section that apt is still writing grows
+        with open(self.term_file, "a") as f:
+            f.write("Log started: 2012-02-02  10:00:00\nnew two\n")
+        # the rotated log is not read again once it is indexed
+        with patch("gzip.open", side_effect=AssertionError):
+            index = self._get_index()
+            self.assertEqual(index.get("2012-02-02  10:00:00")[1:],
+                             ["new two\n"])
+            with open(self.term_file, "a") as f:
+                f.write("more output\n")
+            self.assertEqual(index.get("2012-02-02  10:00:00")[1:],
+                             ["new two\n", "more output\n"])
+            self.assertEqual(index.get("2012-01-01  10:00:00")[1],
+                             "old one\n")
+
+    def test_rotation(self):
+        index = self._get_index()
+        index.update()
+        # logrotate moves the logs along and starts a new live log
+        os.rename(self.term_file + ".1.gz", self.term_file + ".2.gz")
+        with open(self.term_file) as f:
+            data = f.read()
+        with gzip.open(self.term_file + ".1.gz", "w") as f:
+            f.write(data)
+        with open(self.term_file, "w") as f:
+            f.write(make_section("2012-03-01  10:00:00", "newest"))
+        self.assertEqual(index.get("2012-02-01  10:00:00")[1], "new one\n")
+        self.assertEqual(index.get("2012-03-01  10:00:00")[1], "newest\n")
+        self.assertEqual(index.get("2012-01-01  10:00:00")[1], "old one\n")
+        # the oldest log is removed, that is noticed by the next update
+        os.remove(self.term_file + ".2.gz")
+        index.update()
+        self.assertEqual(index.get("2012-01-01  10:00:00"), [])
+        self.assertEqual(len(os.listdir(self.cachedir)), 2)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
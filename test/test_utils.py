@@ -271,6 +271,31 @@ class TestExpungeCache(unittest.TestCase):
         # ensure that the second one was not called
         self.assertEqual(len(glob.glob(os.path.join(tmpdir, "marker.*"))), 1)
 
+    def test_expunge_cache_index(self):
+        from softwarecenter.expunge import ExpungeCache, ExpungeIndex
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        for name in ["indexed", "outdated", "unindexed"]:
+            open(os.path.join(tmpdir, name), "w").write("status: 200")
+        index = ExpungeIndex(tmpdir)
+        # the index is trusted as long as the file is unchanged
+        index.add("indexed", "status: 404")
+        index.add("outdated", "status: 404")
+        os.utime(os.path.join(tmpdir, "outdated"), (1, 1))
+        index.add("gone", "status: 200")
+        index.remove("gone")
+        self.assertEqual(sorted(index.load()), ["indexed", "outdated"])
+        cleaner = ExpungeCache([tmpdir], by_days=0,
+                               by_unsuccessful_http_states=True)
+        reclaimed = cleaner.clean()
+        self.assertEqual(reclaimed, len("status: 200"))
+        self.assertFalse(os.path.exists(os.path.join(tmpdir, "indexed")))
+        self.assertTrue(os.path.exists(os.path.join(tmpdir, "outdated")))
+        # the index now has all the files that are left
+        entries = index.load()
+        self.assertEqual(sorted(entries), ["outdated", "unindexed"])
+        self.assertEqual(entries["unindexed"][0], "status: 200")
+
 
 
 if __name__ == "__main__":
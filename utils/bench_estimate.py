@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import xapian
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from softwarecenter.db.database import StoreDatabase
+from softwarecenter.db.enquire import AppEnquire
+from softwarecenter.db.pkginfo import get_pkg_info
+from softwarecenter.paths import XAPIAN_BASE_PATH
+
+
+def run_benchmark(enquirer, name, func, query, repeat):
+    enquire = xapian.Enquire(enquirer.db.xapiandb)
+    now = time.time()
+    for i in range(repeat):
+        (nr_apps, nr_pkgs) = func(enquire, query)
+    duration = (time.time() - now) / repeat
+    print "%-12s query=%s apps=%i pkgs=%i time=%.2fms" % (
+        name, query, nr_apps, nr_pkgs, duration * 1000)
+    return duration
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--repeat", type="int", default=10,
+                      help="number of runs of each estimation")
+    parser.add_option("--no-axi", action="store_true", default=False,
+                      help="do not use the apt-xapian-index")
+    (options, args) = parser.parse_args()
+
+    cache = get_pkg_info()
+    cache.open()
+    db = StoreDatabase(os.path.join(XAPIAN_BASE_PATH, "xapian"), cache)
+    db.open(use_axi=not options.no_axi, use_agent=False)
+    enquirer = AppEnquire(cache, db)
+    if not enquirer._has_document_type_values():
+        print "database has no document type values, rebuild it first"
+        sys.exit(1)
+
+    # the "all software" view and some search terms
+    queries = [xapian.Query("")] + [xapian.Query(t) for t in args]
+    for query in queries:
+        two_pass = run_benchmark(
+            enquirer, "two-pass",
+            enquirer._get_estimate_nr_apps_and_nr_pkgs_two_pass,
+            query, options.repeat)
+        single_pass = run_benchmark(
+            enquirer, "single-pass",
+            enquirer._get_estimate_nr_apps_and_nr_pkgs_single_pass,
+            query, options.repeat)
+        print "speedup: %.2fx" % (two_pass / single_pass)
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import xapian
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from softwarecenter.db.pkginfo import get_pkg_info
+from softwarecenter.db.update import (
+    get_index_sources,
+    update_from_source,
+    update_from_sources_parallel,
+    )
+
+TEST_APP_INSTALL_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "test", "data", "app-install",
+    "desktop")
+
+
+def make_datadir(copies):
+    """ create a app-install-data like directory with "copies" copies
+        of each of the test desktop files
+    """
+    datadir = tempfile.mkdtemp(prefix="bench-rebuild-")
+    for desktopf in glob.glob(os.path.join(TEST_APP_INSTALL_DIR,
+                                           "*.desktop")):
+        basename = os.path.basename(desktopf)
+        for i in range(copies):
+            shutil.copy(desktopf, os.path.join(
+                datadir, "%i-%s" % (i, basename)))
+    return datadir
+
+
+def run_benchmark(cache, sources, workers):
+    db = xapian.inmemory_open()
+    now = time.time()
+    if workers == 1:
+        for (kind, path) in sources:
+            update_from_source(db, cache, kind, path)
+    else:
+        update_from_sources_parallel(db, cache, sources, workers)
+    duration = time.time() - now
+    nr_docs = db.get_doccount()
+    print "workers=%i docs=%i time=%.3fs docs/sec=%.1f" % (
+        workers, nr_docs, duration, nr_docs / duration)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--copies", type="int", default=500,
+                      help="number of copies of each test desktop file")
+    parser.add_option("--workers", default="1,2,4",
+                      help="comma separated list of worker counts")
+    (options, args) = parser.parse_args()
+
+    cache = get_pkg_info()
+    cache.open()
+    datadir = make_datadir(options.copies)
+    try:
+        # only index the test data, not the AppInfo files of the system
+        sources = get_index_sources(datadir=datadir, listsdir=datadir)
+        for workers in options.workers.split(","):
+            run_benchmark(cache, sources, int(workers))
+    finally:
+        shutil.rmtree(datadir)
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+
+""" Benchmark the search and browse hot paths against a synthetic
+    catalogue and write the results as json, so that runs of different
+    versions can be compared with --compare
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xapian
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from softwarecenter.db.appfilter import AppFilter
+from softwarecenter.db.categories import Category
+from softwarecenter.db.database import StoreDatabase, get_collation_locale
+from softwarecenter.db.enquire import AppEnquire
+from softwarecenter.db.pkginfo import get_pkg_info
+from softwarecenter.db.update import get_index_sources, update_from_sources
+from softwarecenter.enums import SortMethods, DB_SCHEMA_VERSION
+
+CATEGORIES = ["AudioVideo", "Development", "Education", "Game", "Graphics",
+              "Network", "Office", "Science", "Settings", "System",
+              "Utility"]
+
+WORDS = ["audio", "backup", "browser", "chess", "editor", "file", "game",
+         "image", "mail", "manager", "music", "network", "office", "photo",
+         "player", "puzzle", "terminal", "text", "tool", "video", "viewer",
+         "web"]
+
+SEARCH_TERMS = ["editor", "game", "music player", "pho", "web browser",
+                "pkg:synthetic-app-1", "ab"]
+
+DESKTOP_TEMPLATE = """[Desktop Entry]
+X-AppInstall-Package=%(pkgname)s
+X-AppInstall-Popcon=%(popcon)i
+X-AppInstall-Section=%(section)s
+Name=%(name)s
+Comment=%(comment)s
+Icon=%(pkgname)s
+Exec=%(pkgname)s
+Type=Application
+Categories=%(categories)s;
+"""
+
+
+def make_catalogue(datadir, size, cache, seed):
+    """ write "size" desktop files into datadir, a part of them uses the
+        names of real packages so that the filters have something to do
+    """
+    rand = random.Random(seed)
+    real_pkgnames = sorted(pkg.name for pkg in cache)
+    rand.shuffle(real_pkgnames)
+    real_pkgnames = real_pkgnames[:size // 2]
+    for i in range(size):
+        if i < len(real_pkgnames):
+            pkgname = real_pkgnames[i]
+        else:
+            pkgname = "synthetic-app-%i" % i
+        words = rand.sample(WORDS, 3)
+        entry = {
+            "pkgname": pkgname,
+            "popcon": rand.randint(0, 100000),
+            "section": rand.choice(["main", "universe"]),
+            "name": "%s %s %i" % (words[0].title(), words[1].title(), i),
+            "comment": "A %s %s for the %s" % tuple(words),
+            "categories": ";".join(rand.sample(CATEGORIES, 2)),
+            }
+        path = os.path.join(datadir, "%s__%i.desktop" % (pkgname, i))
+        with open(path, "w") as f:
+            f.write(DESKTOP_TEMPLATE % entry)
+
+
+def build_database(pathname, datadir, cache):
+    db = xapian.WritableDatabase(pathname, xapian.DB_CREATE_OR_OVERWRITE)
+    # only index the synthetic data, not the AppInfo files of the system
+    sources = get_index_sources(datadir=datadir, listsdir=datadir)
+    update_from_sources(db, cache, sources)
+    db.set_metadata("db-schema-version", DB_SCHEMA_VERSION)
+    db.set_metadata("sort-key-locale", get_collation_locale())
+    db.flush()
+
+
+class Benchmark(object):
+    """ run and time the benchmark cases """
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def run(self, name, func, setup=None):
+        times = []
+        for i in range(self.repeat):
+            if setup:
+                setup()
+            now = time.time()
+            func()
+            times.append(time.time() - now)
+        times.sort()
+        self.results[name] = {
+            "runs": len(times),
+            "min": times[0],
+            "median": times[len(times) // 2],
+            "mean": sum(times) / len(times),
+            }
+        print >> sys.stderr, "%-60s %8.2fms" % (name, times[0] * 1000)
+
+
+def run_benchmarks(bench, db, cache):
+    # search entry parsing
+    for term in SEARCH_TERMS:
+        bench.run("search_entry/%s" % term,
+                  lambda: db.get_query_list_from_search_entry(term))
+
+    # the queries in all sort modes, with and without a filter
+    enquirer = AppEnquire(cache, db)
+    app_filter = AppFilter(db, cache)
+    app_filter.set_available_only(True)
+    app_filter.set_not_installed_only(True)
+    sort_modes = [(name, getattr(SortMethods, name))
+                  for name in dir(SortMethods) if not name.startswith("_")]
+    queries = [("all", xapian.Query(""))]
+    for term in SEARCH_TERMS[:3]:
+        queries.append((term, db.get_query_list_from_search_entry(term)))
+    for (query_name, query) in queries:
+        for (sort_name, sortmode) in sorted(sort_modes):
+            for (filter_name, xfilter) in [("nofilter", None),
+                                           ("filter", app_filter)]:
+                name = "enquire/%s/%s/%s" % (query_name, sort_name,
+                                             filter_name)
+                bench.run(name,
+                          lambda: enquirer.set_query(query,
+                                                     limit=0,
+                                                     sortmode=sortmode,
+                                                     filter=xfilter,
+                                                     nonblocking_load=False),
+                          setup=enquirer.result_cache.clear)
+
+    # categories
+    for cat_name in CATEGORIES:
+        query = xapian.Query("AC" + cat_name.lower())
+        cat = Category(cat_name, cat_name, "", query)
+        bench.run("category_documents/%s" % cat_name,
+                  lambda: cat.get_documents(db),
+                  setup=enquirer.result_cache.clear)
+
+    # the gtk model is optional, e.g. it is not available on a server
+    try:
+        from softwarecenter.ui.gtk3.models.appstore2 import AppListStore
+        from softwarecenter.ui.gtk3.utils import get_sc_icon_theme
+        import softwarecenter.paths
+    except ImportError as e:
+        print >> sys.stderr, "skipping AppListStore: %s" % e
+        return
+    icons = get_sc_icon_theme(softwarecenter.paths.datadir)
+    store = AppListStore(db, cache, icons)
+    enquirer.set_query(xapian.Query(""), limit=0, nonblocking_load=False)
+    matches = enquirer.matches
+    bench.run("applist_store/set_from_matches",
+              lambda: store.set_from_matches(matches),
+              setup=store.clear)
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_file, new_file):
+    """ print the change of the median time of each benchmark """
+    old = json.load(open(old_file))["results"]
+    new = json.load(open(new_file))["results"]
+    for name in sorted(set(old) & set(new)):
+        old_median = old[name]["median"]
+        new_median = new[name]["median"]
+        if old_median:
+            change = (new_median - old_median) / old_median * 100
+        else:
+            change = 0.0
+        print "%-60s %8.2fms %8.2fms %+7.1f%%" % (
+            name, old_median * 1000, new_median * 1000, change)
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options]\n"
+                                "       %prog --compare old.json new.json")
+    parser.add_option("--size", type="int", default=10000,
+                      help="number of documents of the synthetic catalogue")
+    parser.add_option("--seed", type="int", default=1,
+                      help="random seed for the synthetic catalogue")
+    parser.add_option("--repeat", type="int", default=5,
+                      help="number of runs of each benchmark")
+    parser.add_option("--output", default=None,
+                      help="write the json results to this file")
+    parser.add_option("--compare", action="store_true", default=False,
+                      help="compare two json result files")
+    (options, args) = parser.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare needs two result files")
+        compare(args[0], args[1])
+        sys.exit(0)
+
+    cache = get_pkg_info()
+    cache.open()
+    tmpdir = tempfile.mkdtemp(prefix="bench-search-")
+    try:
+        datadir = os.path.join(tmpdir, "desktop")
+        os.makedirs(datadir)
+        pathname = os.path.join(tmpdir, "xapian")
+        make_catalogue(datadir, options.size, cache, options.seed)
+        now = time.time()
+        build_database(pathname, datadir, cache)
+        build_time = time.time() - now
+
+        db = StoreDatabase(pathname, cache)
+        db.open(use_axi=False, use_agent=False)
+        bench = Benchmark(options.repeat)
+        run_benchmarks(bench, db, cache)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    data = {"meta": {"size": options.size,
+                     "seed": options.seed,
+                     "repeat": options.repeat,
+                     "docs": len(db),
+                     "build_time": build_time,
+                     "revision": get_revision(),
+                     "python": platform.python_version(),
+                     "xapian": xapian.version_string(),
+                     },
+            "results": bench.results,
+           }
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(data, indent=2, sort_keys=True)
@@ -24,6 +24,14 @@ import os
 import json
 import pickle
 import sys
+import threading
+
+# py3 compat
+try:
+    from queue import Queue
+    Queue  # pyflakes
+except ImportError:
+    from Queue import Queue
 
 from gi.repository import GObject
 
@@ -52,6 +60,12 @@ from softwarecenter.enums import (SOFTWARE_CENTER_NAME_KEYRING,
                                   )
                                   
 from softwarecenter.utils import clear_token_from_ubuntu_sso_sync
+from softwarecenter.backend.piston.httppool import install_http_pool
+from softwarecenter.backend.spawn_helper import (FrameDecoder,
+                                                 pack_frame,
+                                                 write_all,
+                                                 READ_SIZE,
+                                                 )
 
 # the piston import
 from softwarecenter.backend.piston.ubuntusso_pristine import UbuntuSsoAPI
@@ -70,6 +84,9 @@ SoftwareCenterRecommenderAPI.default_service_root =  \
     RECOMMENDER_HOST + "/api/1.0"
 
 
+# reuse the http connections and keep the hot cache entries in memory
+install_http_pool()
+
 RatingsAndReviewsAPI # pyflakes
 UbuntuSsoAPI # pyflakes
 SoftwareCenterAgentAPI # pyflakes
@@ -145,6 +162,135 @@ class SSOLoginHelper(object):
         return token
 
 
+def get_cachedir(ignore_cache):
+    if ignore_cache:
+        return None
+    return os.path.join(SOFTWARE_CENTER_CACHE_DIR, "piston-helper")
+
+
+def get_auth(token):
+    return piston_mini_client.auth.OAuthAuthorizer(
+        token["token"], token["token_secret"],
+        token["consumer_key"], token["consumer_secret"])
+
+
+def serialize(piston_reply, output):
+    if output == "pickle":
+        return pickle.dumps(piston_reply)
+    elif output == "json":
+        return json.dumps(piston_reply)
+    return piston_reply
+
+
+class PistonHelperDaemon(object):
+    """ Run the requests that come as frames on stdin and write the
+        responses to stdout until stdin is closed
+
+        The api objects (and so their http connections) are kept per
+        worker thread and the oauth token is kept for the lifetime of
+        the daemon.
+    """
+
+    NR_WORKERS = 4
+
+    def __init__(self, stdin, stdout):
+        self.stdin = stdin
+        self.stdout = stdout
+        self._write_lock = threading.Lock()
+        self._token = None
+        self._token_lock = threading.Lock()
+        self._local = threading.local()
+        self._requests = Queue()
+
+    def run(self):
+        GObject.threads_init()
+        for i in range(self.NR_WORKERS):
+            t = threading.Thread(target=self._worker,
+                                 name="PistonHelper-%i" % i)
+            t.daemon = True
+            t.start()
+        decoder = FrameDecoder()
+        while True:
+            data = os.read(self.stdin, READ_SIZE)
+            if not data:
+                LOG.debug("stdin closed, exiting")
+                break
+            for request in decoder.feed(data):
+                self._requests.put(request)
+
+    def _worker(self):
+        while True:
+            request = self._requests.get()
+            try:
+                response = self._handle(request)
+            except Exception as e:
+                LOG.exception("request '%s' failed" % request)
+                response = {"status": "error", "data": str(e)}
+            response["id"] = request["id"]
+            self._write(response)
+
+    def _write(self, response):
+        with self._write_lock:
+            try:
+                write_all(self.stdout, pack_frame(response))
+            except OSError:
+                # the parent is gone, stdin gets closed as well
+                pass
+
+    def _get_token(self, parent_xid):
+        with self._token_lock:
+            if self._token is None:
+                helper = SSOLoginHelper(parent_xid)
+                self._token = helper.get_oauth_token_and_verify_sync()
+            return self._token
+
+    def _get_api(self, klass_name, needs_auth, ignore_cache, parent_xid):
+        """ return the (cached) api object of this worker thread """
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = {}
+        if needs_auth:
+            token = self._get_token(parent_xid)
+            if not token:
+                return None
+            key = (klass_name, ignore_cache, token["token"])
+        else:
+            key = (klass_name, ignore_cache, None)
+        if key not in apis:
+            klass = globals()[klass_name]
+            cachedir = get_cachedir(ignore_cache)
+            if needs_auth:
+                apis[key] = klass(cachedir=cachedir, auth=get_auth(token))
+            else:
+                apis[key] = klass(cachedir=cachedir)
+        return apis[key]
+
+    def _handle(self, request):
+        api = self._get_api(request["klass"],
+                            request["needs_auth"],
+                            request["ignore_cache"],
+                            request["parent_xid"] or 0)
+        if api is None:
+            return {"status": "error",
+                    "data": "ERROR: can not obtain a oauth token\n"}
+        f = getattr(api, request["func"])
+        try:
+            piston_reply = f(**request["kwargs"])
+        except (httplib2.ServerNotFoundError, APIError) as e:
+            LOG.warn(e)
+            if request["needs_auth"]:
+                # the token may be invalid by now, verify it again for
+                # the next request
+                with self._token_lock:
+                    self._token = None
+            return {"status": "error", "data": str(e)}
+        if piston_reply is None:
+            LOG.warn("no data")
+            return {"status": "ok", "data": None}
+        return {"status": "ok",
+                "data": serialize(piston_reply, request["output"])}
+
+
 LOG = logging.getLogger(__name__)
 
 if __name__ == "__main__":
@@ -165,8 +311,10 @@ if __name__ == "__main__":
                         help="output result as [pickle|json|text]")
     parser.add_argument("--parent-xid", default=0,
                         help="xid of the parent window")
-    parser.add_argument('klass', help='class to use')
-    parser.add_argument('function', help='function to call')
+    parser.add_argument("--daemon", action="store_true", default=False,
+                        help="run the requests that come on stdin")
+    parser.add_argument('klass', nargs="?", help='class to use')
+    parser.add_argument('function', nargs="?", help='function to call')
     parser.add_argument('kwargs', nargs="?",
                         help='kwargs for the function call as json')
     args = parser.parse_args()
@@ -175,11 +323,19 @@ if __name__ == "__main__":
         logging.basicConfig(level=logging.DEBUG)
         LOG.setLevel(logging.DEBUG)
 
-    if args.ignore_cache:
-        cachedir = None
-    else:
-        cachedir = os.path.join(SOFTWARE_CENTER_CACHE_DIR, "piston-helper")
-        
+    if args.daemon:
+        softwarecenter.paths.datadir = args.datadir
+        # keep stray prints of the libraries out of the responses
+        stdout = os.dup(sys.stdout.fileno())
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        PistonHelperDaemon(sys.stdin.fileno(), stdout).run()
+        sys.exit(0)
+
+    if not args.klass or not args.function:
+        parser.error("klass and function are required")
+
+    cachedir = get_cachedir(args.ignore_cache)
+
     # check what we need to call
     klass = globals()[args.klass]
     func = args.function
@@ -200,10 +356,7 @@ if __name__ == "__main__":
                 pass
             sys.exit(1)
 
-        auth = piston_mini_client.auth.OAuthAuthorizer(
-            token["token"], token["token_secret"],
-            token["consumer_key"], token["consumer_secret"])
-        api = klass(cachedir=cachedir, auth=auth)
+        api = klass(cachedir=cachedir, auth=get_auth(token))
     else:
         api = klass(cachedir=cachedir)
         
@@ -235,12 +388,7 @@ if __name__ == "__main__":
             LOG.debug(s)
 
     # check what format to use
-    if args.output == "pickle":
-        res = pickle.dumps(piston_reply)
-    elif args.output == "json":
-        res = json.dumps(piston_reply)
-    elif args.output == "text":
-        res = piston_reply
+    res = serialize(piston_reply, args.output)
 
     # and output it
     try:
@@ -15,7 +15,9 @@ def show_top_rated_apps():
     # get the ratings
     cache = get_pkg_info()
     loader = get_review_loader(cache)
-    review_stats = loader.REVIEW_STATS_CACHE
+    # the stats are modified below, so work on a plain dict copy
+    review_stats = dict(loader.REVIEW_STATS_CACHE.iteritems())
+    loader.REVIEW_STATS_CACHE = review_stats
     # recalculate using different default power
     results = {}
     for i in [0.5, 0.4, 0.3, 0.2, 0.1, 0.05]: